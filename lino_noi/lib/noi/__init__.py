@@ -8,8 +8,20 @@ The main plugin for Lino Noi.
    :toctree:
 
     models
+    bulkload
+    change_buffer
+    checkpoint
+    export
     fixtures.linotickets
+    gitlog
+    management.commands.ingest_commits
+    management.commands.prep_snapshot
+    management.commands.restore_dump
+    management.commands.startup_report
     migrate
+    roles
+    snapshot
+    startup_profile
     user_types
     workflows
 
@@ -19,5 +31,9 @@ from lino.api.ad import Plugin
 
 
 class Plugin(Plugin):
-    pass
+
+    def post_site_startup(self, site):
+        super(Plugin, self).post_site_startup(site)
+        from lino_noi.lib.noi.roles import build_role_index
+        build_role_index()
 
@@ -0,0 +1,528 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Load Python fixtures and dumps using `bulk_create`.
+
+:class:`BulkLoader` collects model instances per model and writes them
+in batches.  Before writing, the batches are sorted so that every
+model comes after the models it points to.
+
+Instances without a primary key get the next free one of their
+table, because other objects might need it.  Instances of multi-table
+inheritance children and of models whose primary key is not an
+:class:`AutoField` are saved one by one because `bulk_create` doesn't
+support them.
+
+When loading hand-written fixtures (e.g. the demo fixtures), the
+:meth:`save` method of an instance is called as usual, but the call
+of :meth:`save_base` which would write it to the database adds it to
+the pending instances instead.  When loading from a dump
+(:attr:`loading_from_dump <lino.core.site.Site.loading_from_dump>`),
+the `save` methods are expected to not change any data, so they are
+not called at all.
+
+Note that `bulk_create` sends no `pre_save` and `post_save` signals.
+
+When a fixture runs a database query on the table of a pending
+instance, the pending instances are written first, so the fixture
+sees the same data as when every instance would have been saved at
+once.  See :func:`install_query_hook`.
+
+Every instance is validated before being collected, but without
+checking its unique constraints because these would query the table
+of the pending instances.  When the database refuses a batch, its
+instances are saved one by one as without a :class:`BulkLoader`.
+An instance which fails to validate or to save while loading a dump
+is deferred as usual.
+
+When writing into PostgreSQL outside of a transaction, the loader can
+use several worker processes.  Each process writes one group of
+models which don't point to each other.
+
+The module can be used as a serialization module for the ``py``
+format, see :attr:`bulk_load_batch_size
+<lino_noi.lib.noi.settings.Site.bulk_load_batch_size>`.  The same
+setting makes :xfile:`restore.py` use a :class:`BulkLoader`, see
+:func:`install_bulk_loader`.
+
+"""
+
+from __future__ import unicode_literals
+
+import logging
+import multiprocessing
+import re
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db import DatabaseError
+from django.db import models
+from django.core.management.color import no_style
+
+from lino.core.utils import obj2str
+from lino.utils import dpy
+from lino.utils.dpy import DpyDeserializer, FakeDeserializedObject
+
+logger = logging.getLogger(__name__)
+
+
+def overrides_save(model):
+    """Return True if the given model or one of its parents (other than
+    Django's :class:`Model`) defines a :meth:`save` method.
+
+    """
+    for cls in model.__mro__:
+        if cls is models.Model:
+            return False
+        if 'save' in cls.__dict__:
+            return True
+    return False
+
+
+TABLE_NAME = re.compile(
+    r'\b(?:FROM|JOIN|INTO|UPDATE|TABLE|TRUNCATE)\s+[`"]?([\w.$]+)',
+    re.IGNORECASE)
+
+
+def get_table_names(sql):
+    """Return the set of the names of the tables which the given SQL
+    statement reads or writes.
+
+    """
+    return set(TABLE_NAME.findall(sql))
+
+
+def get_dependencies(model):
+    """Return the set of models to which the given model has a foreign
+    key, except itself.
+
+    """
+    deps = set()
+    for f in model._meta.concrete_fields:
+        if f.remote_field is not None:
+            m = f.remote_field.model._meta.concrete_model
+            if m is not model._meta.concrete_model:
+                deps.add(m)
+    return deps
+
+
+def sort_models(model_list):
+    """Return the given models sorted so that every model comes after the
+    models it points to.  Models in a reference cycle are returned in
+    their original order.
+
+    """
+    todo = list(model_list)
+    deps = dict([(m, get_dependencies(m) & set(todo)) for m in todo])
+    done = []
+    while todo:
+        ready = [m for m in todo if not (deps[m] - set(done))]
+        if not ready:
+            # a cycle: the database must check the constraints at commit
+            ready = todo[:1]
+        for m in ready:
+            done.append(m)
+            todo.remove(m)
+    return done
+
+
+def partition_models(model_list):
+    """Split the given models into groups of models which don't point to
+    a model of another group.
+
+    """
+    group_of = dict([(m, set([m])) for m in model_list])
+    for m in model_list:
+        for d in get_dependencies(m):
+            if d in group_of and group_of[d] is not group_of[m]:
+                merged = group_of[m] | group_of[d]
+                for x in merged:
+                    group_of[x] = merged
+    groups = []
+    for m in model_list:
+        if group_of[m] not in groups:
+            groups.append(group_of[m])
+    return [[m for m in model_list if m in g] for g in groups]
+
+
+def write_batches(using, batch_size, batches):
+    """Write the given list of `(model, instances)` tuples in a
+    transaction.  Also used as the job of a worker process.
+
+    """
+    with transaction.atomic(using=using):
+        for model, objects in batches:
+            model.objects.using(using).bulk_create(
+                objects, batch_size=batch_size)
+
+
+def worker_job(args):
+    using, batch_size, batches = args
+    try:
+        write_batches(using, batch_size, batches)
+    finally:
+        connections[using].close()
+    return sum([len(objects) for model, objects in batches])
+
+
+class HookedCursor(object):
+    """Wraps a database cursor and calls a hook with the SQL of every
+    statement before executing it.
+
+    """
+    def __init__(self, cursor, hook):
+        self.cursor = cursor
+        self.hook = hook
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return self.cursor.__exit__(*args)
+
+    def execute(self, sql, params=None):
+        self.hook(sql)
+        return self.cursor.execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.hook(sql)
+        return self.cursor.executemany(sql, param_list)
+
+
+def install_query_hook(conn, hook):
+    """Make the given database connection call `hook(sql)` before
+    executing a statement.  Return a function which removes the hook.
+
+    We don't use :meth:`execute_wrapper` because it is not available
+    in Django 1.11.
+
+    """
+    old = (conn.make_cursor, conn.make_debug_cursor)
+
+    def wrap(make):
+        def wrapped(cursor):
+            return HookedCursor(make(cursor), hook)
+        return wrapped
+
+    conn.make_cursor = wrap(old[0])
+    conn.make_debug_cursor = wrap(old[1])
+
+    def uninstall():
+        conn.make_cursor, conn.make_debug_cursor = old
+    return uninstall
+
+
+class BulkLoader(object):
+    """Collects model instances and writes them in batches.
+
+    `batch_size` is the number of pending instances which causes a
+    flush.  `workers` is the maximum number of worker processes used
+    for writing into PostgreSQL.
+
+    .. attribute:: on_error
+
+        A callable which gets the list of `(model, instances)` tuples
+        when writing them failed with a database error.  If this is
+        `None`, the error is raised.
+
+    .. attribute:: flushes
+
+        The number of batches written so far.
+
+    """
+    on_error = None
+
+    def __init__(self, batch_size=1000, workers=None,
+                 using=DEFAULT_DB_ALIAS):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.using = using
+        self.pending = OrderedDict()
+        self.count = 0
+        self.written = 0
+        self.flushing = False
+        self.flushes = 0
+        self.pool = None
+        self.next_ids = {}
+        self.numbered = set()
+
+    def can_bulk(self, model):
+        return not model._meta.parents
+
+    def can_number(self, model):
+        return isinstance(model._meta.pk, models.AutoField)
+
+    def get_next_id(self, model):
+        """Return the next free primary key of the given model.
+
+        The highest primary key is read from the database when needed
+        for the first time and again after every query on the table
+        by somebody else.
+
+        """
+        pk = self.next_ids.get(model)
+        if pk is None:
+            qs = model.objects.using(self.using)
+            pk = (qs.aggregate(m=models.Max('pk'))['m'] or 0) + 1
+        self.next_ids[model] = pk + 1
+        self.numbered.add(model)
+        return pk
+
+    def add(self, obj):
+        """Add the given instance.  Write it immediately if it cannot wait.
+        """
+        model = obj.__class__
+        if not self.can_bulk(model) or (
+                obj.pk is None and not self.can_number(model)):
+            self.flush()
+            obj.save(using=self.using)
+            return
+        if obj.pk is None:
+            obj.pk = self.get_next_id(model)
+        if settings.SITE.loading_from_dump or not overrides_save(model):
+            self.collect(obj)
+        else:
+            self.save_collected(obj)
+
+    def save_collected(self, obj):
+        """Call the :meth:`save` method of the given instance, but collect
+        the instance instead of writing it.
+
+        """
+        def save_base(*args, **kwargs):
+            self.collect(obj)
+        obj.save_base = save_base
+        try:
+            obj.save(using=self.using)
+        finally:
+            del obj.save_base
+
+    def collect(self, obj):
+        self.pending.setdefault(obj.__class__, []).append(obj)
+        self.count += 1
+        if self.count >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write all pending instances."""
+        if not self.pending or self.flushing:
+            return
+        self.flushing = True
+        try:
+            batches = [(m, self.pending[m])
+                       for m in sort_models(list(self.pending.keys()))]
+            self.pending = OrderedDict()
+            self.written += self.count
+            self.count = 0
+            self.flushes += 1
+            if self.use_workers():
+                self.write_parallel(batches)
+            else:
+                try:
+                    write_batches(self.using, self.batch_size, batches)
+                except DatabaseError:
+                    if self.on_error is None:
+                        raise
+                    self.on_error(batches)
+            self.reset_sequences()
+        finally:
+            self.flushing = False
+
+    def reset_sequences(self):
+        """Make the database sequences (if any) continue after the primary
+        keys we assigned.
+
+        """
+        if not self.numbered:
+            return
+        conn = connections[self.using]
+        sql = conn.ops.sequence_reset_sql(no_style(), list(self.numbered))
+        self.numbered = set()
+        if sql:
+            with conn.cursor() as cursor:
+                for stmt in sql:
+                    cursor.execute(stmt)
+
+    def use_workers(self):
+        if not self.workers or self.workers < 2:
+            return False
+        conn = connections[self.using]
+        return conn.vendor == 'postgresql' and not conn.in_atomic_block
+
+    def write_parallel(self, batches):
+        d = dict(batches)
+        groups = partition_models([m for m, objects in batches])
+        if len(groups) < 2:
+            write_batches(self.using, self.batch_size, batches)
+            return
+        if self.pool is None:
+            # the worker processes must not share our connection
+            connections[self.using].close()
+            self.pool = multiprocessing.Pool(self.workers)
+        jobs = [(self.using, self.batch_size, [(m, d[m]) for m in g])
+                for g in groups]
+        self.pool.map(worker_job, jobs)
+
+    def close(self):
+        """Write all pending instances and stop the worker processes."""
+        self.flush()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def before_query(self, sql):
+        """The query hook (see :func:`install_query_hook`) which writes the
+        pending instances before a statement using one of their
+        tables.
+
+        """
+        if self.flushing or not (self.pending or self.next_ids):
+            return
+        tables = get_table_names(sql)
+        if any([m._meta.db_table in tables for m in self.pending.keys()]):
+            self.flush()
+        for m in list(self.next_ids.keys()):
+            if m._meta.db_table in tables:
+                # somebody else might insert a row
+                del self.next_ids[m]
+
+
+class BulkDeserializedObject(FakeDeserializedObject):
+    """A deserialized object which is added to the :class:`BulkLoader`
+    of its deserializer instead of being saved.
+
+    """
+
+    def try_save(self, *args, **kw):
+        obj = self.object
+        try:
+            m = getattr(obj, 'before_dumpy_save', None)
+            if m is not None:
+                m(self.deserializer)
+            if not self.deserializer.quick:
+                obj.full_clean(validate_unique=False)
+            self.deserializer.bulk.add(obj)
+        except Exception as e:
+            # same as in FakeDeserializedObject.try_save()
+            if not settings.SITE.loading_from_dump:
+                logger.warning("Failed to save %s:" % obj2str(obj))
+                raise
+            deps = [f.remote_field.model for f in obj._meta.fields
+                    if f.remote_field is not None]
+            if not deps:
+                logger.exception(e)
+                raise Exception(
+                    "Failed to save independent %s." % obj2str(obj))
+            self.deserializer.register_failure(self, e)
+            return False
+        self.deserializer.register_success()
+        return True
+
+
+def save_one_by_one(loader):
+    """Return an :attr:`on_error <BulkLoader.on_error>` handler which
+    saves the instances of a refused batch one by one.
+
+    """
+    def on_error(batches):
+        for model, objects in batches:
+            for obj in objects:
+                FakeDeserializedObject(loader, obj).try_save()
+    return on_error
+
+
+class BulkDeserializer(DpyDeserializer):
+    """A :class:`DpyDeserializer <lino.utils.dpy.DpyDeserializer>` which
+    uses a :class:`BulkLoader`.
+
+    """
+    bulk = None
+
+    def deserialize(self, fp, **options):
+        using = options.get('using', DEFAULT_DB_ALIAS)
+        self.bulk = BulkLoader(
+            settings.SITE.bulk_load_batch_size, using=using)
+        self.bulk.on_error = save_one_by_one(self)
+        uninstall = install_query_hook(
+            connections[using], self.bulk.before_query)
+        try:
+            for o in super(BulkDeserializer, self).deserialize(
+                    fp, **options):
+                yield o
+        finally:
+            uninstall()
+
+    def expand(self, obj):
+        for o in super(BulkDeserializer, self).expand(obj):
+            yield BulkDeserializedObject(self, o.object)
+
+    def flush_deferred_objects(self):
+        self.bulk.flush()
+        super(BulkDeserializer, self).flush_deferred_objects()
+        self.bulk.flush()
+
+    def finalize(self):
+        super(BulkDeserializer, self).finalize()
+        self.bulk.close()
+
+
+def install_bulk_loader(loader, batch_size, workers=None,
+                        using=DEFAULT_DB_ALIAS):
+    """Make the given :class:`DpyLoader <lino.utils.dpy.DpyLoader>`
+    collect the instances in a :class:`BulkLoader` instead of saving
+    them one by one.
+
+    The pending instances are written when the :xfile:`restore.py`
+    flushes the deferred objects (i.e. after every model), and when a
+    migrator runs a database query on the table of a pending
+    instance.  When a batch fails to write (e.g. because it refers to
+    an object which has not yet been restored), its instances are
+    saved one by one so that the loader can defer the failing ones as
+    usual.
+
+    """
+    bulk = BulkLoader(batch_size, workers, using=using)
+    base_flush = loader.flush_deferred_objects
+    base_finalize = loader.finalize
+
+    def save(obj):
+        for o in loader.expand(obj):
+            BulkDeserializedObject(loader, o.object).try_save()
+
+    def flush_deferred_objects():
+        bulk.flush()
+        base_flush()
+        bulk.flush()
+
+    def finalize():
+        try:
+            base_finalize()
+            bulk.close()
+        finally:
+            uninstall()
+
+    bulk.on_error = save_one_by_one(loader)
+    loader.bulk = bulk
+    loader.save = save
+    loader.flush_deferred_objects = flush_deferred_objects
+    loader.finalize = finalize
+    uninstall = install_query_hook(connections[using], bulk.before_query)
+
+
+Serializer = dpy.Serializer  # Django requires it in every format module
+
+
+def Deserializer(fp, **options):
+    """The Deserializer used when ``manage.py loaddata`` encounters a
+    `.py` fixture.
+
+    """
+    return BulkDeserializer().deserialize(fp, **options)
@@ -0,0 +1,228 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+"""Coalesces the changes done by a same user on a same object into a
+single :class:`Change <lino.modlib.changes.models.Change>` record.
+
+This is used when :attr:`change_buffer_seconds
+<lino_noi.lib.noi.settings.Site.change_buffer_seconds>` is set.  It
+replaces the :func:`on_update <lino.modlib.changes.models.on_update>`
+receiver of :mod:`lino.modlib.changes` for the models given to
+:func:`install_change_buffer` (tickets and comments).  Changes of
+other models, and changes of type "create" and "delete", are still
+logged as before.
+
+The changes of a same request are collected in memory and written
+when the request has finished.  A change done within a database
+transaction is collected only when the transaction has been
+committed, so changes which are rolled back are not logged.
+
+When the previous change of the same user on the same object has
+been written less than :attr:`change_buffer_seconds` ago by this
+process, we update that record instead of writing a new one.
+
+"""
+
+from __future__ import unicode_literals
+
+import atexit
+import datetime
+import threading
+from collections import OrderedDict
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.signals import request_finished
+from django.db import transaction
+from django.utils import timezone
+
+from lino.api import dd, rt
+from lino.core.signals import on_ui_updated
+from lino.utils.watch import get_master
+
+
+def get_diff(fields):
+    """Return a tuple `(changed_fields, diff)` for the given dict of
+    `(old, new)` values, or `None` if nothing has changed.
+
+    """
+    changed_fields = ''
+    lines = []
+    for k, (old, new) in fields.items():
+        if old == new:
+            continue
+        changed_fields += k + " "
+        lines.append("%s : %s --> %s" % (k, old, new))
+    if len(lines) == 0:
+        return None
+    elif len(lines) == 1:
+        return changed_fields, lines[0]
+    return changed_fields, '- ' + ('\n- '.join(lines))
+
+
+def merge_fields(fields, updates):
+    """Merge the given `(fieldname, old, new)` tuples into the given dict
+    of `(old, new)` values, keeping the first old value.
+
+    """
+    for k, old, new in updates:
+        if k in fields:
+            old = fields[k][0]
+        fields[k] = (old, new)
+
+
+class ChangeBuffer(object):
+    """Holds the pending changes of the current thread and the recently
+    written changes of this process.
+
+    Every entry is keyed by `(user, object)` and holds the first old
+    and the last new value of every changed field.  When a thread has
+    more than `max_size` pending entries, they are written
+    immediately.  At most `max_size` written records are remembered
+    for being updated.
+
+    """
+
+    def __init__(self, seconds, max_size, models):
+        self.seconds = seconds
+        self.max_size = max_size
+        self.models = tuple(models)
+        self.local = threading.local()
+        self.recent = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_pending(self):
+        pending = getattr(self.local, 'pending', None)
+        if pending is None:
+            pending = self.local.pending = OrderedDict()
+        return pending
+
+    def add(self, ar, watcher):
+        obj = watcher.watched
+        master = get_master(obj)
+        if master is None:
+            return
+        cs = obj.change_watcher_spec
+        updates = [(k, dd.obj2str(old), dd.obj2str(new))
+                   for k, old, new in watcher.get_updates(cs.ignored_fields)]
+        if len(updates) == 0:
+            return
+        user_id = None if ar is None else ar.user.pk
+        ct = ContentType.objects.get_for_model(obj.__class__)
+        entry = dict(
+            time=timezone.now(), user_id=user_id,
+            object_type=ct, object_id=obj.pk,
+            master_type=ContentType.objects.get_for_model(master.__class__),
+            master_id=master.pk)
+        key = (user_id, ct.pk, obj.pk)
+        # runs immediately when we are not in a transaction
+        transaction.on_commit(lambda: self.collect(key, entry, updates))
+
+    def collect(self, key, entry, updates):
+        pending = self.get_pending()
+        e = pending.get(key)
+        if e is None:
+            e = pending[key] = dict(entry, fields=OrderedDict())
+        merge_fields(e['fields'], updates)
+        if len(pending) > self.max_size:
+            self.flush()
+
+    def flush(self):
+        """Write the pending changes of the current thread."""
+        pending = self.get_pending()
+        if not pending:
+            return
+        self.local.pending = OrderedDict()
+        limit = timezone.now() - datetime.timedelta(seconds=self.seconds)
+        todo = []
+        with self.lock:
+            for key, e in pending.items():
+                prev = self.recent.pop(key, None)
+                if prev is not None and prev['time'] > limit:
+                    fields = prev['fields']
+                    merge_fields(fields, [
+                        (k, old, new) for k, (old, new)
+                        in e['fields'].items()])
+                    e = dict(prev, fields=fields)
+                todo.append((key, e))
+        # write without holding the lock
+        written = [(key, self.write(e)) for key, e in todo]
+        with self.lock:
+            for key, e in written:
+                if e is not None:
+                    self.recent[key] = e
+            while len(self.recent) > self.max_size:
+                self.recent.popitem(last=False)
+
+    def write(self, e):
+        """Write the given entry and return it with the id of its
+        :class:`Change` record, or `None` if nothing has changed.
+
+        """
+        Change = rt.models.changes.Change
+        ChangeTypes = rt.models.changes.ChangeTypes
+        diff = get_diff(e['fields'])
+        if diff is None:
+            if e.get('id'):
+                Change.objects.filter(pk=e['id']).delete()
+            return None
+        changed_fields, msg = diff
+        if e.get('id'):
+            n = Change.objects.filter(pk=e['id']).update(
+                changed_fields=changed_fields, diff=msg)
+            if n:
+                return e
+        c = Change(
+            type=ChangeTypes.update, time=e['time'], user_id=e['user_id'],
+            object_type=e['object_type'], object_id=e['object_id'],
+            master_type=e['master_type'], master_id=e['master_id'],
+            changed_fields=changed_fields, diff=msg)
+        c.save()
+        return dict(e, id=c.pk)
+
+
+BUFFER = None
+
+
+def on_update(sender=None, watcher=None, request=None, **kw):
+    if isinstance(watcher.watched, BUFFER.models):
+        BUFFER.add(request, watcher)
+    else:
+        from lino.modlib.changes.models import on_update
+        on_update(sender=sender, watcher=watcher, request=request, **kw)
+
+
+def on_request_finished(sender=None, **kw):
+    BUFFER.flush()
+
+
+def flush_at_exit():
+    if BUFFER is not None:
+        BUFFER.flush()
+
+
+def install_change_buffer(seconds, max_size, models):
+    """Activate the change buffer for the given models."""
+    global BUFFER
+    from lino.modlib.changes import models as changes_models
+    BUFFER = ChangeBuffer(seconds, max_size, models)
+    on_ui_updated.disconnect(changes_models.on_update)
+    on_ui_updated.connect(on_update)
+    request_finished.connect(on_request_finished)
+    atexit.register(flush_at_exit)
+
+
+def uninstall_change_buffer():
+    """Write the pending changes of the current thread and deactivate the
+    change buffer.
+
+    """
+    global BUFFER
+    from lino.modlib.changes import models as changes_models
+    if BUFFER is None:
+        return
+    BUFFER.flush()
+    BUFFER = None
+    on_ui_updated.disconnect(on_update)
+    request_finished.disconnect(on_request_finished)
+    on_ui_updated.connect(changes_models.on_update)
@@ -0,0 +1,201 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Resumable restores of Python dumps.
+
+A Python dump written by :manage:`dump2py` consists of a
+:xfile:`restore.py` file which executes one file per model, in an
+order where every model comes after the models it depends on.  Big
+tables are split into several parts of at most `max_row_count` rows.
+
+:class:`ResumableRestore` executes the same files in the same order,
+but every file runs in a transaction which also stores a
+:class:`RestoreProgress <lino_noi.lib.noi.models.RestoreProgress>`
+row.  When a restore fails (e.g. in a data migration near the end),
+running it again skips the files which have been committed.  The
+database is flushed only when no file of the dump has been committed
+yet.
+
+The loader may defer objects which cannot yet be saved, e.g. because
+they point to an object of a later file.  Deferred objects exist only
+in memory, so the transaction continues over the following files
+until no deferred objects are pending.
+
+Because everything is written within transactions, the
+:attr:`bulk_load_workers
+<lino_noi.lib.noi.settings.Site.bulk_load_workers>` are not used.
+
+"""
+
+from __future__ import unicode_literals, division
+
+import ast
+import os
+import re
+import time
+
+import six
+
+from django.db import transaction, DatabaseError
+
+from lino.api import dd, rt
+from lino.utils.dpy import DpyLoader
+
+PART_RE = re.compile(r'^(.+)_(\d+)\.py$')
+
+
+def get_dump_files(filename):
+    """Return the names of the files executed by the given
+    :xfile:`restore.py`, in their order.
+
+    """
+    with open(filename, 'rb') as f:
+        tree = ast.parse(f.read(), filename)
+    names = []
+    for node in tree.body:
+        if not isinstance(node, ast.FunctionDef) or node.name != 'main':
+            continue
+        for stmt in node.body:
+            call = getattr(stmt, 'value', None)
+            if isinstance(call, ast.Call) \
+               and isinstance(call.func, ast.Name) \
+               and call.func.id == 'execfile' and call.args:
+                arg = call.args[0]
+                name = getattr(arg, 'value', getattr(arg, 's', None))
+                if isinstance(name, six.string_types):
+                    names.append(name)
+    return names
+
+
+def get_table_and_part(filename, filenames):
+    """Return the table name and the part number of the given file of a
+    dump.
+
+    """
+    mo = PART_RE.match(filename)
+    if mo is not None and mo.group(1) + '_1.py' in filenames:
+        return mo.group(1), int(mo.group(2))
+    return filename[:-3], 1
+
+
+class ResumableRestore(object):
+    """Restores the Python dump whose :xfile:`restore.py` is at the given
+    file name.
+
+    """
+    def __init__(self, filename):
+        self.filename = os.path.abspath(filename)
+        self.dump_dir = os.path.dirname(self.filename)
+        self.files = get_dump_files(self.filename)
+        self.globals_dict = None
+        self.loader = None
+
+    def get_committed(self):
+        """Return the set of files which have already been restored."""
+        RestoreProgress = rt.models.noi.RestoreProgress
+        try:
+            return set(RestoreProgress.objects.filter(
+                dump_dir=self.dump_dir).values_list('filename', flat=True))
+        except DatabaseError:
+            # e.g. the table does not exist in an empty database
+            return set()
+
+    def load_restore_module(self):
+        """Execute the :xfile:`restore.py` without running its `main`
+        function and return its global namespace.
+
+        """
+        g = dict(__name__='lino_noi_restore', __file__=self.filename)
+        with open(self.filename, 'rb') as f:
+            code = compile(f.read(), self.filename, 'exec')
+        six.exec_(code, g)
+        return g
+
+    def run(self, restart=False, initdb=None):
+        """Restore the dump.  Resume a previous run unless `restart` is
+        True.
+
+        `initdb` is a callable which flushes the database.  It is
+        called only when the restore starts from the beginning.
+
+        """
+        self.globals_dict = self.load_restore_module()
+        self.loader = loader = DpyLoader(self.globals_dict)
+        committed = set() if restart else self.get_committed()
+        todo = [fn for fn in self.files if fn not in committed]
+        if committed:
+            dd.logger.info(
+                "Resume restore of %s: %d of %d files are done.",
+                self.dump_dir, len(self.files) - len(todo), len(self.files))
+        else:
+            if initdb is not None:
+                initdb()
+            loader.initialize()
+        if not todo and committed:
+            dd.logger.info("Nothing to restore.")
+            return
+
+        os.chdir(self.dump_dir)
+        while True:
+            with transaction.atomic():
+                pending = self.run_group(todo)
+                if not todo:
+                    loader.finalize()
+                rt.models.noi.RestoreProgress.objects.bulk_create(pending)
+            self.log_committed(pending)
+            if not todo:
+                break
+        dd.logger.info("Loaded %d objects", loader.count_objects)
+        self.log_summary()
+
+    def run_group(self, todo):
+        """Execute the next files of the given list until no deferred
+        objects are pending.  Remove them from the list and return an
+        unsaved :class:`RestoreProgress` for each of them.
+
+        """
+        pending = []
+        while todo:
+            pending.append(self.run_file(todo.pop(0)))
+            if not self.loader.save_later:
+                break
+        return pending
+
+    def run_file(self, fn):
+        """Execute the given file of the dump and return an unsaved
+        :class:`RestoreProgress` for it.
+
+        """
+        loader = self.loader
+        table, part = get_table_and_part(fn, self.files)
+        count = loader.count_objects
+        t0 = time.time()
+        self.globals_dict['execfile'](
+            fn, self.globals_dict, dict(loader=loader))
+        bulk = getattr(loader, 'bulk', None)
+        if bulk is not None:
+            bulk.flush()
+        return rt.models.noi.RestoreProgress(
+            dump_dir=self.dump_dir, filename=fn, table=table, part=part,
+            rows=loader.count_objects - count, seconds=time.time() - t0)
+
+    def log_committed(self, pending):
+        for p in pending:
+            dd.logger.info(
+                "Committed %s: %d rows in %.1f seconds (%s rows/s).",
+                p.filename, p.rows, p.seconds,
+                int(p.rows_per_second or 0))
+
+    def log_summary(self):
+        """Log the number of rows and the throughput per model."""
+        totals = {}
+        qs = rt.models.noi.RestoreProgress.objects.filter(
+            dump_dir=self.dump_dir)
+        for p in qs:
+            rows, seconds = totals.get(p.table, (0, 0))
+            totals[p.table] = (rows + p.rows, seconds + p.seconds)
+        for table in sorted(totals, key=lambda t: -totals[t][1]):
+            rows, seconds = totals[table]
+            dd.logger.info(
+                "%s: %d rows in %.1f seconds (%d rows/s)", table, rows,
+                seconds, rows / seconds if seconds else 0)
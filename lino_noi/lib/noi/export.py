@@ -0,0 +1,189 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Streaming exports of big tables.
+
+The :class:`ExportExcelAction
+<lino.modlib.export_excel.models.ExportExcelAction>` of
+:mod:`lino.modlib.export_excel` builds the whole workbook in memory,
+and all rows of the table are loaded into the query cache before the
+first cell is written.  With a few hundred thousand tickets this
+needs more memory than a web worker has.
+
+The actions defined here replace it on the tables of tickets and
+working sessions (:class:`Tickets <lino_xl.lib.tickets.ui.Tickets>`,
+:class:`Sessions <lino_xl.lib.working.ui.Sessions>` and their
+subclasses):
+
+- :class:`StreamingExcelAction` writes the rows through the write-only
+  mode of openpyxl, which doesn't keep the rows in memory, into the
+  same temporary file as the original action.
+
+- :class:`ExportCSVAction` and :class:`ExportTSVAction` write a CSV
+  file or a file of tab-separated values.  This is much faster than
+  writing a workbook.
+
+Both iterate over the rows using :meth:`QuerySet.iterator`, which uses
+a server-side cursor on PostgreSQL and reads
+:attr:`streaming_export_chunk_size
+<lino_noi.lib.noi.settings.Site.streaming_export_chunk_size>` rows at
+a time.
+
+"""
+
+from __future__ import unicode_literals
+
+import csv
+import io
+import os
+
+import six
+from six import text_type
+
+from django.conf import settings
+from django.db.models import Model, QuerySet
+from django.utils.functional import Promise
+
+from etgen.html import iselement, to_rst
+
+from lino.api import _
+from lino.core.choicelists import Choice
+from lino.modlib.export_excel.models import ExportExcelAction, sheet_name
+from lino.utils import IncompleteDate
+from lino.utils.media import TmpMediaFile
+from lino.utils.quantities import Duration
+
+
+def get_cell_value(value):
+    """Convert the given field value into something a spreadsheet cell
+    can hold, like :func:`ar2workbook
+    <lino.modlib.export_excel.models.ar2workbook>` does.
+
+    """
+    if type(value) == bool:
+        return value and 1 or 0
+    if isinstance(value, (Duration, Choice, Promise, Model)):
+        return text_type(value)
+    if iselement(value):
+        return to_rst(value)
+    if isinstance(value, IncompleteDate):
+        if value.is_complete():
+            return value.as_date()
+        return text_type(value)
+    return value
+
+
+def iter_objects(ar):
+    """Yield the rows of the given table request without loading them
+    all into memory.
+
+    """
+    data = ar.data_iterator
+    if not isinstance(data, QuerySet):
+        # virtual tables return a list
+        for obj in data:
+            yield obj
+        return
+    n = settings.SITE.streaming_export_chunk_size
+    if data._prefetch_related_lookups:
+        # `iterator()` ignores prefetch_related
+        start = 0
+        while True:
+            chunk = list(data[start:start + n])
+            for obj in chunk:
+                yield obj
+            if len(chunk) < n:
+                return
+            start += n
+    try:
+        it = data.iterator(chunk_size=n)
+    except TypeError:  # Django < 2.0
+        it = data.iterator()
+    for obj in it:
+        yield obj
+
+
+def iter_rows(ar, column_names=None):
+    """Yield the headers, followed by a list of cell values for every
+    row of the given table request.
+
+    """
+    fields, headers, widths = ar.get_field_info(column_names)
+    atomizers = [col.field._lino_atomizer for col in fields]
+    yield [text_type(h) for h in headers]
+    for obj in iter_objects(ar):
+        yield [get_cell_value(sf.full_value_from_object(obj, ar))
+               for sf in atomizers]
+
+
+class StreamingExcelAction(ExportExcelAction):
+    """Export this table to an `.xlsx` file without keeping the rows in
+    memory.
+
+    """
+    def render(self, ar, file):
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet(sheet_name(ar.get_title()))
+        bold_font = Font(name='Calibri', size=11, bold=True)
+        rows = iter_rows(ar)
+        header = []
+        for h in next(rows):
+            cell = WriteOnlyCell(sheet, value=h)
+            cell.font = bold_font
+            header.append(cell)
+        sheet.append(header)
+        for row in rows:
+            sheet.append(row)
+        workbook.save(file)
+
+
+class ExportCSVAction(ExportExcelAction):
+    """Export this table to a `.csv` file."""
+    label = _("Export to .csv")
+    help_text = _('Export this table as a .csv file')
+    icon_name = None
+    button_text = "CSV"
+    sort_index = -4
+    file_format = 'csv'
+    delimiter = ','
+
+    def run_from_ui(self, ar, **kw):
+        mf = TmpMediaFile(ar, self.file_format)
+        settings.SITE.makedirs_if_missing(os.path.dirname(mf.name))
+        self.render(ar, mf.name)
+        ar.success(open_url=mf.get_url(ar.request))
+
+    def render(self, ar, file):
+        if six.PY2:
+            f = open(file, 'wb')
+        else:
+            f = io.open(file, 'w', encoding='utf-8', newline='')
+        with f:
+            writer = csv.writer(f, delimiter=str(self.delimiter))
+            for row in iter_rows(ar):
+                row = ['' if v is None else text_type(v) for v in row]
+                if six.PY2:
+                    row = [v.encode('utf-8') for v in row]
+                writer.writerow(row)
+
+
+class ExportTSVAction(ExportCSVAction):
+    """Export this table to a `.tsv` file."""
+    label = _("Export to .tsv")
+    help_text = _('Export this table as a file of tab-separated values')
+    button_text = "TSV"
+    sort_index = -3
+    file_format = 'tsv'
+    delimiter = '\t'
+
+
+def install_streaming_exports(*tables):
+    """Replace the export actions of the given tables."""
+    for t in tables:
+        t.export_excel = StreamingExcelAction()
+        t.export_csv = ExportCSVAction()
+        t.export_tsv = ExportTSVAction()
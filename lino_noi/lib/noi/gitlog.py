@@ -0,0 +1,231 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Import the commits of a local git repository into
+:mod:`lino_xl.lib.github`.
+
+Unlike the import actions of :class:`Repository
+<lino_xl.lib.github.models.Repository>`, which ask the GitHub API
+for every page of 100 commits, the :class:`CommitIngester` reads the
+output of ``git log`` on a local clone of the repository.  It doesn't
+need network access.
+
+The ingester
+
+- streams the output of ``git log``, so the history is never loaded
+  into memory as a whole,
+
+- finds the ticket references in the commit message using the
+  :attr:`ticket_pattern <lino_xl.lib.github.Plugin.ticket_pattern>`
+  of the plugin,
+
+- writes the commits in batches: a single query per batch to find
+  the existing commits and the referenced tickets, and a single bulk
+  insert of the new commits,
+
+- stores the last imported commit of every repository in a
+  :class:`CommitWatermark <lino_noi.lib.noi.models.CommitWatermark>`
+  so that the next run reads only the commits made since then.
+
+Commit authors are mapped to users by their email address or, for
+GitHub's noreply addresses, by their :attr:`github_username`.  Commits without a ticket reference are not
+assigned to a ticket.
+
+See also :manage:`ingest_commits`.
+
+"""
+
+from __future__ import unicode_literals
+
+import codecs
+import json
+import subprocess
+
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from lino.api import dd, rt
+
+FIELD_SEP = '\x1f'
+RECORD_SEP = '\x1e'
+LOG_FIELDS = ('sha', 'author_name', 'author_email', 'committer_name',
+              'committer_email', 'date', 'message')
+LOG_FORMAT = FIELD_SEP.join(
+    ['%H', '%an', '%ae', '%cn', '%ce', '%cI', '%B']) + RECORD_SEP
+NOREPLY_DOMAIN = 'users.noreply.github.com'
+
+
+def run_git(path, *args):
+    """Run the given git command in the given repository and return its
+    output without the trailing newline.
+
+    """
+    out = subprocess.check_output(['git', '-C', path] + list(args))
+    return out.decode('utf-8').strip()
+
+
+def is_ancestor(path, sha, rev):
+    return subprocess.call(
+        ['git', '-C', path, 'merge-base', '--is-ancestor', sha, rev]) == 0
+
+
+def parse_record(record):
+    """Return a dict for the given record of the ``git log`` output."""
+    values = record.lstrip('\n').split(FIELD_SEP)
+    if len(values) != len(LOG_FIELDS):
+        raise Exception("Invalid git log record {!r}".format(record))
+    return dict(zip(LOG_FIELDS, values))
+
+
+def iter_log(path, rev_range, chunk_size=64 * 1024):
+    """Yield a dict for every commit in the given revision range, newest
+    first.
+
+    """
+    p = subprocess.Popen(
+        ['git', '-C', path, 'log', '--format=' + LOG_FORMAT, rev_range],
+        stdout=subprocess.PIPE)
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    buf = ''
+    try:
+        while True:
+            chunk = p.stdout.read(chunk_size)
+            if not chunk:
+                break
+            buf += decoder.decode(chunk)
+            records = buf.split(RECORD_SEP)
+            buf = records.pop()
+            for r in records:
+                yield parse_record(r)
+    finally:
+        p.stdout.close()
+        rc = p.wait()
+    if rc != 0:
+        raise subprocess.CalledProcessError(rc, 'git log')
+
+
+class CommitIngester(object):
+    """Imports the commits of the local clone at `path` into the given
+    :class:`Repository <lino_xl.lib.github.models.Repository>`.
+
+    """
+    def __init__(self, repository, path, branch='HEAD', batch_size=500):
+        self.repository = repository
+        self.path = path
+        self.branch = branch
+        self.batch_size = batch_size
+        self.ticket_pattern = dd.plugins.github.ticket_pattern
+        self.users = None
+        self.created = 0
+        self.linked = 0
+
+    def get_users(self):
+        """Return a dict which maps email addresses and GitHub user names
+        to users.
+
+        """
+        if self.users is None:
+            self.users = dict()
+            qs = rt.models.users.User.objects.all()
+            for u in qs.only('id', 'email', 'github_username'):
+                if u.email:
+                    self.users[u.email.lower()] = u
+                if u.github_username:
+                    self.users[u.github_username] = u
+        return self.users
+
+    def find_user(self, d):
+        users = self.get_users()
+        for k in (d['author_email'].lower(), d['committer_email'].lower()):
+            u = users.get(k)
+            if u is not None:
+                return u
+        # GitHub's noreply addresses contain the user name, e.g.
+        # 12345+octocat@users.noreply.github.com
+        local, domain = d['author_email'].rpartition('@')[::2]
+        if domain.lower() == NOREPLY_DOMAIN:
+            return users.get(local.split('+')[-1])
+
+    def get_ticket_id(self, message):
+        ids = self.ticket_pattern.findall(message)
+        if ids:
+            return int(ids[0])
+
+    def get_watermark(self):
+        CommitWatermark = rt.models.noi.CommitWatermark
+        wm, created = CommitWatermark.objects.get_or_create(
+            repository_id=self.repository.pk)
+        return wm
+
+    def get_rev_range(self, wm, tip, full=False):
+        if full or not wm.last_sha:
+            return tip
+        if wm.last_sha == tip:
+            return None
+        if not is_ancestor(self.path, wm.last_sha, tip):
+            # history has been rewritten
+            dd.logger.warning(
+                "%s is not an ancestor of %s, reading all commits.",
+                wm.last_sha, tip)
+            return tip
+        return '{}..{}'.format(wm.last_sha, tip)
+
+    def run(self, full=False):
+        """Import the new commits and return their number."""
+        wm = self.get_watermark()
+        tip = run_git(self.path, 'rev-parse', self.branch)
+        rev_range = self.get_rev_range(wm, tip, full)
+        if rev_range is not None:
+            batch = []
+            for d in iter_log(self.path, rev_range):
+                batch.append(d)
+                if len(batch) >= self.batch_size:
+                    self.write_batch(batch)
+                    batch = []
+            self.write_batch(batch)
+        wm.last_sha = tip
+        wm.save()
+        return self.created
+
+    def write_batch(self, batch):
+        """Write the given commits using a few queries."""
+        if not batch:
+            return
+        Commit = rt.models.github.Commit
+        Ticket = rt.models.tickets.Ticket
+        repo = self.repository
+        ticket_ids = dict()
+        for d in batch:
+            ticket_ids[d['sha']] = self.get_ticket_id(d['message'])
+        known_tickets = set(Ticket.objects.filter(
+            pk__in=set(ticket_ids.values())).values_list('pk', flat=True))
+        existing = dict(Commit.objects.filter(
+            sha__in=[d['sha'] for d in batch]).values_list(
+                'sha', 'ticket_id'))
+        new = []
+        with transaction.atomic():
+            for d in batch:
+                sha = d['sha']
+                tid = ticket_ids[sha]
+                if tid not in known_tickets:
+                    tid = None
+                if sha in existing:
+                    if tid is not None and existing[sha] is None:
+                        Commit.objects.filter(sha=sha).update(ticket_id=tid)
+                        self.linked += 1
+                    continue
+                message = d['message'].strip()
+                user = self.find_user(d)
+                new.append(Commit(
+                    repository=repo, sha=sha, user=user, ticket_id=tid,
+                    git_user=user.github_username if user else '',
+                    commiter_name=d['committer_name'][:100],
+                    url="https://github.com/{}/{}/commit/{}".format(
+                        repo.user_name, repo.repo_name, sha),
+                    created=parse_datetime(d['date']),
+                    description=message,
+                    summary=message.split('\n', 1)[0][:100],
+                    comment='', unassignable=False,
+                    data=json.dumps(d)))
+            Commit.objects.bulk_create(new)
+        self.created += len(new)
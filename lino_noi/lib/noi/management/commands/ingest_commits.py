@@ -0,0 +1,78 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Defines the :manage:`ingest_commits` management command:
+
+.. management_command:: ingest_commits
+
+Import the commits of a local clone of a GitHub repository into the
+given :class:`Repository <lino_xl.lib.github.models.Repository>`.
+Only the commits made since the previous run are read.  See
+:mod:`lino_noi.lib.noi.gitlog`.
+
+Usage::
+
+  $ python manage.py ingest_commits lino-framework/book path/to/book
+
+The repository is given as ``user_name/repo_name`` (or
+``user_name:repo_name``) or as its primary key.  A repository which
+doesn't exist is created.
+
+"""
+
+from __future__ import unicode_literals
+
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lino.api import dd, rt
+
+
+class Command(BaseCommand):
+    help = "Import the new commits of a local git repository."
+
+    def add_arguments(self, parser):
+        parser.add_argument('repository',
+                            help="user_name/repo_name or primary key.")
+        parser.add_argument('path', help="The local clone.")
+        parser.add_argument('--branch', dest='branch', default='HEAD',
+                            help="The branch to read (default: HEAD).")
+        parser.add_argument('--batch-size', dest='batch_size', type=int,
+                            default=500,
+                            help="Number of commits written at once.")
+        parser.add_argument('--full', action='store_true', dest='full',
+                            default=False,
+                            help="Read all commits, not only the new ones.")
+
+    def get_repository(self, spec):
+        Repository = rt.models.github.Repository
+        if spec.isdigit():
+            try:
+                return Repository.objects.get(pk=int(spec))
+            except Repository.DoesNotExist:
+                raise CommandError("No repository {}".format(spec))
+        parts = spec.replace(':', '/').split('/', 1)
+        if len(parts) != 2:
+            raise CommandError(
+                "Invalid repository {!r} (expected user_name/repo_name)"
+                .format(spec))
+        user_name, repo_name = parts
+        repo, created = Repository.objects.get_or_create(
+            user_name=user_name, repo_name=repo_name)
+        return repo
+
+    def handle(self, *args, **options):
+        if not dd.is_installed('github'):
+            raise CommandError("The github plugin is not installed.")
+        from lino_noi.lib.noi.gitlog import CommitIngester
+        path = options['path']
+        if not os.path.isdir(path):
+            raise CommandError("No directory {}".format(path))
+        repo = self.get_repository(options['repository'])
+        ing = CommitIngester(repo, path, options['branch'],
+                             options['batch_size'])
+        n = ing.run(options['full'])
+        self.stdout.write(
+            "Imported {} commits into {} ({} existing commits linked "
+            "to a ticket).".format(n, repo, ing.linked))
@@ -0,0 +1,61 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Defines the :manage:`prep_snapshot` management command:
+
+.. management_command:: prep_snapshot
+
+Like :manage:`prep`, but restore the demo database from a snapshot
+when there is one for the current code (see
+:mod:`lino_noi.lib.noi.snapshot`).  Otherwise run :manage:`prep` and
+save a snapshot.
+
+Databases other than SQLite are always prepared using :manage:`prep`.
+
+"""
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from atelier.utils import confirm
+from lino.api import dd
+from lino.management.commands.prep import Command as BaseCommand
+from lino.management.commands.initdb import CommandError
+
+from lino_noi.lib.noi.snapshot import is_supported
+from lino_noi.lib.noi.snapshot import restore_snapshot, save_snapshot
+
+
+class Command(BaseCommand):
+    """Restore the demo database from a snapshot or prepare it and save
+    a snapshot.
+
+    """
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--refresh', action='store_true',
+                            dest='refresh', default=False,
+                            help='Ignore an existing snapshot.')
+
+    def handle(self, *args, **options):
+        using = options.get('database', DEFAULT_DB_ALIAS)
+        refresh = options.pop('refresh', False)
+        if settings.SITE.readonly or not is_supported(using):
+            return super(Command, self).handle(*args, **options)
+        if options.get('interactive'):
+            dbname = settings.DATABASES[using]['NAME']
+            if not confirm("""We are going to flush your database (%s).
+Are you sure (y/n) ?""" % dbname):
+                raise CommandError("User abort.")
+            options.update(interactive=False)
+        if not refresh:
+            fn = restore_snapshot(using)
+            if fn is not None:
+                dd.logger.info("Restored database from snapshot %s.", fn)
+                return
+        super(Command, self).handle(*args, **options)
+        fn = save_snapshot(using)
+        dd.logger.info("Saved snapshot %s.", fn)
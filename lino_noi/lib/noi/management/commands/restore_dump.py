@@ -0,0 +1,51 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Defines the :manage:`restore_dump` management command:
+
+.. management_command:: restore_dump
+
+Restore a Python dump written by :manage:`dump2py`, like running its
+:xfile:`restore.py`, but resume a previous run which has been
+interrupted or has failed.  See :mod:`lino_noi.lib.noi.checkpoint`.
+
+Usage::
+
+  $ python manage.py restore_dump path/to/dump
+
+"""
+
+from __future__ import unicode_literals
+
+import os
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from lino_noi.lib.noi.checkpoint import ResumableRestore
+
+
+class Command(BaseCommand):
+    help = "Restore a Python dump, resuming a previous run."
+
+    def add_arguments(self, parser):
+        parser.add_argument('dump_dir', help="The directory of the dump.")
+        parser.add_argument('--noinput', action='store_false',
+                            dest='interactive', default=True,
+                            help="Don't ask for confirmation before "
+                            "flushing the database.")
+        parser.add_argument('--restart', action='store_true',
+                            dest='restart', default=False,
+                            help="Ignore the progress of a previous run.")
+
+    def handle(self, *args, **options):
+        fn = os.path.join(options['dump_dir'], 'restore.py')
+        if not os.path.exists(fn):
+            raise CommandError("No file {}".format(fn))
+        interactive = options['interactive']
+
+        def initdb():
+            call_command('initdb', interactive=interactive)
+
+        ResumableRestore(fn).run(options['restart'], initdb)
+        call_command('resetsequences')
@@ -0,0 +1,65 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Defines the :manage:`startup_report` management command:
+
+.. management_command:: startup_report
+
+Show how much time each plugin costs when a new process starts up.
+
+The command starts a new Python process which runs
+:func:`django.setup` with the :mod:`startup profiler
+<lino_noi.lib.noi.startup_profile>` activated, and shows the total
+time per plugin from its report.  The plugin times include the
+imports of its modules (on Python 3 only) and its startup hooks.
+
+"""
+
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from lino_noi.lib.noi.startup_profile import ENV_VAR
+
+
+class Command(BaseCommand):
+    help = "Show the startup time of each plugin."
+
+    def handle(self, *args, **options):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fn = os.path.join(tmpdir, 'startup.json')
+            env = dict(os.environ)
+            env[ENV_VAR] = fn
+            proc = subprocess.Popen(
+                [sys.executable, '-c', 'import django; django.setup()'],
+                env=env, stderr=subprocess.PIPE,
+                universal_newlines=True)
+            out = proc.communicate()[1]
+            if proc.returncode or not os.path.exists(fn):
+                raise CommandError(out)
+            with open(fn) as f:
+                report = json.load(f)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        data = report['otherData']
+        lazy = getattr(settings.SITE, 'lazy_plugins', set())
+        rows = sorted(data['plugins_ms'].items(),
+                      key=lambda x: x[1], reverse=True)
+        total = data['total_ms'] or 1
+        self.stdout.write("{:<40} {:>10} {:>6}".format("Plugin", "ms", "%"))
+        for label, ms in rows:
+            if label in lazy:
+                label += " (lazy)"
+            self.stdout.write("{:<40} {:>10.1f} {:>6.1f}".format(
+                label, ms, 100.0 * ms / total))
+        self.stdout.write("{:<40} {:>10.1f}".format("Total", total))
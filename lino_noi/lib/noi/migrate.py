@@ -9,6 +9,11 @@ This module is used because a :ref:`noi` Site has
 :attr:`migration_class <lino.core.site.Site.migration_class>` set to
 ``"lino_noi.lib.migrate.Migrator"``.
 
+The migrators don't save anything themselves: they return or yield
+the instances to be saved by the loader, which writes them in batches
+when :attr:`bulk_load_batch_size
+<lino_noi.lib.noi.settings.Site.bulk_load_batch_size>` is set.
+
 """
 
 from django.conf import settings
@@ -24,6 +29,36 @@ def noop(*args):
 class Migrator(Migrator):
     "The standard migrator for :ref:`noi`."
 
+    def __init__(self, *args, **kwargs):
+        super(Migrator, self).__init__(*args, **kwargs)
+        self.known_ids = {}
+
+    def get_known_ids(self, model):
+        """Return the set of primary keys of the given model which are known
+        to exist.  The set is read once from the database and then
+        maintained by the migrator.
+
+        """
+        ids = self.known_ids.get(model)
+        if ids is None:
+            ids = set(model.objects.values_list('pk', flat=True))
+            self.known_ids[model] = ids
+        return ids
+
+    def exists(self, model, pk):
+        """Return whether the given model has a row with the given primary
+        key, without asking the database once for every row of a dump.
+
+        """
+        ids = self.get_known_ids(model)
+        if pk in ids:
+            return True
+        # the row may have been restored after we read the set
+        if model.objects.filter(pk=pk).exists():
+            ids.add(pk)
+            return True
+        return False
+
     def migrate_from_0_0_1(self, globals_dict):
         """
         - Convert products to topics.
@@ -59,13 +94,12 @@ class Migrator(Migrator):
             kw = dict()
             kw.update(id=id)
             kw.update(topic_id=product_id)
-            try:
-                partner = Partner.objects.get(id=site_id)
-            except Partner.DoesNotExist:
-                partner = Partner(id=site_id, name=str(site_id))
-                partner.save()
-            kw.update(partner=partner)
-            return tickets_Interest(**kw)
+            kw.update(partner_id=site_id)
+            if self.exists(Partner, site_id):
+                return tickets_Interest(**kw)
+            partner = Partner(id=site_id, name=str(site_id))
+            self.get_known_ids(Partner).add(site_id)
+            return (partner, tickets_Interest(**kw))
 
         @override(globals_dict)
         def create_products_productcat(id, name, description):
@@ -3,13 +3,27 @@
 # License: BSD (see file COPYING for details)
 """The :xfile:`models.py` module for :mod:`lino_noi`.
 
-Defines a handler for :data:`lino.modlib.smtpd.signals.mail_received`.
+Defines a handler for :data:`lino.modlib.smtpd.signals.mail_received`
+and the :class:`ChangeArchive`, :class:`RestoreProgress` and
+:class:`CommitWatermark` models and the :class:`ArchivedChangesByMaster`
+table.  Installs the streaming exports of :mod:`lino_noi.lib.noi.export`.
 
 """
 
+import datetime
+import json
+import zlib
+from collections import OrderedDict
 from email.parser import Parser
 
-from lino.api import dd
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from lino.api import dd, rt, _
+from etgen.html import E
+from lino_noi.lib.noi.startup_profile import startup_phase
 # from lino.modlib.smtpd.signals import mail_received
 
 
@@ -29,9 +43,227 @@ from lino.api import dd
 
 @dd.receiver(dd.post_analyze)
 def my_details(sender, **kw):
-    sender.modules.system.SiteConfigs.set_detail_layout("""
-    site_company next_partner_id:10 default_build_method
-    site_calendar simulate_today hide_events_before
-    default_event_type max_auto_events 
-    """)
+    with startup_phase('my_details'):
+        sender.modules.system.SiteConfigs.set_detail_layout("""
+        site_company next_partner_id:10 default_build_method
+        site_calendar simulate_today hide_events_before
+        default_event_type max_auto_events 
+        """)
+
+
+
+def get_archive_days():
+    return getattr(settings.SITE, 'change_archive_days', None)
+
+
+class ChangeArchive(dd.Model):
+    """A compressed block of old :class:`Change
+    <lino.modlib.changes.models.Change>` records of a same master
+    during a same month.
+
+    The records are stored as a zlib-compressed JSON list.  They are
+    shown by :class:`ArchivedChangesByMaster`.  See
+    :attr:`change_archive_days
+    <lino_noi.lib.noi.settings.Site.change_archive_days>`.
+
+    """
+    class Meta:
+        app_label = 'noi'
+        verbose_name = _("Change archive")
+        verbose_name_plural = _("Change archives")
+        unique_together = ('master_type', 'master_id', 'month')
+
+    master_type = dd.ForeignKey(
+        'contenttypes.ContentType', related_name='+')
+    master_id = models.PositiveIntegerField()
+    month = models.DateField(_("Month"))
+    count = models.PositiveIntegerField(_("Count"), default=0)
+    data = models.BinaryField(editable=False, blank=True)
+
+    def __str__(self):
+        return "{} #{} {}".format(
+            self.master_type, self.master_id, self.month.strftime("%Y-%m"))
+
+    def get_records(self):
+        """Return the list of the archived records (dicts)."""
+        if not self.data:
+            return []
+        # some backends return a memoryview
+        return json.loads(zlib.decompress(bytes(self.data)).decode('utf-8'))
+
+    def set_records(self, records):
+        s = json.dumps(records, separators=(',', ':'))
+        self.data = zlib.compress(s.encode('utf-8'), 9)
+        self.count = len(records)
+
+    def get_changes(self):
+        """Yield an unsaved :class:`Change` instance for every archived
+        record.
+
+        """
+        Change = rt.models.changes.Change
+        ChangeTypes = rt.models.changes.ChangeTypes
+        for r in self.get_records():
+            yield Change(
+                id=r['id'], time=parse_datetime(r['time']),
+                type=ChangeTypes.get_by_value(r['type']),
+                user_id=r['user_id'],
+                object_type_id=r['object_type_id'],
+                object_id=r['object_id'],
+                master_type_id=self.master_type_id,
+                master_id=self.master_id,
+                changed_fields=r['changed_fields'], diff=r['diff'])
+
+    @classmethod
+    def archive_changes(cls, before):
+        """Move all changes older than the given timestamp into the
+        archive.  Return the number of archived changes.
+
+        """
+        Change = rt.models.changes.Change
+        qs = Change.objects.filter(time__lt=before, master_id__isnull=False)
+        qs = qs.order_by('master_type', 'master_id', 'time', 'id')
+        groups = OrderedDict()
+        n = 0
+        for c in qs.iterator():
+            month = c.time.date().replace(day=1)
+            k = (c.master_type_id, int(c.master_id), month)
+            if k not in groups and len(groups) >= 100:
+                cls.write_groups(groups)
+                groups = OrderedDict()
+            groups.setdefault(k, []).append(c)
+            n += 1
+        cls.write_groups(groups)
+        return n
+
+    @classmethod
+    def write_groups(cls, groups):
+        Change = rt.models.changes.Change
+        with transaction.atomic():
+            for (mt, mid, month), changes in groups.items():
+                obj, created = cls.objects.get_or_create(
+                    master_type_id=mt, master_id=mid, month=month)
+                records = obj.get_records()
+                for c in changes:
+                    records.append(dict(
+                        id=c.id, time=c.time.isoformat(),
+                        type=c.type.value, user_id=c.user_id,
+                        object_type_id=c.object_type_id,
+                        object_id=c.object_id,
+                        changed_fields=c.changed_fields, diff=c.diff))
+                obj.set_records(records)
+                obj.save()
+                Change.objects.filter(
+                    id__in=[c.id for c in changes]).delete()
+
+
+class RestoreProgress(dd.Model):
+    """Records that one file of a Python dump has been restored by
+    :manage:`restore_dump`, together with the number of objects and
+    the time it took.  See :mod:`lino_noi.lib.noi.checkpoint`.
+
+    """
+    class Meta:
+        app_label = 'noi'
+        verbose_name = _("Restore progress")
+        verbose_name_plural = _("Restore progress")
+        unique_together = ('dump_dir', 'filename')
+
+    dump_dir = models.CharField(_("Dump"), max_length=250)
+    filename = models.CharField(_("File"), max_length=200)
+    table = models.CharField(_("Table"), max_length=200)
+    part = models.PositiveIntegerField(_("Part"), default=1)
+    rows = models.PositiveIntegerField(_("Rows"), default=0)
+    seconds = models.FloatField(_("Seconds"), default=0)
+    finished = models.DateTimeField(_("Finished"), default=timezone.now)
+
+    def __str__(self):
+        return "{} ({} rows in {:.1f} s)".format(
+            self.filename, self.rows, self.seconds)
+
+    @property
+    def rows_per_second(self):
+        if not self.seconds:
+            return None
+        return self.rows / self.seconds
+
+
+class CommitWatermark(dd.Model):
+    """The last commit of a repository which has been imported by
+    :manage:`ingest_commits`.  See :mod:`lino_noi.lib.noi.gitlog`.
+
+    """
+    class Meta:
+        app_label = 'noi'
+        verbose_name = _("Commit watermark")
+        verbose_name_plural = _("Commit watermarks")
+
+    # not a ForeignKey because the github plugin is optional
+    repository_id = models.IntegerField(_("Repository"), unique=True)
+    last_sha = models.CharField(_("Last commit"), max_length=40, blank=True)
+    modified = models.DateTimeField(_("Modified"), auto_now=True)
+
+    def __str__(self):
+        return "{} @ {}".format(self.repository_id, self.last_sha)
+
+
+class ArchivedChangesByMaster(dd.Table):
+    """Shows the archived changes of the master object, one row per
+    month, newest first.
+
+    Only the archives of the displayed page are decompressed.  The
+    recent changes are shown by :class:`ChangesByMaster
+    <lino.modlib.changes.models.ChangesByMaster>`.
+
+    """
+    model = 'noi.ChangeArchive'
+    master = dd.Model
+    label = _("Archived changes")
+    required_roles = dd.login_required()
+    editable = False
+    order_by = ['-month']
+    column_names = 'month count changes'
+
+    @classmethod
+    def get_filter_kw(self, ar, **kw):
+        mi = ar.master_instance
+        if mi is None:
+            return None
+        kw.update(
+            master_type=rt.models.contenttypes.ContentType.objects.get_for_model(
+                mi.__class__),
+            master_id=mi.pk)
+        return kw
+
+    @dd.displayfield(_("Changes"))
+    def changes(self, obj, ar):
+        items = []
+        for c in obj.get_changes():
+            items.append(E.li(
+                "{} {} {}: ".format(
+                    dd.fdl(c.time.date()), c.time.strftime("%H:%M"),
+                    c.user or ''),
+                c.diff))
+        return E.ul(*items)
+
+
+if dd.is_installed('export_excel'):
+
+    from lino_xl.lib.tickets.ui import Tickets
+    from lino_noi.lib.noi.export import install_streaming_exports
+
+    install_streaming_exports(Tickets)
+    if dd.is_installed('working'):
+        from lino_xl.lib.working.ui import Sessions
+        install_streaming_exports(Sessions)
+
 
+@dd.schedule_daily()
+def archive_old_changes():
+    days = get_archive_days()
+    if days is None or not dd.is_installed('changes'):
+        return
+    before = timezone.now() - datetime.timedelta(days=days)
+    n = ChangeArchive.archive_changes(before)
+    if n:
+        dd.logger.info("Archived %d changes older than %s.", n, before)
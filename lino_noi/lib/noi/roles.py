@@ -0,0 +1,63 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+"""A precomputed index of which user types have which roles.
+
+The index is built by the :meth:`post_site_startup
+<lino_noi.lib.noi.Plugin.post_site_startup>` of the ``noi`` plugin,
+i.e. after the :attr:`user_types_module
+<lino.core.site.Site.user_types_module>` of the site (which may extend
+the user types defined in :mod:`lino_noi.lib.noi.user_types`) has been
+loaded.  When it is needed before that, it gets built upon first
+usage.
+
+"""
+
+import inspect
+
+from lino.modlib.users.choicelists import UserTypes
+
+ROLE_INDEX = None
+"""A dict which maps every role class to the frozenset of the values of
+the user types having that role."""
+
+
+def build_role_index():
+    """Build the :data:`ROLE_INDEX` from the current content of
+    :class:`UserTypes`.
+
+    """
+    global ROLE_INDEX
+    index = dict()
+    for ut in UserTypes.get_list_items():
+        for cls in inspect.getmro(ut.role.__class__):
+            index.setdefault(cls, set()).add(ut.value)
+    ROLE_INDEX = {k: frozenset(v) for k, v in index.items()}
+
+
+def get_user_types_with_role(role):
+    """Return the frozenset of user type values having the given role."""
+    if ROLE_INDEX is None:
+        build_role_index()
+    return ROLE_INDEX.get(role, frozenset())
+
+
+def has_role(ar, role):
+    """Return `True` if the user of the given action request has the
+    given role.
+
+    Same as ``ar.get_user().user_type.has_required_roles([role])``
+    but does a set lookup instead of walking through the class
+    hierarchy, and remembers the answer for the lifetime of the
+    request.
+
+    """
+    ut = ar.get_user().user_type
+    if ut is None:
+        return False
+    memo = ar.__dict__.setdefault('_role_memo', dict())
+    k = (ut.value, role)
+    if k not in memo:
+        memo[k] = ut.value in get_user_types_with_role(role)
+    return memo[k]
@@ -9,6 +9,15 @@ Base Django settings for Lino Noi applications.
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import os
+import sys
+
+from lino_noi.lib.noi.startup_profile import get_profiler, startup_phase
+from lino_noi.lib.noi.startup_profile import connect_signals
+
+# start recording the imports before importing lino
+get_profiler()
+
 from lino.projects.std.settings import *
 from lino.api.ad import _
 from lino_noi import SETUP_INFO
@@ -41,6 +50,125 @@ class Site(Site):
 
     auto_configure_logger_names = "atelier django lino lino_xl lino_noi"
 
+    change_buffer_seconds = None
+    """If this is set, changes done by a same user on a same ticket or
+    comment during the given number of seconds are logged as a single
+    :class:`Change <lino.modlib.changes.models.Change>`.  See
+    :mod:`lino_noi.lib.noi.change_buffer`.
+
+    """
+
+    change_buffer_size = 1000
+    """The maximum number of pending changes per thread, and of recently
+    written changes, to hold in memory when :attr:`change_buffer_seconds`
+    is set.
+
+    """
+
+    change_archive_days = None
+    """If this is set, changes older than the given number of days are
+    moved every night into the compressed
+    :class:`ChangeArchive <lino_noi.lib.noi.models.ChangeArchive>`.
+    The archived changes are shown by :class:`ArchivedChangesByMaster
+    <lino_noi.lib.noi.models.ArchivedChangesByMaster>`.
+
+    """
+
+    bulk_load_batch_size = None
+    """If this is set, Python fixtures and Python dumps are loaded using
+    `bulk_create` with batches of the given size.  See
+    :mod:`lino_noi.lib.noi.bulkload`.
+
+    """
+
+    bulk_load_workers = None
+    """The maximum number of worker processes to use when restoring a
+    Python dump into PostgreSQL.  Used only when
+    :attr:`bulk_load_batch_size` is set.
+
+    """
+
+    lazy_plugins = frozenset(['export_excel', 'weasyprint', 'appypod'])
+    """The plugins which define no database models and are needed only
+    for serving web requests or printing documents.  They are not
+    installed when running one of the :attr:`light_commands`.  Every
+    name in this set must be yielded by :meth:`get_installed_apps`.
+
+    Run :manage:`startup_report` to see what each plugin costs at
+    startup.
+
+    """
+
+    light_commands = frozenset([
+        'check', 'migrate', 'showmigrations',
+        'rebuild_fulltext', 'ingest_commits'])
+    """The management commands which run without the
+    :attr:`lazy_plugins`.  These are Django's commands for checking
+    and migrating the database and the commands of Lino Noi which
+    don't print or export anything.
+
+    Don't add commands which may load printable objects (e.g.
+    :manage:`checkdata` or :manage:`linod`): :mod:`weasyprint
+    <lino.modlib.weasyprint>` and :mod:`appypod <lino_xl.lib.appypod>`
+    register the build methods which are stored in the database (and
+    one of them is the :attr:`default_build_method`).
+
+    """
+
+    streaming_export_chunk_size = 2000
+    """The number of rows read at once when exporting a table of tickets
+    or sessions.  See :mod:`lino_noi.lib.noi.export`.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        p = get_profiler()
+        if p is not None:
+            connect_signals(p)
+        with startup_phase('Site.__init__'):
+            super(Site, self).__init__(*args, **kwargs)
+
+    def install_settings(self):
+        super(Site, self).install_settings()
+        if self.bulk_load_batch_size:
+            self.update_settings(SERIALIZATION_MODULES={
+                "py": "lino_noi.lib.noi.bulkload",
+            })
+
+    def install_migrations(self, loader):
+        super(Site, self).install_migrations(loader)
+        if self.bulk_load_batch_size:
+            from lino_noi.lib.noi.bulkload import install_bulk_loader
+            install_bulk_loader(
+                loader, self.bulk_load_batch_size, self.bulk_load_workers)
+
+    def load_plugins(self):
+        with startup_phase('load_plugins'):
+            super(Site, self).load_plugins()
+        p = get_profiler()
+        if p is not None:
+            p.watch_plugins(self.installed_plugins)
+
+    def is_light_process(self):
+        """Return True if this process runs one of the
+        :attr:`light_commands`.
+
+        """
+        argv = sys.argv
+        if len(argv) < 2:
+            return False
+        prog = os.path.basename(argv[0])
+        if prog not in ('manage.py', 'django-admin', 'django-admin.py'):
+            return False
+        return argv[1] in self.light_commands
+
+    def get_apps_modifiers(self, **kw):
+        kw = super(Site, self).get_apps_modifiers(**kw)
+        if self.is_light_process():
+            for k in self.lazy_plugins:
+                kw.setdefault(k, None)
+        return kw
+
     def get_installed_apps(self):
         """Implements :meth:`lino.core.site.Site.get_installed_apps` for Lino
         Noi.
@@ -94,7 +222,8 @@ class Site(Site):
         yield 'lino_xl.lib.userstats'
 
     def setup_plugins(self):
-        super(Site, self).setup_plugins()
+        with startup_phase('setup_plugins'):
+            super(Site, self).setup_plugins()
         # self.plugins.comments.configure(
         #     commentable_model='tickets.Ticket')
         # self.plugins.skills.configure(
@@ -136,13 +265,21 @@ class Site(Site):
         
 
     def do_site_startup(self):
-        super(Site, self).do_site_startup()
+        with startup_phase('do_site_startup'):
+            super(Site, self).do_site_startup()
 
         from lino.utils.watch import watch_changes as wc
 
-        wc(self.modules.tickets.Ticket, ignore=['_user_cache'])
-        wc(self.modules.comments.Comment, master_key='owner')
-        # wc(self.modules.working.Session, master_key='owner')
+        with startup_phase('watch_changes'):
+            wc(self.modules.tickets.Ticket, ignore=['_user_cache'])
+            wc(self.modules.comments.Comment, master_key='owner')
+            # wc(self.modules.working.Session, master_key='owner')
+
+        if self.change_buffer_seconds:
+            from lino_noi.lib.noi.change_buffer import install_change_buffer
+            install_change_buffer(
+                self.change_buffer_seconds, self.change_buffer_size,
+                [self.modules.tickets.Ticket, self.modules.comments.Comment])
         
         if self.is_installed('votes'):
             wc(self.modules.votes.Vote, master_key='votable')
@@ -0,0 +1,206 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Snapshots of the demo database.
+
+Loading the :attr:`demo_fixtures <lino.core.site.Site.demo_fixtures>`
+takes minutes, mainly because the ``checksummaries`` fixture computes
+all working summaries.  A snapshot is a copy of the database after
+loading them.  It is stored below the :attr:`cache_dir
+<lino.core.site.Site.cache_dir>` and identified by a hash of
+
+- the names of the demo fixtures and the source code of their modules,
+- the database fields of every model,
+- the settings of the site and of its plugins (e.g.
+  :attr:`the_demo_date <lino.core.site.Site.the_demo_date>`), the
+  languages of the site and the versions of the used libraries.
+
+Only settings having a simple value (a string, number, date or a list
+of them) are considered.
+
+Changes in other code which is called by a fixture are not detected.
+Use :manage:`prep_snapshot` with ``--refresh`` after such changes.
+
+Only SQLite databases are supported.  Snapshots are copied using the
+`backup API
+<https://docs.python.org/3/library/sqlite3.html#sqlite3.Connection.backup>`__,
+which also works for in-memory test databases.  Python versions
+before 3.7 have no backup API, there we copy the database file.
+
+"""
+
+from __future__ import unicode_literals
+
+import datetime
+import glob
+import hashlib
+import os
+import shutil
+import sqlite3
+
+import six
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, DEFAULT_DB_ALIAS
+
+SNAPSHOT_SUFFIX = '.sqlite3'
+
+
+def get_fixture_names():
+    names = settings.SITE.demo_fixtures
+    if isinstance(names, six.string_types):
+        names = names.split()
+    return list(names)
+
+
+def get_fixture_dirs():
+    for p in settings.SITE.installed_plugins:
+        yield os.path.join(os.path.dirname(p.app_module.__file__), 'fixtures')
+    for d in getattr(settings, 'FIXTURE_DIRS', []):
+        yield d
+
+
+SIMPLE_TYPES = six.string_types + six.integer_types + (
+    float, bool, type(None), datetime.date)
+
+
+def is_simple(v):
+    if isinstance(v, datetime.datetime):
+        return False  # e.g. the startup time
+    if isinstance(v, (list, tuple, set, frozenset)):
+        return all([is_simple(x) for x in v])
+    return isinstance(v, SIMPLE_TYPES)
+
+
+def get_settings(obj):
+    """Yield a tuple `(name, value)` for every public attribute of the
+    given site or plugin which has a simple value.  Properties are
+    skipped because some of them (e.g. :attr:`site_config
+    <lino.core.site.Site.site_config>`) access the database.
+
+    """
+    for name in sorted(dir(obj)):
+        if name.startswith('_'):
+            continue
+        if isinstance(getattr(obj.__class__, name, None), property):
+            continue
+        try:
+            v = getattr(obj, name)
+        except Exception:
+            continue
+        if is_simple(v):
+            if isinstance(v, (set, frozenset)):
+                v = sorted(v)
+            yield name, v
+
+
+def get_snapshot_key():
+    """Return a hash which changes when the demo database would change.
+    """
+    site = settings.SITE
+    h = hashlib.sha1()
+
+    def add(x):
+        h.update(repr(x).encode('utf-8'))
+
+    names = get_fixture_names()
+    add(names)
+    add([li.django_code for li in site.languages])
+    add(list(get_settings(site)))
+    for p in site.installed_plugins:
+        add((p.app_label, list(get_settings(p))))
+    add(site.version)
+    for lib in site.get_used_libs():
+        add(lib[:2])
+    for d in get_fixture_dirs():
+        for name in names:
+            fn = os.path.join(d, name + '.py')
+            if os.path.exists(fn):
+                add(fn)
+                with open(fn, 'rb') as f:
+                    h.update(f.read())
+    for m in apps.get_models():
+        add(m._meta.label_lower)
+        for f in m._meta.local_fields:
+            add((f.name, f.column, f.get_internal_type(), f.null,
+                 getattr(f, 'max_length', None)))
+    return h.hexdigest()
+
+
+def get_snapshot_dir():
+    return os.path.join(settings.SITE.cache_dir, 'snapshots')
+
+
+def get_snapshot_file(key=None):
+    if key is None:
+        key = get_snapshot_key()
+    return os.path.join(get_snapshot_dir(), key + SNAPSHOT_SUFFIX)
+
+
+def is_supported(using=DEFAULT_DB_ALIAS):
+    return connections[using].vendor == 'sqlite'
+
+
+def save_snapshot(using=DEFAULT_DB_ALIAS):
+    """Save the given database as snapshot and remove older snapshots.
+    Return the name of the snapshot file.
+
+    """
+    fn = get_snapshot_file()
+    d = os.path.dirname(fn)
+    if not os.path.exists(d):
+        os.makedirs(d)
+    tmp = fn + '.tmp'
+    conn = connections[using]
+    if hasattr(sqlite3.Connection, 'backup'):
+        conn.ensure_connection()
+        dst = sqlite3.connect(tmp)
+        try:
+            conn.connection.backup(dst)
+        finally:
+            dst.close()
+    else:
+        conn.close()
+        shutil.copyfile(conn.settings_dict['NAME'], tmp)
+    os.rename(tmp, fn)
+    for old in glob.glob(os.path.join(d, '*' + SNAPSHOT_SUFFIX)):
+        if old != fn:
+            os.remove(old)
+    return fn
+
+
+def restore_snapshot(using=DEFAULT_DB_ALIAS):
+    """Replace the given database by the snapshot if there is one.
+    Return the name of the snapshot file, or `None` if there is no
+    snapshot for the current code.
+
+    Usage example in a test case::
+
+        @classmethod
+        def setUpClass(cls):
+            super(MyTests, cls).setUpClass()
+            if not restore_snapshot():
+                call_command('prep_snapshot', interactive=False)
+
+    """
+    if not is_supported(using):
+        return None
+    fn = get_snapshot_file()
+    if not os.path.exists(fn):
+        return None
+    conn = connections[using]
+    if hasattr(sqlite3.Connection, 'backup'):
+        conn.ensure_connection()
+        src = sqlite3.connect(fn)
+        try:
+            src.backup(conn.connection)
+        finally:
+            src.close()
+    else:
+        conn.close()
+        shutil.copyfile(fn, conn.settings_dict['NAME'])
+    settings.SITE.clear_site_config()
+    ContentType.objects.clear_cache()
+    return fn
@@ -0,0 +1,320 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""A profiler for the startup of a Lino Noi site.
+
+It is active when the environment variable
+:envvar:`LINO_NOI_STARTUP_PROFILE` contains the name of a file.  For
+example::
+
+  $ LINO_NOI_STARTUP_PROFILE=startup.json python manage.py check
+
+The profiler records the wall time and the memory (maximum resident
+set size) of
+
+- the phases of the :class:`Site <lino_noi.lib.noi.settings.Site>`
+  startup (``Site.__init__``, ``load_plugins``, ``setup_plugins``,
+  ``do_site_startup``, the model analysis, the UI build, ...)
+
+- the startup hooks of every plugin
+
+- the import of every Python module (on Python 3)
+
+When the site has started up, it writes a report in the `Trace Event
+Format
+<https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU>`__.
+You can open it in `chrome://tracing` or https://www.speedscope.app
+to see a flame graph.  The ``otherData`` key of the report contains
+the total time per phase and per plugin, which is meant for comparing
+two releases.
+
+"""
+
+from __future__ import unicode_literals
+
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import resource
+except ImportError:  # e.g. on Windows
+    resource = None
+
+ENV_VAR = 'LINO_NOI_STARTUP_PROFILE'
+
+PLUGIN_HOOKS = ('on_site_startup', 'before_analyze', 'on_ui_init',
+                'post_site_startup')
+
+profiler = None
+
+
+def get_maxrss():
+    """Return the maximum resident set size of this process in KiB, or
+    `None` if the platform doesn't tell it.
+
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024  # bytes on macOS
+    return rss
+
+
+class ImportTimer(object):
+    """A meta path finder which records the execution of every module
+    imported from the file system.
+
+    """
+    def __init__(self, profiler):
+        from importlib.machinery import PathFinder
+        self.path_finder = PathFinder
+        self.profiler = profiler
+        self.stack = []
+
+    def find_spec(self, fullname, path, target=None):
+        spec = self.path_finder.find_spec(fullname, path, target)
+        if spec is None or spec.loader is None \
+           or not hasattr(spec.loader, 'exec_module'):
+            return None
+        spec.loader = TimedLoader(self, spec.loader)
+        return spec
+
+
+class TimedLoader(object):
+
+    def __init__(self, timer, loader):
+        self.timer = timer
+        self.loader = loader
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        # The module must not see the wrapper, e.g. pkg_resources
+        # looks up its resource provider by the type of the loader.
+        module.__loader__ = self.loader
+        if module.__spec__ is not None:
+            module.__spec__.loader = self.loader
+        name = module.__name__
+        stack = self.timer.stack
+        with self.timer.profiler.phase(name, 'import', stack=tuple(stack)):
+            stack.append(name)
+            try:
+                self.loader.exec_module(module)
+            finally:
+                stack.pop()
+
+
+class StartupProfiler(object):
+    """Records the timed events of the startup and writes the report.
+
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.t0 = time.time()
+        self.events = []
+        self.pending = {}
+        self.import_timer = None
+        self.plugins = []
+
+    def add_event(self, name, cat, start, rss, **kw):
+        self.events.append(dict(
+            name=name, cat=cat, start=start, end=time.time(),
+            rss_before=rss, rss_after=get_maxrss(), **kw))
+
+    @contextmanager
+    def phase(self, name, cat='site', **kw):
+        """Record the code in this context as one event."""
+        start, rss = time.time(), get_maxrss()
+        try:
+            yield
+        finally:
+            self.add_event(name, cat, start, rss, **kw)
+
+    def begin(self, name, cat='site'):
+        """Start an event which is ended by :meth:`end`.  Used for
+        phases delimited by a pair of signals.
+
+        """
+        self.pending[(name, cat)] = (time.time(), get_maxrss())
+
+    def end(self, name, cat='site'):
+        start = self.pending.pop((name, cat), None)
+        if start is not None:
+            self.add_event(name, cat, *start)
+
+    def wrap(self, obj, attr, name, cat='site'):
+        """Replace the method `attr` of `obj` by a version which records
+        every call as an event.
+
+        """
+        func = getattr(obj, attr)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.phase(name, cat):
+                return func(*args, **kwargs)
+
+        setattr(obj, attr, wrapper)
+
+    def install_import_timer(self):
+        if sys.version_info < (3, 4):
+            return
+        self.import_timer = ImportTimer(self)
+        sys.meta_path.insert(0, self.import_timer)
+
+    def uninstall_import_timer(self):
+        if self.import_timer in sys.meta_path:
+            sys.meta_path.remove(self.import_timer)
+
+    def watch_plugins(self, plugins):
+        """Record the startup hooks of the given plugins."""
+        self.plugins = plugins
+        for p in plugins:
+            for hook in PLUGIN_HOOKS:
+                self.wrap(p, hook, "{}.{}".format(p.app_label, hook),
+                          'plugin')
+
+    def get_plugin_label(self, module_name):
+        best = None
+        for p in self.plugins:
+            an = p.app_name
+            if module_name == an or module_name.startswith(an + '.'):
+                if best is None or len(an) > len(best.app_name):
+                    best = p
+        if best is not None:
+            return best.app_label
+
+    def get_owner(self, modules):
+        """Return the label of the plugin which owns the last of the given
+        nested module imports.  A module which belongs to no plugin is
+        owned by the plugin which imported it.
+
+        """
+        owner = None
+        for name in modules:
+            owner = self.get_plugin_label(name) or owner
+        return owner
+
+    def get_totals(self):
+        """Return two dicts which map each phase and each plugin to its
+        total time in milliseconds.
+
+        """
+        phases = {}
+        plugins = {}
+
+        def add(d, k, seconds):
+            d[k] = d.get(k, 0) + seconds * 1000
+
+        imports = [ev for ev in self.events if ev['cat'] == 'import']
+        # the time of a module without the modules it imports
+        children = {}
+        for ev in imports:
+            if ev['stack']:
+                parent = ev['stack'][-1]
+                children[parent] = children.get(parent, 0) + (
+                    ev['end'] - ev['start'])
+        for ev in imports:
+            owner = self.get_owner(ev['stack'] + (ev['name'],))
+            if owner is not None:
+                add(plugins, owner, ev['end'] - ev['start'] -
+                    children.get(ev['name'], 0))
+
+        for ev in self.events:
+            if ev['cat'] == 'site':
+                add(phases, ev['name'], ev['end'] - ev['start'])
+            elif ev['cat'] == 'plugin':
+                add(plugins, ev['name'].split('.')[0],
+                    ev['end'] - ev['start'])
+        return phases, plugins
+
+    def get_report(self):
+        pid = os.getpid()
+        trace = []
+        for ev in self.events:
+            trace.append(dict(
+                name=ev['name'], cat=ev['cat'], ph='X', pid=pid, tid=0,
+                ts=int((ev['start'] - self.t0) * 1e6),
+                dur=int((ev['end'] - ev['start']) * 1e6),
+                args=dict(maxrss_kb=ev['rss_after'],
+                          maxrss_growth_kb=(
+                              ev['rss_after'] - ev['rss_before']
+                              if ev['rss_after'] is not None else None))))
+        phases, plugins = self.get_totals()
+        return dict(
+            traceEvents=trace,
+            displayTimeUnit='ms',
+            otherData=dict(
+                argv=' '.join(sys.argv),
+                total_ms=(time.time() - self.t0) * 1000,
+                maxrss_kb=get_maxrss(),
+                phases_ms=phases,
+                plugins_ms=plugins))
+
+    def write(self):
+        self.uninstall_import_timer()
+        with open(self.filename, 'w') as f:
+            json.dump(self.get_report(), f, indent=1, sort_keys=True)
+
+
+def get_profiler():
+    """Return the :class:`StartupProfiler`, or `None` if startup
+    profiling is not active.
+
+    The first call creates the profiler and starts to record the
+    imports.  This happens when :mod:`lino_noi.lib.noi.settings` is
+    imported.
+
+    """
+    global profiler
+    if profiler is None:
+        filename = os.environ.get(ENV_VAR)
+        if not filename:
+            return None
+        profiler = StartupProfiler(filename)
+        profiler.install_import_timer()
+    return profiler
+
+
+@contextmanager
+def startup_phase(name):
+    """Record the code in this context as a startup phase if startup
+    profiling is active.
+
+    """
+    p = get_profiler()
+    if p is None:
+        yield
+    else:
+        with p.phase(name):
+            yield
+
+
+def connect_signals(p):
+    """Record the phases which are delimited by Lino's startup signals,
+    and write the report when the startup is done.
+
+    """
+    from lino.core import signals
+
+    def connect(signal, func):
+        signal.connect(func, weak=False)
+
+    for name, pre, post in (
+            ('startup', signals.pre_startup, signals.post_startup),
+            ('analyze', signals.pre_analyze, signals.post_analyze),
+            ('ui_build', signals.pre_ui_build, signals.post_ui_build)):
+        connect(pre, lambda sender=None, name=name, **kw: p.begin(name))
+        connect(post, lambda sender=None, name=name, **kw: p.end(name))
+
+    def write_report(sender=None, **kw):
+        p.write()
+
+    # must be connected after the receiver which ends the startup phase
+    connect(signals.post_startup, write_report)
@@ -8,11 +8,16 @@ Lino Noi. Not used in reality.
    :toctree:
 
     models
+    views
+    pagecache
+    management.commands.precompile_templates
     fixtures.linotickets
     migrate
 
 """
 
+import os
+
 from lino.api.ad import Plugin
 
 
@@ -22,8 +27,62 @@ class Plugin(Plugin):
 
     url_prefix = 'noi'
 
+    index_page_size = 50
+    """The number of tickets per page of the public index."""
+
+    stream_buffer_size = 20
+    """The number of template chunks to collect before sending them to
+    the client when a page is streamed."""
+
+    max_queries = None
+    """The maximum number of database queries a page of the public
+    interface may run.
+
+    `None` (the default) means to not count them.  Set this in the
+    settings of a test project to make sure that changes in a
+    template do not cause one query per row or per related object.
+    When a page runs more queries, the view raises an
+    :class:`AssertionError` whose message lists them.
+
+    """
+
+    use_bytecode_cache = False
+    """Whether to store the compiled Jinja templates below the
+    :attr:`cache_dir <lino.core.site.Site.cache_dir>` so that new
+    worker processes don't need to compile them again.
+
+    Run :manage:`precompile_templates` after a deploy to fill the
+    cache before the first request comes in.
+
+    """
+
+    page_cache_timeout = None
+    """The number of seconds to keep a rendered page of the public
+    interface in the Django cache.
+
+    `None` (the default) means to not cache anything.  Cached pages
+    are discarded whenever a ticket, a link, a site, a user or a
+    comment is modified.  Cached responses carry `ETag` and
+    `Last-Modified` headers and answer conditional requests with "304
+    Not Modified".
+
+    """
+
     needs_plugins = ['lino.modlib.bootstrap3']
 
+    def post_site_startup(self, site):
+        super(Plugin, self).post_site_startup(site)
+        if self.use_bytecode_cache and site.cache_dir:
+            from jinja2 import FileSystemBytecodeCache
+            d = self.get_bytecode_cache_dir()
+            if not os.path.exists(d):
+                os.makedirs(d)
+            env = site.plugins.jinja.renderer.jinja_env
+            env.bytecode_cache = FileSystemBytecodeCache(d)
+
+    def get_bytecode_cache_dir(self):
+        return str(self.site.cache_dir.child('jinja_bytecode'))
+
     def on_ui_init(self, ui):
         from .renderer import Renderer
         self.renderer = Renderer(self)
@@ -38,7 +97,8 @@ class Plugin(Plugin):
                 views.Index.as_view(),
                 name='index'),
             url(r'^ticket/(?P<pk>[0-9]+)/$',
-                views.Detail.as_view(model=Ticket)),
+                views.Detail.as_view(
+                    model=Ticket, select_related=('user',))),
             # url('', include('lino.core.urls'))
         ]
 
@@ -0,0 +1,58 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Defines the :manage:`precompile_templates` management command:
+
+.. management_command:: precompile_templates
+
+Compile the Jinja templates of the public interface and the templates
+they extend or include, and store them in the bytecode cache (see
+:attr:`use_bytecode_cache
+<lino_noi.lib.public.Plugin.use_bytecode_cache>`).
+
+"""
+
+from __future__ import unicode_literals
+
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from jinja2 import meta
+
+from lino.api import dd
+from lino_noi.lib import public
+
+
+def get_template_names(root):
+    """Yield the names of all templates below the given directory."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        for fn in filenames:
+            if fn.endswith('.html'):
+                name = os.path.relpath(os.path.join(dirpath, fn), root)
+                yield name.replace(os.sep, '/')
+
+
+class Command(BaseCommand):
+    help = "Compile the templates of the public interface " \
+           "into the Jinja bytecode cache."
+
+    def handle(self, *args, **options):
+        env = dd.plugins.jinja.renderer.jinja_env
+        if env.bytecode_cache is None:
+            raise CommandError("The Jinja bytecode cache is not active.")
+        root = os.path.join(os.path.dirname(public.__file__), 'config')
+        todo = list(get_template_names(root))
+        done = set()
+        while todo:
+            name = todo.pop()
+            if name in done:
+                continue
+            done.add(name)
+            # get_template() writes the bytecode cache
+            env.get_template(name)
+            source = env.loader.get_source(env, name)[0]
+            for ref in meta.find_referenced_templates(env.parse(source)):
+                # ref is None for dynamic names
+                if ref is not None:
+                    todo.append(ref)
+        self.stdout.write("Compiled {} templates.".format(len(done)))
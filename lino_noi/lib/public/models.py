@@ -0,0 +1,37 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Database models for this plugin.
+
+Defines no models, only the receivers which discard the cached
+pages (see :mod:`lino_noi.lib.public.pagecache`).
+
+"""
+
+from django.db.models.signals import post_delete
+
+from lino.api import dd, rt
+
+from lino_noi.lib.tickets.signals import tickets_state_changed
+
+from .pagecache import invalidate_pages
+
+
+@dd.receiver(dd.post_save)
+@dd.receiver(post_delete)
+def discard_cached_pages(sender=None, instance=None, **kw):
+    if not dd.plugins.public.page_cache_timeout:
+        return
+    # the pages show the author, the site and the comments of a ticket
+    if isinstance(instance, (rt.models.tickets.Ticket,
+                             rt.models.tickets.Link,
+                             rt.models.tickets.Site,
+                             rt.models.users.User,
+                             rt.models.comments.Comment)):
+        invalidate_pages()
+
+
+@dd.receiver(tickets_state_changed)
+def discard_pages_after_state_change(sender=None, **kw):
+    if dd.plugins.public.page_cache_timeout:
+        invalidate_pages()
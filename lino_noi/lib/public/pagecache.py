@@ -0,0 +1,110 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""A server-side cache for the rendered pages of the public
+interface.
+
+Every cached page is stored together with its ETag and its
+modification time.  The cache key contains a *generation* number
+which is incremented by :func:`invalidate_pages` whenever a ticket, a
+link, a site, a user or a comment changes, so there is no need to find
+out which pages are affected by a change.
+
+"""
+
+from __future__ import unicode_literals
+
+import calendar
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils import translation
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from lino.api import dd
+
+GENERATION_KEY = 'noi.public.generation'
+
+
+def get_generation():
+    g = cache.get(GENERATION_KEY)
+    if g is None:
+        # a time stamp so that entries cached before the generation
+        # key got evicted are not used again
+        g = int(time.time() * 1000)
+        if not cache.add(GENERATION_KEY, g, None):
+            g = cache.get(GENERATION_KEY, g)
+    return g
+
+
+def invalidate_pages():
+    """Discard all cached pages."""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        # no generation yet, so nothing has been cached
+        pass
+
+
+def is_cacheable(request):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if not dd.plugins.public.page_cache_timeout:
+        return False
+    user = getattr(request, 'user', None)
+    return not getattr(user, 'authenticated', False)
+
+
+def get_page_key(request):
+    return 'noi.public.page.{}.{}.{}'.format(
+        get_generation(), translation.get_language(),
+        hashlib.md5(request.get_full_path().encode('utf-8')).hexdigest())
+
+
+def cached_response(request, build):
+    """Return a response for the given request, using the cached page
+    if possible.
+
+    `build` is a callable which returns a tuple `(html,
+    last_modified)` where `last_modified` is a timestamp or `None`.
+    It is called only when the page is not cached.
+
+    Requests of authenticated users are never cached because the
+    content depends on their permissions.
+
+    """
+    if not is_cacheable(request):
+        html, last_modified = build()
+        return HttpResponse(html)
+    key = get_page_key(request)
+    entry = cache.get(key)
+    if entry is None:
+        html, last_modified = build()
+        etag = quote_etag(hashlib.md5("{}.{}".format(
+            key, last_modified).encode('utf-8')).hexdigest())
+        entry = (etag, last_modified, html)
+        cache.set(key, entry, dd.plugins.public.page_cache_timeout)
+    etag, last_modified, html = entry
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = HttpResponse(html)
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def get_timestamp(dt):
+    """Return the given datetime as seconds since the epoch, or `None`.
+
+    """
+    if dt is None:
+        return None
+    if timezone.is_aware(dt):
+        return calendar.timegm(dt.utctimetuple())
+    return int(time.mktime(dt.timetuple()))
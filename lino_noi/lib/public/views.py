@@ -6,41 +6,208 @@ Views for the public web interface of Lino Noi.
 
 """
 
-from django.http import HttpResponse, Http404
+from contextlib import contextmanager
+
+from django.db import connection
+from django.http import Http404, StreamingHttpResponse
+from django.test.utils import CaptureQueriesContext
 from django.views.generic import View
 
 from lino.core.utils import full_model_name
 from lino.core.requests import BaseRequest
 from lino.api import dd
+from lino.core.constants import URL_PARAM_START
+from lino_noi.lib.tickets.models import URL_PARAM_AFTER, keyset_filter
+from lino_noi.lib.tickets.models import is_ranked
+from .pagecache import cached_response, get_timestamp, is_cacheable
 
 
-def render_from_request(request, template_name, **context):
-    template = dd.plugins.jinja.renderer.jinja_env.get_template(template_name)
-    ar = BaseRequest(
+def make_request(request):
+    return BaseRequest(
         renderer=dd.plugins.public.renderer,
         request=request)
+
+
+def get_template(template_name):
+    return dd.plugins.jinja.renderer.jinja_env.get_template(template_name)
+
+
+def render_from_request(request, template_name, ar=None, **context):
+    template = get_template(template_name)
+    if ar is None:
+        ar = make_request(request)
     context = ar.get_printable_context(**context)
     return template.render(**context)
 
 
+def stream_from_request(request, template_name, ar=None, **context):
+    """Like :func:`render_from_request`, but return an iterator over
+    chunks of the rendered template instead of a string.
+
+    """
+    template = get_template(template_name)
+    if ar is None:
+        ar = make_request(request)
+    context = ar.get_printable_context(**context)
+    stream = template.stream(**context)
+    stream.enable_buffering(dd.plugins.public.stream_buffer_size)
+    return stream
+
+
+@contextmanager
+def count_queries(name):
+    """Raise an :class:`AssertionError` if the code in this context
+    runs more than :attr:`max_queries
+    <lino_noi.lib.public.Plugin.max_queries>` database queries.
+
+    """
+    max_queries = dd.plugins.public.max_queries
+    if max_queries is None:
+        yield
+        return
+    with CaptureQueriesContext(connection) as ctx:
+        yield
+    if len(ctx) > max_queries:
+        raise AssertionError(
+            "{} ran {} database queries (max_queries is {}):\n{}".format(
+                name, len(ctx), max_queries,
+                "\n".join([q['sql'] for q in ctx.captured_queries])))
+
+
 class TemplateView(View):
     template_name = 'detail.html'
     # model = None
     
 
+class TicketPage(object):
+    """The tickets of one page of the public index.
+
+    Becomes the data iterator of the given table request, so that
+    rendering the table iterates over the database rows without
+    loading them into the query cache.  While the table is being
+    rendered, it remembers the last ticket and the newest
+    modification time, so the template can render the cursor link
+    after the table.
+
+    When `offset` is not `None`, the page is selected by its offset
+    instead of a cursor.  This is used for the results of a full-text
+    search, which are sorted by rank.
+
+    """
+    def __init__(self, sar, page_size, offset=None):
+        self.sar = sar
+        self.page_size = page_size
+        self.offset = offset
+        self.count = 0
+        self.last_pk = None
+        self.last_modified = None
+        qs = sar.actor.get_request_queryset(sar).select_related('site')
+        start = offset or 0
+        self.rows = qs[start:start + page_size]
+        # the table request would otherwise run its own query
+        sar._data_iterator = sar._sliced_data_iterator = self
+
+    def __iter__(self):
+        for obj in self.rows.iterator():
+            self.count += 1
+            self.last_pk = obj.pk
+            ts = get_timestamp(obj.modified)
+            if ts is not None and (
+                    self.last_modified is None or ts > self.last_modified):
+                self.last_modified = ts
+            yield obj
+
+    @property
+    def next_after(self):
+        """The value of the cursor parameter for the next page, or `None`
+        if this is the last page or if pages are selected by offset.
+
+        """
+        if self.offset is None and self.count == self.page_size:
+            return self.last_pk
+
+    @property
+    def next_start(self):
+        """The offset of the next page, or `None` if this is the last page
+        or if pages are selected by a cursor.
+
+        """
+        if self.offset is not None and self.count == self.page_size:
+            return self.offset + self.page_size
+
+
 class Index(TemplateView):
+    """The public ticket index.
+
+    Shows :attr:`index_page_size
+    <lino_noi.lib.public.Plugin.index_page_size>` tickets per page,
+    the next page is selected using a cursor (the id of the last
+    ticket) rather than an offset.  The results of a full-text search
+    are sorted by rank, their pages are selected by offset (there are
+    at most :attr:`fulltext_max_results
+    <lino_noi.lib.tickets.Plugin.fulltext_max_results>` of them).  The
+    response is streamed unless it gets cached.
+
+    """
 
     template_name = 'noi/index.html'
 
     def get(self, request):
-        s = render_from_request(request, self.template_name)
-        return HttpResponse(s)
+        q = request.GET.get('q', '')
+        try:
+            after = int(request.GET.get(URL_PARAM_AFTER, 0))
+            start = int(request.GET.get(URL_PARAM_START, 0))
+        except ValueError:
+            raise Http404()
+        if is_cacheable(request):
+            return cached_response(
+                request, lambda: self.build(request, q, after, start))
+        return StreamingHttpResponse(self.stream(request, q, after, start))
+
+    def get_page(self, request, q, after, start):
+        ar = make_request(request)
+        page_size = dd.plugins.public.index_page_size
+        if is_ranked(q):
+            flt = None
+            offset = start
+        else:
+            flt = keyset_filter(after)
+            offset = None
+        sar = ar.spawn(
+            'tickets.Tickets', limit=page_size, quick_search=q or None,
+            filter=flt)
+        return ar, TicketPage(sar, page_size, offset)
+
+    def stream(self, request, q, after, start):
+        # the queries run while the response is being sent, so we
+        # must count them here
+        with count_queries(self.template_name):
+            ar, page = self.get_page(request, q, after, start)
+            for chunk in stream_from_request(
+                    request, self.template_name, ar=ar, q=q, page=page):
+                yield chunk
+
+    def build(self, request, q, after, start):
+        with count_queries(self.template_name):
+            ar, page = self.get_page(request, q, after, start)
+            s = ''.join(stream_from_request(
+                request, self.template_name, ar=ar, q=q, page=page))
+        return s, page.last_modified
 
 
 class Detail(TemplateView):
+    """Shows the detail page of a database object.
+
+    .. attribute:: select_related
+
+        The names of the foreign keys used by the template.  They are
+        loaded in the same query as the object itself.
+
+    """
 
     model = None  # to be specified in views.py
     # template_name = 'noi/detail.html'
+    select_related = ()
 
     def __init__(self, model, *args, **kwargs):
         self.model = model
@@ -48,11 +215,16 @@ class Detail(TemplateView):
         super(TemplateView, self).__init__(*args, **kwargs)
 
     def get(self, request, pk):
-        try:
-            obj = self.model.objects.get(pk=pk)
-        except self.model.DoesNotExist:
-            raise Http404()
-        s = render_from_request(request, self.template_name, obj=obj)
-        return HttpResponse(s)
+        return cached_response(request, lambda: self.build(request, pk))
+
+    def build(self, request, pk):
+        with count_queries(self.template_name):
+            qs = self.model.objects.select_related(*self.select_related)
+            try:
+                obj = qs.get(pk=pk)
+            except self.model.DoesNotExist:
+                raise Http404()
+            s = render_from_request(request, self.template_name, obj=obj)
+        return s, get_timestamp(getattr(obj, 'modified', None))
 
 
@@ -7,6 +7,11 @@
    :toctree:
 
    models
+   fulltext
+   dashboard
+   summaries
+   signals
+   stats
 
 
 """
@@ -16,7 +21,73 @@ from lino_xl.lib.tickets import *
 class Plugin(Plugin):
 
     extends_models = ['Ticket']
+
+    use_search_index = False
+    """Whether the parameter panel of :class:`Tickets` should filter
+    on the :class:`TicketSearchIndex
+    <lino_noi.lib.tickets.models.TicketSearchIndex>` instead of
+    joining the ticket table with its related tables.
+
+    When you set this on an existing site, run :manage:`checkdata`
+    with ``--fix`` to fill the index.
+
+    """
+
+    dashboard_cache_timeout = None
+    """The number of seconds to cache the rendered
+    :class:`MyTicketsToWork` dashboard item of every user.
+
+    `None` (the default) means to not cache it.  The cached item of a
+    user is discarded whenever one of the tickets assigned to this
+    user is modified, so the timeout only matters for changes on
+    related objects (e.g. the name of a site).
+
+    """
     
+    use_incremental_summaries = False
+    """Whether to update the working time summaries whenever a session
+    or a ticket is saved, instead of recomputing all of them every
+    night.  See :mod:`lino_noi.lib.tickets.summaries`.
+
+    When you set this on an existing site, run
+    :manage:`checksummaries` once.
+
+    """
+
+    use_site_stats = False
+    """Whether to maintain a :class:`SiteTicketStats
+    <lino_noi.lib.tickets.models.SiteTicketStats>` row for every site
+    instead of counting its tickets each time a site is displayed.
+    See :mod:`lino_noi.lib.tickets.stats`.
+
+    When you set this on an existing site, run :manage:`checkdata`
+    with ``--fix`` to fill the statistics (or let them be computed
+    when a site is displayed for the first time).
+
+    """
+
+    use_fulltext = False
+    """Whether the quick search of tickets should use a full-text index
+    of their summary, description and comments.  See
+    :mod:`lino_noi.lib.tickets.fulltext`.
+
+    When you set this on an existing site, run
+    :manage:`rebuild_fulltext` once.
+
+    """
+
+    fulltext_backend = 'lino_noi.lib.tickets.fulltext.SQLiteBackend'
+    """The class of the full-text search backend, given as a dotted
+    name.  It must be a subclass of :class:`Backend
+    <lino_noi.lib.tickets.fulltext.Backend>`.
+
+    """
+
+    fulltext_max_results = 1000
+    """The maximum number of tickets returned by a full-text search."""
+
+    _fulltext_backend = None
+
     needs_plugins = [
         'lino_xl.lib.excerpts',
         'lino_xl.lib.topics',
@@ -31,11 +102,30 @@ class Plugin(Plugin):
         m.add_action('tickets.MyTicketsToWork')
 
 
+    def post_site_startup(self, site):
+        super(Plugin, self).post_site_startup(site)
+        if self.use_incremental_summaries and site.is_installed('working'):
+            from .summaries import cancel_nightly_rebuild
+            cancel_nightly_rebuild()
+
+    def get_fulltext_backend(self):
+        """Return the instance of the :attr:`fulltext_backend`."""
+        if self._fulltext_backend is None:
+            from django.utils.module_loading import import_string
+            self._fulltext_backend = import_string(self.fulltext_backend)(
+                self)
+        return self._fulltext_backend
+
     def get_dashboard_items(self, user):
         for i in super(Plugin, self).get_dashboard_items(user):
             yield i
         if user.authenticated:
-            yield self.site.models.tickets.MyTicketsToWork
+            if self.dashboard_cache_timeout:
+                from .dashboard import CachedActorItem
+                yield CachedActorItem(
+                    self.site.models.tickets.MyTicketsToWork)
+            else:
+                yield self.site.models.tickets.MyTicketsToWork
             # else:
             #     yield self.site.models.tickets.   PublicTickets
 
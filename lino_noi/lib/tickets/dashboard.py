@@ -0,0 +1,83 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+"""Defines the :class:`CachedActorItem` dashboard item.
+
+The rendered HTML of a cached item is stored in the Django cache
+under a key which contains a version number per user.  Code which
+modifies a ticket calls :func:`invalidate_dashboard` for the users
+whose dashboard shows that ticket.
+
+"""
+
+from __future__ import unicode_literals
+
+import time
+
+from django.core.cache import cache
+from django.utils import translation
+
+from lino.api import dd
+from lino.core.dashboard import ActorItem
+
+VERSION_KEY = 'noi.dashboard.version.{}'
+
+
+def get_dashboard_version(user_id):
+    """Return the current dashboard version of the given user."""
+    key = VERSION_KEY.format(user_id)
+    v = cache.get(key)
+    if v is None:
+        # Start with a time stamp rather than 1 so that items cached
+        # before the version key got evicted are not used again.
+        v = int(time.time() * 1000)
+        if not cache.add(key, v, None):
+            v = cache.get(key, v)
+    return v
+
+
+def invalidate_dashboard(*user_ids):
+    """Mark the cached dashboard items of the given users as outdated.
+
+    `None` values are ignored, so you can pass e.g. the
+    `assigned_to_id` of a ticket without testing it.
+
+    """
+    if not dd.plugins.tickets.dashboard_cache_timeout:
+        return
+    for user_id in set(user_ids):
+        if user_id is None:
+            continue
+        key = VERSION_KEY.format(user_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # no version yet, so nothing has been cached
+            pass
+
+
+class CachedActorItem(ActorItem):
+    """An :class:`ActorItem <lino.core.dashboard.ActorItem>` whose
+    rendered HTML is cached per user.
+
+    The cache key contains the user who is looking at the dashboard
+    (the workflow buttons depend on the real user, the rows on the
+    user we are acting as), the language and the renderer.
+
+    """
+
+    def render(self, ar):
+        timeout = dd.plugins.tickets.dashboard_cache_timeout
+        user = ar.get_user()
+        if not timeout or user.pk is None:
+            return super(CachedActorItem, self).render(ar)
+        key = 'noi.dashboard.{}.{}.{}.{}.{}.{}'.format(
+            self.name, user.pk, ar.user.pk, translation.get_language(),
+            ar.renderer.__class__.__name__,
+            get_dashboard_version(user.pk))
+        s = cache.get(key)
+        if s is None:
+            s = super(CachedActorItem, self).render(ar)
+            cache.set(key, s, timeout)
+        return s
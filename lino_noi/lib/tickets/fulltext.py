@@ -0,0 +1,174 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+
+"""Full-text search for tickets.
+
+The text of a ticket is its summary, its description and the bodies of
+its comments, stripped of any HTML markup.  The backend to use is
+specified by :attr:`fulltext_backend
+<lino_noi.lib.tickets.Plugin.fulltext_backend>`.
+
+"""
+
+from __future__ import unicode_literals
+
+import os
+import re
+import sqlite3
+import threading
+
+from django.conf import settings
+from django.utils.html import strip_tags
+
+from lino.api import rt
+from lino.core.gfks import gfk2lookup
+
+try:
+    from html import unescape
+except ImportError:  # Python 2
+    from six.moves.html_parser import HTMLParser
+    unescape = HTMLParser().unescape
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(s):
+    """Return a list of the lower-case words in the given HTML or plain
+    text.
+
+    """
+    if not s:
+        return []
+    return TOKEN_RE.findall(unescape(strip_tags(s)).lower())
+
+
+def get_ticket_texts(ticket):
+    """Return a tuple `(summary, description, comments)` with the
+    tokenized texts to be indexed for the given ticket.
+
+    """
+    texts = [ticket.summary, ticket.description]
+    comments = []
+    if settings.SITE.is_installed('comments'):
+        Comment = rt.models.comments.Comment
+        qs = Comment.objects.filter(**gfk2lookup(Comment.owner, ticket))
+        for body in qs.values_list('body', flat=True):
+            comments.extend(tokenize(body))
+    return (' '.join(tokenize(texts[0])),
+            ' '.join(tokenize(texts[1])),
+            ' '.join(comments))
+
+
+class Backend(object):
+    """Base class for full-text search backends."""
+
+    def __init__(self, plugin):
+        self.plugin = plugin
+
+    def index_ticket(self, ticket):
+        """Add or update the given ticket in the index."""
+        raise NotImplementedError()
+
+    def remove_ticket(self, pk):
+        """Remove the ticket with the given primary key from the index."""
+        raise NotImplementedError()
+
+    def search(self, text, limit=None):
+        """Return a list of the primary keys of the tickets matching the
+        given search text, the best matches first.
+
+        """
+        raise NotImplementedError()
+
+    def clear(self):
+        """Remove all tickets from the index."""
+        raise NotImplementedError()
+
+    def rebuild(self, tickets):
+        """Replace the content of the index by the given tickets.
+        Return the number of indexed tickets.
+
+        """
+        self.clear()
+        n = 0
+        for obj in tickets:
+            self.index_ticket(obj)
+            n += 1
+        return n
+
+
+class SQLiteBackend(Backend):
+    """A backend which stores the index in a SQLite FTS5 table in a file
+    :xfile:`tickets_fulltext.sqlite` in the :attr:`cache_dir
+    <lino.core.site.Site.cache_dir>`.  Needs no server.
+
+    Matches on the summary rank higher than those on the description,
+    which rank higher than those in comments.
+
+    """
+    filename = 'tickets_fulltext.sqlite'
+    weights = (10.0, 2.0, 1.0)
+
+    def __init__(self, plugin):
+        super(SQLiteBackend, self).__init__(plugin)
+        self.filename = os.path.join(
+            str(settings.SITE.cache_dir), self.filename)
+        self._local = threading.local()
+
+    def get_connection(self):
+        con = getattr(self._local, 'connection', None)
+        if con is None:
+            con = sqlite3.connect(self.filename)
+            con.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS tickets USING fts5("
+                "summary, description, comments, "
+                "tokenize='unicode61 remove_diacritics 1')")
+            self._local.connection = con
+        return con
+
+    def index_ticket(self, ticket):
+        con = self.get_connection()
+        with con:
+            con.execute("DELETE FROM tickets WHERE rowid=?", (ticket.pk,))
+            con.execute(
+                "INSERT INTO tickets (rowid, summary, description, comments)"
+                " VALUES (?, ?, ?, ?)",
+                (ticket.pk, ) + get_ticket_texts(ticket))
+
+    def remove_ticket(self, pk):
+        con = self.get_connection()
+        with con:
+            con.execute("DELETE FROM tickets WHERE rowid=?", (pk,))
+
+    def clear(self):
+        con = self.get_connection()
+        with con:
+            con.execute("DELETE FROM tickets")
+
+    def rebuild(self, tickets):
+        self.clear()
+        con = self.get_connection()
+        n = 0
+        with con:
+            for obj in tickets:
+                con.execute(
+                    "INSERT INTO tickets (rowid, summary, description, "
+                    "comments) VALUES (?, ?, ?, ?)",
+                    (obj.pk, ) + get_ticket_texts(obj))
+                n += 1
+            con.execute("INSERT INTO tickets(tickets) VALUES ('optimize')")
+        return n
+
+    def search(self, text, limit=None):
+        words = tokenize(text)
+        if len(words) == 0:
+            return []
+        query = ' '.join(['"{}"*'.format(w) for w in words])
+        sql = "SELECT rowid FROM tickets WHERE tickets MATCH ? " \
+              "ORDER BY bm25(tickets, ?, ?, ?)"
+        args = (query, ) + self.weights
+        if limit is not None:
+            sql += " LIMIT ?"
+            args += (limit, )
+        return [row[0] for row in self.get_connection().execute(sql, args)]
@@ -0,0 +1,26 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Defines the :manage:`rebuild_fulltext` management command:
+
+.. management_command:: rebuild_fulltext
+
+Rebuild the full-text search index of all tickets.
+
+"""
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from lino.api import dd, rt
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of all tickets."
+
+    def handle(self, *args, **options):
+        be = dd.plugins.tickets.get_fulltext_backend()
+        qs = rt.models.tickets.Ticket.objects.order_by('id')
+        n = be.rebuild(qs.iterator())
+        self.stdout.write("Indexed {} tickets.".format(n))
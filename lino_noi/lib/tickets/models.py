@@ -6,13 +6,35 @@
 
 Defines a customized :class:`TicketDetail`.
 
+Ticket tables support keyset pagination for API clients (see
+:func:`parse_req`).
+
 """
 from __future__ import print_function
 from lino_xl.lib.tickets.models import *
 from lino.modlib.users.mixins import Assignable
 
+import datetime
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import SuspiciousOperation
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.utils import timezone
+from django.utils import translation
+
+from lino.core import constants
+from lino.core.fields import OneToOneField
+from lino.core.gfks import gfk2lookup
+from lino.modlib.checkdata.choicelists import Checker
 from lino.api import _
 
+from lino_noi.lib.noi.roles import get_user_types_with_role
+from .dashboard import invalidate_dashboard
+from .signals import tickets_state_changed
+from . import summaries
+from . import stats
+
 
 class Ticket(Ticket, Assignable):
     class Meta(Ticket.Meta):
@@ -54,32 +76,815 @@ class Ticket(Ticket, Assignable):
         super(Ticket, self).after_ui_create(ar)
 
         if dd.is_installed('notify'):
-            ctx = dict(user=ar.user, what=ar.obj2memo(self))
-            def msg(user, mm):
-                subject = _("{user} submitted ticket {what}").format(**ctx)
-                return (subject , tostring(E.span(subject)))
+            self.notify_triagers(ar)
 
-            mt = rt.models.notify.MessageTypes.tickets
-            # owner = self.get_change_owner()
-            # rt.models.notify.Message.emit_notification(
-            #     ar, owner, mt, msg, self.get_change_observers())
-            rt.models.notify.Message.emit_notification(
-                ar, self, mt, msg,
-                [(u, u.mail_mode) for u in rt.models.users.User.objects.all()
-                    if u.user_type and u.user_type.has_required_roles(
-                            [Triager])
-                    and u != ar.get_user()
-                 ]
-            )
+    def notify_triagers(self, ar):
+        """Notify all triagers (except the author) about this new ticket.
+
+        The recipients are selected using a single query on their
+        :attr:`user_type`, and the messages are written using a single
+        bulk insert.  Users who have an unseen message about this
+        ticket are skipped.  No mail is sent here: the messages remain
+        unsent until :func:`send_pending_emails_often
+        <lino.modlib.notify.models.send_pending_emails_often>` picks
+        them up in the background.
+
+        """
+        Message = rt.models.notify.Message
+        MailModes = rt.models.notify.MailModes
+        mt = rt.models.notify.MessageTypes.tickets
+        me = ar.get_user()
+        qs = rt.models.users.User.objects.filter(
+            user_type__in=get_user_types_with_role(Triager))
+        if me is not None and me.pk is not None:
+            qs = qs.exclude(pk=me.pk)
+        qs = qs.exclude(mail_mode=MailModes.silent)
+        # like Message.create_message, don't notify users who have an
+        # unseen message about this ticket
+        unseen = Message.objects.filter(
+            seen__isnull=True, **gfk2lookup(Message.owner, self))
+        qs = qs.exclude(pk__in=unseen.values('user_id'))
+
+        ctx = dict(user=ar.user, what=ar.obj2memo(self))
+        subjects = dict()
+        now = timezone.now()
+        messages = []
+        for u in qs:
+            if mt in u.user_type.mask_message_types:
+                continue
+            if u.language not in subjects:
+                with translation.override(u.language):
+                    subject = _("{user} submitted ticket {what}").format(
+                        **ctx)
+                    subjects[u.language] = (
+                        subject, tostring(E.span(subject)))
+            subject, body = subjects[u.language]
+            msg = Message(
+                user=u, owner=self, created=now, subject=subject,
+                body=body, mail_mode=u.mail_mode or MailModes.often,
+                message_type=mt)
+            msg.full_clean()
+            messages.append(msg)
+        if len(messages) == 0:
+            return
+        Message.objects.bulk_create(messages)
+
+        if settings.SITE.use_websockets:
+            # bulk_create() does not set the primary keys on every
+            # backend, so we read them back in one query.
+            qs = Message.objects.filter(
+                created=now, message_type=mt,
+                **gfk2lookup(Message.owner, self))
+            for obj in qs.select_related('user'):
+                obj.send_browser_message(obj.user)
+
+    def get_workflow_buttons(self, ar):
+        """Overrides :meth:`lino.core.model.Model.get_workflow_buttons` in
+        order to check the permission of state transitions only once
+        per request for every combination of state, site, ownership and
+        user type.
+
+        The buttons themselves are still rendered for every row
+        because they contain the primary key.  Workflow actions which
+        are not state transitions (e.g. starting a working session) are
+        checked for every row as before.
+
+        """
+        actor = ar.actor
+        state = actor.get_row_state(self)
+        me = ar.get_user()
+        key = (actor, state, self.site_id is not None,
+               self.user_id == me.pk, self.user_id == ar.user.pk,
+               me.user_type)
+        memo = ar.__dict__.setdefault('_transitions_memo', dict())
+        l = []
+        sep = ''
+        show = True  # whether to show the state
+
+        def show_state():
+            l.append(sep)
+            l.append(E.b(str(state)))
+
+        df = actor.get_disabled_fields(self, ar)
+        for ba in actor.get_actions():
+            if not ba.action.show_in_workflow:
+                continue
+            if ba.action.action_name in df:
+                continue
+            if isinstance(ba.action, dd.ChangeStateAction):
+                k = key + (ba.action.action_name, )
+                ok = memo.get(k)
+                if ok is None:
+                    ok = memo[k] = actor.get_row_permission(
+                        self, ar, state, ba)
+                if not ok:
+                    continue
+                if show:
+                    show_state()
+                    sep = u" \u2192 "
+                    show = False
+            elif not actor.get_row_permission(self, ar, state, ba):
+                continue
+            l.append(sep)
+            l.append(ar.action_button(ba, self))
+            sep = ' '
+        if state and show:
+            show_state()
+        return E.span(*l)
+
+    @classmethod
+    def get_fulltext_ids(cls, search_text):
+        """Return the primary keys of the tickets matching the given quick
+        search text, the best matches first, or `None` if the
+        full-text index is not to be used for this search.
+
+        """
+        if not cls.uses_fulltext(search_text):
+            return None
+        pl = dd.plugins.tickets
+        return pl.get_fulltext_backend().search(
+            search_text, pl.fulltext_max_results)
+
+    @classmethod
+    def uses_fulltext(cls, search_text):
+        """Whether a quick search for the given text uses the full-text
+        index.  This is the case if :attr:`use_fulltext
+        <lino_noi.lib.tickets.Plugin.use_fulltext>` is set, except when
+        searching for a ticket number.
+
+        """
+        if not dd.plugins.tickets.use_fulltext or not search_text:
+            return False
+        return not search_text.lstrip('#').isdigit()
+
+    @classmethod
+    def quick_search_filter(cls, search_text, prefix=''):
+        """Use the full-text index when :meth:`get_fulltext_ids` says so.
+        """
+        ids = None if prefix else cls.get_fulltext_ids(search_text)
+        if ids is None:
+            return super(Ticket, cls).quick_search_filter(
+                search_text, prefix)
+        return models.Q(pk__in=ids)
 
     show_commits = dd.ShowSlaveTable('github.CommitsByTicket')
     show_changes = dd.ShowSlaveTable('changes.ChangesByMaster')
+    show_archived_changes = dd.ShowSlaveTable('noi.ArchivedChangesByMaster')
     # show_wishes = dd.ShowSlaveTable('deploy.DeploymentsByTicket')
     # show_stars = dd.ShowSlaveTable('stars.AllStarsByController')
 
+class TicketSearchIndex(dd.Model):
+    """A denormalised copy of the ticket fields used by the parameter
+    panel of :class:`Tickets`, with composite indexes on the common
+    filter combinations.
+
+    Used only when :attr:`use_search_index
+    <lino_noi.lib.tickets.Plugin.use_search_index>` is set.  Entries
+    are updated whenever a ticket or a site is saved, and deleted
+    together with their ticket.  :class:`TicketSearchIndexChecker`
+    repairs them after changes which send no signals (e.g. queryset
+    updates or restoring a dump).
+
+    The site, company and user are stored as plain integers so that
+    they don't prevent deletion of the objects they refer to.
+
+    """
+    class Meta:
+        app_label = 'tickets'
+        verbose_name = _("Ticket search index entry")
+        verbose_name_plural = _("Ticket search index")
+        index_together = [
+            ('active', 'state'),
+            ('todo', 'state'),
+            ('company_id', 'active'),
+            ('has_site', 'active'),
+            ('assigned_to_id', 'active'),
+            ('private', 'active'),
+            ('active', 'created'),
+            ('active', 'modified')]
+
+    allow_cascaded_delete = ['ticket']
+
+    ticket = OneToOneField(
+        'tickets.Ticket', primary_key=True, related_name='search_index')
+    state = TicketStates.field(blank=True)
+    site_id = models.IntegerField(blank=True, null=True)
+    company_id = models.IntegerField(blank=True, null=True)
+    assigned_to_id = models.IntegerField(blank=True, null=True)
+    has_site = models.BooleanField(default=False)
+    active = models.BooleanField(default=False)
+    todo = models.BooleanField(default=False)
+    private = models.BooleanField(default=False)
+    has_ref = models.BooleanField(default=False)
+    created = models.DateTimeField(blank=True, null=True)
+    modified = models.DateTimeField(blank=True, null=True)
+
+    @classmethod
+    def get_values_for(cls, ticket):
+        """Return a dict with the values of the index entry for the given
+        ticket.
+
+        """
+        site = ticket.site
+        state = ticket.state
+        return dict(
+            state=state,
+            site_id=ticket.site_id,
+            company_id=None if site is None else site.company_id,
+            assigned_to_id=ticket.assigned_to_id,
+            has_site=site is not None,
+            active=state is not None and state.active,
+            todo=state is not None and state.show_in_todo,
+            private=ticket.private,
+            has_ref=ticket.ref is not None,
+            created=ticket.created,
+            modified=ticket.modified)
+
+    @classmethod
+    def update_for(cls, ticket):
+        """Create or update the index entry for the given ticket."""
+        cls.objects.update_or_create(
+            ticket=ticket, defaults=cls.get_values_for(ticket))
+
+    @classmethod
+    def filter_tickets(cls, qs, pv):
+        """Apply the parameter values `pv` to the ticket queryset `qs`
+        using a single query on the index.
+
+        """
+        flt = dict()
+        YesNo = dd.YesNo
+        if pv.observed_event:
+            name = pv.observed_event.name
+            if name in ('created', 'modified'):
+                if pv.start_date:
+                    flt[name + '__gte'] = datetime.datetime.combine(
+                        pv.start_date, datetime.time(0, 0, 0))
+                if pv.end_date:
+                    flt[name + '__lte'] = datetime.datetime.combine(
+                        pv.end_date, datetime.time(23, 59, 59))
+            else:
+                qs = pv.observed_event.add_filter(qs, pv)
+        if pv.interesting_for:
+            flt.update(company_id=pv.interesting_for.pk)
+        if pv.show_assigned == YesNo.no:
+            flt.update(assigned_to_id__isnull=False)
+        elif pv.show_assigned == YesNo.yes:
+            flt.update(assigned_to_id__isnull=True)
+        for k, fld in (('show_active', 'active'), ('show_todo', 'todo'),
+                       ('has_site', 'has_site'),
+                       ('show_private', 'private'),
+                       ('has_ref', 'has_ref')):
+            v = getattr(pv, k)
+            if v == YesNo.no:
+                flt[fld] = False
+            elif v == YesNo.yes:
+                flt[fld] = True
+        idx = cls.objects.filter(**flt)
+        if pv.not_assigned_to:
+            idx = idx.exclude(assigned_to_id=pv.not_assigned_to.pk)
+        if len(flt) or pv.not_assigned_to:
+            qs = qs.filter(pk__in=idx.values('ticket_id'))
+        return qs
+
+
+class TicketSearchIndexChecker(Checker):
+    """Checks whether the :class:`TicketSearchIndex` entry of a ticket
+    is up to date.
+
+    """
+    model = 'tickets.Ticket'
+    verbose_name = _("Check the search index entries of tickets.")
+
+    def get_checkdata_problems(self, obj, fix=False):
+        TicketSearchIndex = rt.models.tickets.TicketSearchIndex
+        try:
+            idx = obj.search_index
+        except TicketSearchIndex.DoesNotExist:
+            yield (True, _("Missing search index entry"))
+            if fix:
+                TicketSearchIndex.update_for(obj)
+            return
+        for k, v in TicketSearchIndex.get_values_for(obj).items():
+            if getattr(idx, k) != v:
+                yield (True, _("Outdated search index entry"))
+                if fix:
+                    TicketSearchIndex.update_for(obj)
+                return
+
+TicketSearchIndexChecker.activate()
+
+
+class SiteTicketStats(dd.Model):
+    """The materialised ticket statistics of a site.  See
+    :mod:`lino_noi.lib.tickets.stats`.
+
+    Besides the fields below, there is one field per ticket state
+    (named by :meth:`get_summary_field
+    <lino_xl.lib.tickets.choicelists.TicketState.get_summary_field>`)
+    with the number of tickets in that state.
+
+    """
+    class Meta:
+        app_label = 'tickets'
+        verbose_name = _("Site ticket statistics")
+        verbose_name_plural = _("Site ticket statistics")
+
+    allow_cascaded_delete = ['site']
+
+    site = OneToOneField(
+        'tickets.Site', primary_key=True, related_name='ticket_stats')
+    open_planned_time = dd.DurationField(
+        _("Open planned time"), blank=True, null=True)
+    last_activity = models.DateTimeField(
+        _("Last activity"), blank=True, null=True)
+
+    @classmethod
+    def get_for_site(cls, site):
+        """Return the statistics of the given site.  Return an unsaved
+        instance when :attr:`use_site_stats
+        <lino_noi.lib.tickets.Plugin.use_site_stats>` is not set.
+        The unsaved instance is cached on the given site object, so the
+        virtual fields of a same row compute it only once.
+
+        """
+        if not dd.plugins.tickets.use_site_stats:
+            obj = getattr(site, stats.CACHE_ATTR, None)
+            if obj is None:
+                obj = cls(site=site, **stats.compute_values(site.pk))
+                setattr(site, stats.CACHE_ATTR, obj)
+            return obj
+        try:
+            return site.ticket_stats
+        except cls.DoesNotExist:
+            return stats.recompute(site.pk)
+
+    def get_state_counts(self):
+        """Yield a tuple `(state, count)` for every state with tickets."""
+        for st in TicketStates.get_list_items():
+            n = getattr(self, st.get_summary_field())
+            if n:
+                yield st, n
+
+
+@dd.receiver(dd.pre_analyze)
+def inject_ticket_stats_fields(sender, **kw):
+    for st in TicketStates.get_list_items():
+        dd.inject_field(
+            SiteTicketStats, st.get_summary_field(),
+            models.IntegerField(st.text, default=0))
+
+    def state_counts(obj, ar):
+        if obj.pk is None:
+            return ''
+        s = SiteTicketStats.get_for_site(obj)
+        return ', '.join(["{}: {}".format(st.text, n)
+                          for st, n in s.get_state_counts()])
+
+    def stats_getter(name):
+        def getter(obj, ar):
+            if obj.pk is None:
+                return None
+            return getattr(SiteTicketStats.get_for_site(obj), name)
+        return getter
+
+    dd.inject_field(Site, 'ticket_states', dd.VirtualField(
+        dd.DisplayField(_("Tickets")), state_counts))
+    dd.inject_field(Site, 'open_planned_time', dd.VirtualField(
+        dd.DurationField(_("Open planned time")),
+        stats_getter('open_planned_time')))
+    dd.inject_field(Site, 'last_ticket_activity', dd.VirtualField(
+        models.DateTimeField(_("Last activity")),
+        stats_getter('last_activity')))
+
+
+class SiteTicketStatsChecker(Checker):
+    """Checks whether the :class:`SiteTicketStats` of a site are up to
+    date.
+
+    """
+    model = 'tickets.Site'
+    verbose_name = _("Check the ticket statistics of sites.")
+
+    def get_checkdata_problems(self, obj, fix=False):
+        if not dd.plugins.tickets.use_site_stats:
+            return
+        try:
+            current = obj.ticket_stats
+        except SiteTicketStats.DoesNotExist:
+            yield (True, _("Missing ticket statistics"))
+            if fix:
+                stats.recompute(obj.pk)
+            return
+        for k, v in stats.compute_values(obj.pk).items():
+            if getattr(current, k) != v:
+                yield (True, _("Outdated ticket statistics"))
+                if fix:
+                    stats.recompute(obj.pk)
+                return
+
+SiteTicketStatsChecker.activate()
+
+
+def use_site_stats():
+    return dd.plugins.tickets.use_site_stats \
+        and not settings.SITE.loading_from_dump
+
+
+@dd.receiver(dd.pre_save)
+def remember_stats_contribution(sender=None, instance=None, **kw):
+    if use_site_stats() and isinstance(instance, rt.models.tickets.Ticket):
+        setattr(instance, stats.ORIGINAL_ATTR,
+                stats.get_original_contribution(instance))
+
+
+@dd.receiver(dd.post_save)
+def update_site_stats(sender=None, instance=None, **kw):
+    if use_site_stats() and isinstance(instance, rt.models.tickets.Ticket):
+        old = getattr(instance, stats.ORIGINAL_ATTR, None)
+        stats.apply_changes(
+            [(old, stats.get_contribution(instance))],
+            instance.modified or timezone.now())
+        setattr(instance, stats.ORIGINAL_ATTR, None)
+
+
+@dd.receiver(post_delete)
+def remove_from_site_stats(sender=None, instance=None, **kw):
+    if use_site_stats() and isinstance(instance, rt.models.tickets.Ticket):
+        stats.apply_changes([(stats.get_contribution(instance), None)])
+
+
+@dd.receiver(tickets_state_changed)
+def update_site_stats_many(sender=None, changes=None, **kw):
+    if use_site_stats():
+        stats.apply_state_change(changes)
+
+
+def sites_queryset(cls, ar, **filter):
+    qs = base_sites_queryset(cls, ar, **filter)
+    if dd.plugins.tickets.use_site_stats:
+        qs = qs.select_related('ticket_stats')
+    return qs
+
+base_sites_queryset = Sites.get_request_queryset.__func__
+Sites.get_request_queryset = classmethod(sites_queryset)
+
+
+class DirtySummary(dd.Model):
+    """Marks the working time summaries of a site and a year as
+    outdated.  See :mod:`lino_noi.lib.tickets.summaries`.
+
+    A `year` of `None` means that only the summary without a year is
+    outdated.
+
+    """
+    class Meta:
+        app_label = 'tickets'
+        verbose_name = _("Outdated summary")
+        verbose_name_plural = _("Outdated summaries")
+        unique_together = ('site_id', 'year')
+
+    site_id = models.IntegerField()
+    year = models.IntegerField(blank=True, null=True)
+
+
+def use_incremental_summaries():
+    return dd.plugins.tickets.use_incremental_summaries \
+        and dd.is_installed('working') \
+        and not settings.SITE.loading_from_dump
+
+
+def is_summarized(obj):
+    # sites because of their reporting type
+    return isinstance(obj, (rt.models.tickets.Ticket,
+                            rt.models.tickets.Site,
+                            rt.models.working.Session))
+
+
+@dd.receiver(dd.pre_save)
+def remember_contributions(sender=None, instance=None, **kw):
+    if use_incremental_summaries() and is_summarized(instance):
+        setattr(instance, summaries.ORIGINAL_ATTR,
+                summaries.get_original(instance))
+
+
+@dd.receiver(dd.post_save)
+def update_summaries(sender=None, instance=None, **kw):
+    if use_incremental_summaries() and is_summarized(instance):
+        old = getattr(instance, summaries.ORIGINAL_ATTR, None)
+        setattr(instance, summaries.ORIGINAL_ATTR, None)
+        summaries.update_summaries(old, instance)
+
+
+@dd.receiver(post_delete)
+def remove_from_summaries(sender=None, instance=None, **kw):
+    if use_incremental_summaries() and is_summarized(instance):
+        try:
+            old = summaries.get_contributions(instance)
+        except ObjectDoesNotExist:
+            # e.g. the ticket of a session has been deleted before
+            return
+        summaries.apply_deltas(old, dict())
+
+
+@dd.receiver(tickets_state_changed)
+def mark_summaries_dirty(sender=None, changes=None, **kw):
+    if use_incremental_summaries():
+        for site_id in set([obj.site_id for obj, old in changes]):
+            summaries.mark_dirty(site_id)
+
+
+@dd.schedule_often(300)
+def recompute_dirty_summaries():
+    if use_incremental_summaries():
+        summaries.update_dirty_summaries()
+
+
+@dd.receiver(dd.post_save)
+def update_search_index(sender=None, instance=None, **kw):
+    if not dd.plugins.tickets.use_search_index:
+        return
+    if settings.SITE.loading_from_dump:
+        return
+    TicketSearchIndex = rt.models.tickets.TicketSearchIndex
+    if isinstance(instance, rt.models.tickets.Ticket):
+        TicketSearchIndex.update_for(instance)
+    elif isinstance(instance, rt.models.tickets.Site):
+        qs = TicketSearchIndex.objects.filter(site_id=instance.pk)
+        if instance.company_id is None:
+            qs = qs.exclude(company_id__isnull=True)
+        else:
+            qs = qs.exclude(company_id=instance.company_id)
+        qs.update(company_id=instance.company_id)
+
+
+@dd.receiver(tickets_state_changed)
+def update_search_index_many(sender=None, changes=None, **kw):
+    if not dd.plugins.tickets.use_search_index:
+        return
+    obj = changes[0][0]
+    rt.models.tickets.TicketSearchIndex.objects.filter(
+        ticket_id__in=[t.pk for t, old in changes]).update(
+            state=obj.state, active=obj.state.active,
+            todo=obj.state.show_in_todo, modified=obj.modified)
+
+
+@dd.receiver(dd.on_ui_updated)
+def invalidate_old_assignee(sender=None, watcher=None, **kw):
+    if isinstance(watcher.watched, rt.models.tickets.Ticket):
+        invalidate_dashboard(watcher.original_state.get('assigned_to_id'))
+
+
+@dd.receiver(dd.post_save)
+@dd.receiver(post_delete)
+def invalidate_assignee(sender=None, instance=None, **kw):
+    if isinstance(instance, rt.models.tickets.Ticket):
+        invalidate_dashboard(instance.assigned_to_id)
+
+
+@dd.receiver(tickets_state_changed)
+def invalidate_assignees(sender=None, changes=None, **kw):
+    invalidate_dashboard(*[obj.assigned_to_id for obj, old in changes])
+
+
+@dd.receiver(dd.post_save)
+def update_fulltext(sender=None, instance=None, **kw):
+    if not dd.plugins.tickets.use_fulltext:
+        return
+    if settings.SITE.loading_from_dump:
+        return
+    if isinstance(instance, rt.models.tickets.Ticket):
+        ticket = instance
+    elif dd.is_installed('comments') and isinstance(
+            instance, rt.models.comments.Comment):
+        ticket = instance.owner
+        if not isinstance(ticket, rt.models.tickets.Ticket):
+            return
+    else:
+        return
+    # the index is not in the database, so we must wait until the
+    # change is committed
+    be = dd.plugins.tickets.get_fulltext_backend()
+    transaction.on_commit(lambda: be.index_ticket(ticket))
+
+
+@dd.receiver(post_delete)
+def remove_fulltext(sender=None, instance=None, **kw):
+    if not dd.plugins.tickets.use_fulltext:
+        return
+    be = dd.plugins.tickets.get_fulltext_backend()
+    if isinstance(instance, rt.models.tickets.Ticket):
+        pk = instance.pk
+        transaction.on_commit(lambda: be.remove_ticket(pk))
+    elif dd.is_installed('comments') and isinstance(
+            instance, rt.models.comments.Comment):
+        ticket = instance.owner
+        if isinstance(ticket, rt.models.tickets.Ticket):
+            transaction.on_commit(lambda: be.index_ticket(ticket))
+
+
+SEARCH_RANK = 'search_rank'
+
+
+def add_quick_search_filter(cls, qs, search_text):
+    """Annotate the tickets found in the full-text index with their rank
+    so that :func:`get_request_queryset` can sort them by relevance.
+
+    """
+    ids = qs.model.get_fulltext_ids(search_text)
+    if ids is None:
+        return base_add_quick_search_filter(cls, qs, search_text)
+    if len(ids) == 0:
+        return qs.none()
+    rank = models.Case(
+        *[models.When(pk=pk, then=models.Value(i))
+          for i, pk in enumerate(ids)],
+        output_field=models.IntegerField())
+    return qs.filter(pk__in=ids).annotate(**{SEARCH_RANK: rank})
+
+base_add_quick_search_filter = Tickets.add_quick_search_filter.__func__
+Tickets.add_quick_search_filter = classmethod(add_quick_search_filter)
+
+
+def get_request_queryset(cls, ar):
+    if not dd.plugins.tickets.use_search_index \
+       or dd.is_installed('votes') or dd.is_installed('deploy'):
+        qs = base_get_request_queryset(cls, ar)
+    else:
+        # skip the filters of the base class, but not those of its
+        # parent
+        qs = super(Tickets, cls).get_request_queryset(ar)
+        qs = rt.models.tickets.TicketSearchIndex.filter_tickets(
+            qs, ar.param_values)
+    if ar.quick_search and not ar.order_by \
+       and SEARCH_RANK in qs.query.annotations:
+        # the best matches of a full-text search first
+        qs = qs.order_by(SEARCH_RANK, '-id')
+    return qs
+
+base_get_request_queryset = Tickets.get_request_queryset.__func__
+Tickets.get_request_queryset = classmethod(get_request_queryset)
+
+def is_ranked(quick_search, order_by=None):
+    """Whether a ticket table request with the given quick search and
+    sort order is sorted by the rank of a full-text search (see
+    :func:`get_request_queryset`).  Keyset pagination doesn't work on
+    these requests.
+
+    """
+    return not order_by and rt.models.tickets.Ticket.uses_fulltext(
+        quick_search)
+
+
+URL_PARAM_AFTER = 'after'
+"""The URL parameter which activates keyset pagination on a ticket table.
+Its value is the id of the last ticket of the previous page."""
+
+
+def keyset_filter(after):
+    """Return the filter to use for getting the page of tickets after the
+    ticket with the given id, or `None` if `after` is empty.
+
+    """
+    if after:
+        return models.Q(id__lt=after)
+
+
+def parse_req(cls, request, rqdata, **kw):
+    """Activate keyset pagination when the request specifies
+    :data:`URL_PARAM_AFTER` and the table is sorted by descending id
+    (and not by the rank of a full-text search, see :func:`is_ranked`).
+
+    In that case the `start` parameter is ignored and the page is
+    found using the index on the primary key instead of skipping the
+    rows of the previous pages.
+
+    Keyset pagination is meant for API clients (and the public ticket
+    list uses it as well).  The parameter is ignored in requests of a
+    grid (i.e. those specifying
+    :data:`URL_PARAM_REQUESTING_PANEL
+    <lino.core.constants.URL_PARAM_REQUESTING_PANEL>`) because the
+    paging toolbar works with offsets and total counts.
+
+    """
+    kw = base_parse_req(cls, request, rqdata, **kw)
+    after = rqdata.get(URL_PARAM_AFTER, None)
+    if not after or rqdata.get(constants.URL_PARAM_REQUESTING_PANEL):
+        return kw
+    if (kw.get('order_by') or cls.order_by) != ["-id"]:
+        return kw
+    if is_ranked(kw.get('quick_search'), kw.get('order_by')):
+        return kw
+    try:
+        flt = keyset_filter(int(after))
+    except ValueError:
+        raise SuspiciousOperation("Invalid value for after")
+    if kw.get('filter') is not None:
+        flt &= kw['filter']
+    kw.update(filter=flt)
+    kw.pop('offset', None)
+    return kw
+
+base_parse_req = Tickets.parse_req.__func__
+Tickets.parse_req = classmethod(parse_req)
+
+
+def links_queryset(cls, ar):
+    qs = base_links_queryset(cls, ar)
+    if qs is not None:
+        # the summary shows both tickets of every link
+        qs = qs.select_related('parent', 'child')
+    return qs
+
+base_links_queryset = LinksByTicket.get_request_queryset.__func__
+LinksByTicket.get_request_queryset = classmethod(links_queryset)
+
+
+def get_preview_rows(actor, obj, ar, *related):
+    """Return a tuple `(sar, rows, more)` for rendering the summary of
+    the given slave table: the table request, its first
+    :attr:`preview_limit <lino.core.tables.AbstractTable.preview_limit>`
+    rows and whether there are more rows.
+
+    The rows are fetched using a single query, together with the
+    given related objects.
+
+    """
+    sar = actor.request_from(ar, master_instance=obj)
+    qs = sar.data_iterator
+    if related and isinstance(qs, models.QuerySet):
+        qs = qs.select_related(*related)
+    limit = actor.preview_limit
+    rows = list(qs[:limit + 1])
+    return sar, rows[:limit], len(rows) > limit
+
+
+def more_button(ar, sar, text):
+    """Return an HTML element which opens the full table of the given
+    table request.
+
+    """
+    return ar.href_to_request(sar, text)
+
+
+if dd.is_installed('comments'):
+
+    from lino.modlib.comments.ui import CommentsByRFC
+
+    def comments_summary(cls, obj, ar):
+        sar, rows, more = get_preview_rows(cls, obj, ar, 'user')
+        html = obj.get_rfc_description(ar)
+        isar = cls.insert_action.request_from(sar)
+        if isar.get_permission():
+            btn = isar.ar2button(None, _("Write comment"), icon_name=None)
+            html += "<p>" + tostring(btn) + "</p>"
+        html += "<ul>"
+        for c in rows:
+            html += "<li>{}<div id=\"{}\">{}</div></li>".format(
+                cls.get_comment_header(c, sar),
+                "comment-" + str(c.id),
+                ar.parse_memo(c.body))
+        html += "</ul>"
+        if more:
+            html += "<p>" + tostring(more_button(
+                ar, sar, _("Show all comments"))) + "</p>"
+        return ar.html_text(html)
+
+    CommentsByRFC.get_table_summary = classmethod(comments_summary)
+
+
+if dd.is_installed('github'):
+
+    from django.contrib.humanize.templatetags.humanize import naturaltime
+    from lino_xl.lib.github.desktop import CommitsByTicket
+
+    def commits_summary(cls, obj, ar):
+        sar, rows, more = get_preview_rows(cls, obj, ar, 'user')
+        items = []
+        for c in rows:
+            items.append(E.li(
+                E.a(c.sha[:6], href=c.url, target="_BLANK"),
+                ":" if c.user else "",
+                ar.obj2html(c.user) if c.user else "",
+                ":",
+                ar.obj2html(
+                    c, naturaltime(c.created),
+                    title=c.created.strftime('%Y-%m-%d %H:%M')),
+                E.br(), c.summary))
+        if more:
+            items.append(E.li(more_button(ar, sar, _("Show all commits"))))
+        return E.ul(*items)
+
+    CommitsByTicket.get_table_summary = classmethod(commits_summary)
+
+
 class TicketDetail(TicketDetail):
     """Customized detail_layout for Tickets in Noi
 
+    The summaries of the comments and the commits show at most
+    :attr:`preview_limit <lino.core.tables.AbstractTable.preview_limit>`
+    rows, followed by a button which opens the full table.
+
     """
     main = "general more #history_tab #more2 #github.CommitsByTicket"
     
@@ -162,6 +967,21 @@ class SiteDetail(SiteDetail):
         company contact_person reporting_type workflow_buttons:20
         tickets.SubscriptionsBySite:30 TicketsBySite
     """, label=_("General"))
+
+    if dd.plugins.tickets.use_site_stats:
+
+        main = """general site_tickets more history"""
+
+        general = dd.Panel("""
+            id name
+            company contact_person reporting_type workflow_buttons:20
+            ticket_states open_planned_time last_ticket_activity
+            tickets.SubscriptionsBySite:30
+        """, label=_("General"))
+
+        site_tickets = dd.Panel("""
+        TicketsBySite
+        """, label=_("Tickets"))
     
     more = dd.Panel("""
     remark
@@ -183,6 +1003,9 @@ Tickets.params_layout = """user end_user assigned_to not_assigned_to interesting
     start_date end_date observed_event topic #feasable_by has_ref"""
 Tickets.column_names = 'id summary:50 #user:10 #topic #faculty priority ' \
                        'workflow_buttons:30 site:10 #project:10'
+if dd.plugins.tickets.use_site_stats:
+    Sites.column_names = "ref name company remark workflow_buttons " \
+                         "open_planned_time last_ticket_activity id *"
 Tickets.tablet_columns = "id summary workflow_buttons"
 Tickets.mobile_columns = "summary workflow_buttons"
 
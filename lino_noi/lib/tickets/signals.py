@@ -0,0 +1,23 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Signals sent by this plugin.
+
+.. data:: tickets_state_changed
+
+    Sent by :meth:`execute_many
+    <lino_noi.lib.tickets.workflows.TicketAction.execute_many>` after
+    the state of several tickets has been changed using a single
+    database update.  Such an update sends no `pre_save` or
+    `post_save` signals, so the caches and summaries which depend on
+    the state of a ticket must subscribe to this signal as well.
+
+    `sender` is the ticket model, `changes` a list of `(ticket,
+    old_state)` tuples where every ticket has already its new state
+    and modification time, and `request` the action request.
+
+"""
+
+from django.dispatch import Signal
+
+tickets_state_changed = Signal(['changes', 'request'])
@@ -0,0 +1,192 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Materialised ticket statistics per site.
+
+Used when :attr:`use_site_stats
+<lino_noi.lib.tickets.Plugin.use_site_stats>` is set.
+
+Every site has a :class:`SiteTicketStats
+<lino_noi.lib.tickets.models.SiteTicketStats>` row with the number of
+its tickets in each state, the planned time of its active tickets and
+the time of the last modification of one of its tickets.  The row is
+updated whenever a ticket is saved or deleted, and when the state of
+several tickets is changed at once (:meth:`execute_many
+<lino_noi.lib.tickets.workflows.TicketAction.execute_many>`).  A row
+which doesn't yet exist is computed from the tickets of its site.
+When a site loses a ticket (because it has been deleted or moved to
+another site), its last activity is read again from its remaining
+tickets.
+
+When :attr:`use_site_stats
+<lino_noi.lib.tickets.Plugin.use_site_stats>` is not set, the
+statistics are computed each time a site is displayed (once per row
+of a table of sites).
+
+"""
+
+from __future__ import unicode_literals
+
+from django.db import transaction
+from django.db.models import Count, Max
+
+from lino.api import rt
+
+from lino.utils.quantities import Duration
+from lino_xl.lib.tickets.choicelists import TicketStates
+
+ZERO_DURATION = Duration('0:00')
+
+ORIGINAL_ATTR = '_stats_contribution'
+
+CACHE_ATTR = '_computed_ticket_stats'
+
+
+def get_contribution(ticket):
+    """Return a tuple `(site_id, state, planned_time)` describing what
+    the given ticket contributes to the statistics of its site, or
+    `None`.
+
+    """
+    if ticket.site_id is None:
+        return None
+    planned = None
+    if ticket.state is not None and ticket.state.active:
+        planned = ticket.planned_time
+    return (ticket.site_id, ticket.state, planned)
+
+
+def get_original_contribution(ticket):
+    """Return the contribution of the given ticket as it is stored in the
+    database.
+
+    """
+    if ticket.pk is None:
+        return None
+    Ticket = rt.models.tickets.Ticket
+    old = Ticket.objects.filter(pk=ticket.pk).only(
+        'site', 'state', 'planned_time').first()
+    if old is None:
+        return None
+    return get_contribution(old)
+
+
+def compute_values(site_id):
+    """Return a dict with the field values of the statistics of the given
+    site, computed from its tickets.
+
+    """
+    qs = rt.models.tickets.Ticket.objects.filter(site_id=site_id)
+    values = dict()
+    for st in TicketStates.get_list_items():
+        values[st.get_summary_field()] = 0
+    for row in qs.values('state').annotate(n=Count('id')):
+        st = TicketStates.get_by_value(row['state'])
+        if st is not None:
+            values[st.get_summary_field()] = row['n']
+    active = [st.value for st in TicketStates.get_list_items() if st.active]
+    planned = ZERO_DURATION
+    for d in qs.filter(state__in=active).exclude(
+            planned_time__isnull=True).values_list(
+                'planned_time', flat=True):
+        if d:
+            planned += d
+    values.update(open_planned_time=planned)
+    values.update(last_activity=get_last_activity(site_id))
+    return values
+
+
+def get_last_activity(site_id):
+    """Return the last modification time of the tickets of the given
+    site.
+
+    """
+    qs = rt.models.tickets.Ticket.objects.filter(site_id=site_id)
+    return qs.aggregate(m=Max('modified'))['m']
+
+
+def recompute(site_id):
+    """Compute, store and return the statistics of the given site."""
+    obj, created = rt.models.tickets.SiteTicketStats.objects.update_or_create(
+        site_id=site_id, defaults=compute_values(site_id))
+    return obj
+
+
+def add_ticket(values, state, planned, sign):
+    if state is not None:
+        k = state.get_summary_field()
+        values[k] = values.get(k, 0) + sign
+    if planned:
+        if sign > 0:
+            values['open_planned_time'] += planned
+        else:
+            values['open_planned_time'] = \
+                ZERO_DURATION + (values['open_planned_time'] - planned)
+
+
+def apply_changes(changes, activity=None):
+    """Update the statistics for the given list of `(old, new)` tuples,
+    each of them describing the old and the new contribution of a
+    ticket.  `activity` is the modification time of the tickets, or
+    `None` if they have been deleted.
+
+    """
+    if activity is None:
+        changes = [(old, new) for old, new in changes if old != new]
+    if not changes:
+        return
+    SiteTicketStats = rt.models.tickets.SiteTicketStats
+    sites = set([c[0] for pair in changes for c in pair if c is not None])
+    active_sites = set([new[0] for old, new in changes if new is not None])
+    # sites which lost a ticket (deleted or moved to another site)
+    losing_sites = set([old[0] for old, new in changes if old is not None
+                        and (new is None or new[0] != old[0])])
+    with transaction.atomic():
+        for site_id in sites:
+            stats = SiteTicketStats.objects.select_for_update().filter(
+                site_id=site_id).first()
+            if stats is None:
+                # includes the current changes since the tickets have
+                # been saved already
+                recompute(site_id)
+                continue
+            values = dict(open_planned_time=stats.open_planned_time or
+                          ZERO_DURATION)
+            for st in TicketStates.get_list_items():
+                k = st.get_summary_field()
+                values[k] = getattr(stats, k) or 0
+            for old, new in changes:
+                if old is not None and old[0] == site_id:
+                    add_ticket(values, old[1], old[2], -1)
+                if new is not None and new[0] == site_id:
+                    add_ticket(values, new[1], new[2], 1)
+            last = stats.last_activity
+            if site_id in losing_sites:
+                # the ticket with the last activity may be gone
+                last = get_last_activity(site_id)
+            if activity is not None and site_id in active_sites and (
+                    last is None or activity > last):
+                last = activity
+            values.update(last_activity=last)
+            SiteTicketStats.objects.filter(site_id=site_id).update(**values)
+
+
+def apply_state_change(todo):
+    """Update the statistics after the state of several tickets has been
+    changed using a single database update.  `todo` is a list of
+    `(ticket, old_state)` tuples where the ticket has already its new
+    state and modification time.
+
+    """
+    changes = []
+    activity = None
+    for obj, old_state in todo:
+        if obj.site_id is None:
+            continue
+        planned = None
+        if old_state is not None and old_state.active:
+            planned = obj.planned_time
+        changes.append(((obj.site_id, old_state, planned),
+                        get_contribution(obj)))
+        activity = obj.modified
+    apply_changes(changes, activity)
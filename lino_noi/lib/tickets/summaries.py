@@ -0,0 +1,286 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Incremental maintenance of the working time summaries.
+
+Used when :attr:`use_incremental_summaries
+<lino_noi.lib.tickets.Plugin.use_incremental_summaries>` is set.
+
+Every :class:`Session <lino_xl.lib.working.models.Session>` contributes
+its duration to the ``*_hours`` field of the :class:`SiteSummary
+<lino_xl.lib.working.models.SiteSummary>` rows of the site of its
+ticket (the row of its year or month, and the row without a year).
+Every ticket contributes to the active or inactive ticket counts of
+its site, and to the count of tickets in its state (named by
+:meth:`get_summary_field
+<lino_xl.lib.tickets.choicelists.TicketState.get_summary_field>`) if
+the summaries have such a field.  When a session or a ticket is saved
+or deleted, we subtract its old contribution and add its new one,
+within a transaction which locks the affected rows.
+
+The row without a year (where `year` and `month` are `None`) is new.
+:manage:`checksummaries` doesn't create it because
+:meth:`get_summary_periods
+<lino.modlib.summaries.mixins.Summary.get_summary_periods>` yields
+only the periods of a year, although :meth:`get_summary_collectors
+<lino_xl.lib.working.models.SiteSummary.get_summary_collectors>`
+counts the tickets only in this row.  So with incremental summaries
+the ticket counts of a site are in its row without a year, which also
+holds the total hours of the site.
+
+When the site or the ticket type of a ticket changes, or the
+reporting type of a site, the contributions of many sessions change.
+We then mark the summaries of the old and the new site as dirty for
+every year in which these sessions have been done.
+
+When a summary row does not yet exist, or when the contribution of an
+object cannot be computed, its partition (a site and a year) is marked
+as dirty by storing a :class:`DirtySummary
+<lino_noi.lib.tickets.models.DirtySummary>`.
+:func:`update_dirty_summaries` recomputes only these partitions.  It
+runs every few minutes and replaces the nightly recomputation of all
+summaries.
+
+Changes done using queryset methods (e.g. `update()`) send no
+signals and are not seen.  Call :func:`mark_dirty` after such
+changes, or run :manage:`checksummaries`.
+
+"""
+
+from __future__ import unicode_literals
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import transaction
+
+from lino.api import dd, rt
+
+from lino_xl.lib.working.choicelists import ZERO_DURATION
+from lino.utils.quantities import Duration
+
+NO_PERIOD = (None, None)
+
+ORIGINAL_ATTR = '_summary_original'
+
+# the fields needed by get_contributions() and get_session_dependencies()
+TICKET_FIELDS = ('site', 'state', 'ticket_type')
+SITE_FIELDS = ('reporting_type',)
+SESSION_FIELDS = (
+    'ticket', 'start_date', 'start_time', 'end_date', 'end_time',
+    'break_time', 'reporting_type', 'ticket__site', 'ticket__ticket_type',
+    'ticket__site__reporting_type', 'ticket__ticket_type__reporting_type')
+
+
+def has_summary_field(name):
+    try:
+        rt.models.working.SiteSummary._meta.get_field(name)
+    except FieldDoesNotExist:
+        return False
+    return True
+
+
+def get_period_keys(date):
+    """Return the `(year, month)` keys of the summary rows to which an
+    object of the given date contributes.
+
+    """
+    keys = [NO_PERIOD]
+    if date is None:
+        return keys
+    period = rt.models.working.SiteSummary.summary_period
+    if period == 'yearly':
+        keys.append((date.year, None))
+    elif period == 'monthly':
+        keys.append((date.year, date.month))
+    return keys
+
+
+def get_contributions(obj):
+    """Return a dict which maps `(key, fieldname)` to the value which the
+    given session or ticket adds to a summary field.  `key` is a tuple
+    `(site_id, year, month)`.
+
+    """
+    c = dict()
+    if isinstance(obj, rt.models.tickets.Site):
+        return c
+    if isinstance(obj, rt.models.tickets.Ticket):
+        if obj.site_id is not None and obj.state is not None:
+            key = (obj.site_id, None, None)
+            k = 'active_tickets' if obj.state.active else 'inactive_tickets'
+            c[(key, k)] = 1
+            k = obj.state.get_summary_field()
+            if k is not None and has_summary_field(k):
+                c[(key, k)] = 1
+        return c
+    d = obj.get_duration()
+    if not d or obj.ticket_id is None:
+        return c
+    ticket = obj.ticket
+    if ticket.site_id is not None:
+        k = obj.get_reporting_type().name + '_hours'
+        for year, month in get_period_keys(obj.start_date):
+            c[((ticket.site_id, year, month), k)] = d
+    return c
+
+
+def get_original(obj):
+    """Return the given session, ticket or site as it is stored in the
+    database, with only the fields needed for updating the summaries,
+    or `None`.
+
+    """
+    if obj.pk is None:
+        return None
+    qs = obj.__class__.objects.filter(pk=obj.pk)
+    if isinstance(obj, rt.models.tickets.Ticket):
+        qs = qs.only(*TICKET_FIELDS)
+    elif isinstance(obj, rt.models.tickets.Site):
+        qs = qs.only(*SITE_FIELDS)
+    else:
+        qs = qs.select_related(
+            'ticket__site', 'ticket__ticket_type').only(*SESSION_FIELDS)
+    return qs.first()
+
+
+def get_original_contributions(obj):
+    """Return the contributions of the given object as it is stored in
+    the database.
+
+    """
+    old = get_original(obj)
+    if old is None:
+        return dict()
+    return get_contributions(old)
+
+
+def get_session_dependencies(obj):
+    """Return the values of the fields of the given ticket or site on
+    which the contributions of its sessions depend.
+
+    """
+    if isinstance(obj, rt.models.tickets.Ticket):
+        return (obj.site_id, obj.ticket_type_id)
+    return (obj.reporting_type,)
+
+
+def mark_sessions_dirty(old, obj):
+    """Mark the summaries of the sessions of the given ticket or site as
+    dirty if their contributions have changed since it was `old`.
+
+    """
+    if get_session_dependencies(old) == get_session_dependencies(obj):
+        return
+    qs = rt.models.working.Session.objects.all()
+    if isinstance(obj, rt.models.tickets.Ticket):
+        qs = qs.filter(ticket=obj)
+        site_ids = set([old.site_id, obj.site_id])
+    else:
+        qs = qs.filter(ticket__site=obj)
+        site_ids = set([obj.pk])
+    years = set([d.year for d in qs.dates('start_date', 'year')])
+    if not years:
+        if not qs.exists():
+            return
+        # sessions without a date are only in the row without a year
+        years.add(None)
+    for site_id in site_ids:
+        for year in years:
+            mark_dirty(site_id, year)
+
+
+def update_summaries(old, obj):
+    """Update the summaries after the given session, ticket or site has
+    been saved.  `old` is the value returned by :func:`get_original`
+    before saving it.
+
+    """
+    if old is None:
+        apply_deltas(dict(), get_contributions(obj))
+        return
+    apply_deltas(get_contributions(old), get_contributions(obj))
+    if not isinstance(obj, rt.models.working.Session):
+        mark_sessions_dirty(old, obj)
+
+
+def add_value(value, old, new):
+    """Return the given summary value minus `old` plus `new`."""
+    if value is None:
+        value = 0
+    if old:
+        value = value - old
+    if new:
+        value = value + new
+    if isinstance(old or new, Duration):
+        value = ZERO_DURATION + value
+    return value
+
+
+def mark_dirty(site_id, year=None):
+    """Mark the summaries of the given site and year as outdated."""
+    if site_id is None:
+        return
+    rt.models.tickets.DirtySummary.objects.get_or_create(
+        site_id=site_id, year=year)
+
+
+def apply_deltas(old, new):
+    """Update the summary fields from the `old` to the `new`
+    contributions.
+
+    """
+    SiteSummary = rt.models.working.SiteSummary
+    fields = dict()
+    for k in set(old) | set(new):
+        if old.get(k) != new.get(k):
+            key, name = k
+            fields.setdefault(key, []).append(name)
+    if not fields:
+        return
+    with transaction.atomic():
+        for key, names in fields.items():
+            site_id, year, month = key
+            qs = SiteSummary.objects.select_for_update().filter(
+                master_id=site_id, year=year, month=month)
+            row = qs.first()
+            if row is None:
+                mark_dirty(site_id, year)
+                continue
+            values = dict()
+            for name in names:
+                k = (key, name)
+                values[name] = add_value(
+                    getattr(row, name), old.get(k), new.get(k))
+            qs.update(**values)
+
+
+def update_dirty_summaries():
+    """Recompute the summaries of all dirty partitions."""
+    SiteSummary = rt.models.working.SiteSummary
+    Site = rt.models.tickets.Site
+    DirtySummary = rt.models.tickets.DirtySummary
+    for ds in DirtySummary.objects.order_by('site_id', 'year'):
+        with transaction.atomic():
+            # delete first so that changes done meanwhile mark it
+            # dirty again
+            DirtySummary.objects.filter(pk=ds.pk).delete()
+            master = Site.objects.filter(pk=ds.site_id).first()
+            if master is None:
+                continue
+            keys = [NO_PERIOD]
+            if ds.year is not None:
+                keys += [(year, month) for year, month
+                         in SiteSummary.get_summary_periods()
+                         if year == ds.year]
+            for year, month in keys:
+                obj = SiteSummary.get_for_period(master, year, month)
+                obj.compute_summary_values()
+
+
+def cancel_nightly_rebuild():
+    """Remove the job which recomputes all summaries every night."""
+    if not dd.schedule:
+        return
+    from lino.modlib.summaries.models import checksummaries
+    for job in list(dd.schedule.jobs):
+        if getattr(job.job_func, 'func', None) is checksummaries:
+            dd.schedule.cancel_job(job)
@@ -19,31 +19,139 @@ block, otherwise we use the more widely supported symbols from
 """
 from __future__ import unicode_literals
 
+from django.utils import timezone
+from django.utils import translation
+
+from etgen.html import E, tostring
+
 from lino.api import dd, rt, _, pgettext
+from lino.utils.watch import get_master
 
 from lino.utils.instantiator import create_row
 
 from lino_xl.lib.tickets.choicelists import TicketStates
 from lino_xl.lib.tickets.roles import Triager
+from lino_noi.lib.noi.roles import has_role
+from lino_noi.lib.tickets.signals import tickets_state_changed
 
 class TicketAction(dd.ChangeStateAction):
     """Base class for ticket actions.
 
     Make sure that only *triagers* can act on tickets of other users.
 
+    When run on more than one selected ticket, the state change is
+    done by :meth:`execute_many`.
+
     """
     needs_site = False
 
     def get_action_permission(self, ar, obj, state):
         me = ar.get_user()
-        if obj.user != me:
-            if not me.user_type.has_required_roles([Triager]):
+        if me.pk is None or obj.user_id != me.pk:
+            if not has_role(ar, Triager):
                 return False
         if self.needs_site and obj.site_id is None:
             return False
         return super(TicketAction,
                      self).get_action_permission(ar, obj, state)
 
+    def run_from_ui(self, ar):
+        if len(ar.selected_rows) < 2:
+            return super(TicketAction, self).run_from_ui(ar)
+        self.execute_many(ar, ar.selected_rows)
+        ar.set_response(refresh=True)
+        ar.success()
+
+    def execute_many(self, ar, rows):
+        """Change the state of the given tickets using a single database
+        update.
+
+        Tickets which are already in the target state or on which the
+        user may not run this action are skipped.  The changes are
+        logged using a single bulk insert, and every observer gets one
+        notification message about all tickets.
+
+        Since the update sends no `post_save` signals, we send
+        :data:`tickets_state_changed
+        <lino_noi.lib.tickets.signals.tickets_state_changed>` instead.
+
+        """
+        Ticket = rt.models.tickets.Ticket
+        target = self.target_state
+        ba = ar.bound_action
+        todo = []
+        for obj in rows:
+            old = ar.actor.get_row_state(obj)
+            if old == target:
+                continue
+            if not ba.get_row_permission(ar, obj, old):
+                continue
+            todo.append((obj, old))
+        if len(todo) == 0:
+            return
+        now = timezone.now()
+        ids = [obj.pk for obj, old in todo]
+        Ticket.objects.filter(pk__in=ids).update(state=target, modified=now)
+        for obj, old in todo:
+            obj.state = target
+            obj.modified = now
+
+        tickets_state_changed.send(sender=Ticket, changes=todo, request=ar)
+
+        if dd.is_installed('changes'):
+            self.log_changes(ar, todo, now)
+
+        if dd.is_installed('notify'):
+            self.notify_many(ar, [obj for obj, old in todo])
+
+    def log_changes(self, ar, todo, now):
+        Change = rt.models.changes.Change
+        ChangeTypes = rt.models.changes.ChangeTypes
+        changes = []
+        for obj, old in todo:
+            master = get_master(obj)
+            if master is None:
+                continue
+            changes.append(Change(
+                type=ChangeTypes.update, time=now, master=master,
+                user=ar.user, object=obj, changed_fields='state ',
+                diff="state : {} --> {}".format(
+                    dd.obj2str(old), dd.obj2str(self.target_state))))
+        Change.objects.bulk_create(changes)
+
+    def notify_many(self, ar, tickets):
+        Message = rt.models.notify.Message
+        MailModes = rt.models.notify.MailModes
+        mt = tickets[0].get_notify_message_type()
+        if mt is None:
+            return
+        me = ar.get_user()
+        observers = dict()  # site_id -> list of (user, mail_mode)
+        recipients = dict()  # user -> (mail_mode, list of tickets)
+        for obj in tickets:
+            if obj.site_id not in observers:
+                observers[obj.site_id] = list(obj.get_change_observers())
+            for user, mm in observers[obj.site_id]:
+                if user is None or user.user_type is None:
+                    continue
+                if mm == MailModes.silent:
+                    continue
+                if user == me and not me.notify_myself:
+                    continue
+                if mt in user.user_type.mask_message_types:
+                    continue
+                recipients.setdefault(user, (mm, []))[1].append(obj)
+        for user, (mm, lst) in recipients.items():
+            with translation.override(user.language):
+                subject = _("{user} marked {num} tickets as {state}").format(
+                    user=ar.user, num=len(lst), state=self.target_state)
+                body = tostring(E.div(
+                    E.p(subject, ":"),
+                    E.ul(*[E.li(ar.obj2memo(obj)) for obj in lst])))
+            Message.create_message(
+                user, subject=subject, body=body,
+                mail_mode=mm or MailModes.often, message_type=mt)
+
     
 class MarkTicketOpened(TicketAction):
     """Mark this ticket as open.
@@ -71,9 +71,13 @@ lino_noi
 lino_noi.lib
 lino_noi.lib.noi
 lino_noi.lib.noi.fixtures
+lino_noi.lib.noi.management
+lino_noi.lib.noi.management.commands
 lino_noi.lib.contacts
 lino_noi.lib.contacts.fixtures
 lino_noi.lib.public
+lino_noi.lib.public.management
+lino_noi.lib.public.management.commands
 lino_noi.lib.topics
 lino_noi.lib.users
 lino_noi.lib.users.fixtures
@@ -81,6 +85,8 @@ lino_noi.lib.cal
 lino_noi.lib.cal.fixtures
 lino_noi.lib.courses
 lino_noi.lib.tickets
+lino_noi.lib.tickets.management
+lino_noi.lib.tickets.management.commands
 """.splitlines() if n])
 
 SETUP_INFO.update(message_extractors={
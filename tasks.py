@@ -6,6 +6,7 @@ ns = setup_from_tasks(
     blogref_url='http://luc.lino-framework.org',
     revision_control_system='git',
     locale_dir='lino_noi/lib/noi/locale',
+    prep_command="manage.py prep_snapshot --noinput --traceback",
 )
     # cleanable_files=['docs/api/lino_noi.*'],
     # demo_projects=[
@@ -5,6 +5,7 @@ Examples how to run these tests::
   $ python setup.py test -s tests.DocsTests
   $ python setup.py test -s tests.DocsTests.test_debts
   $ python setup.py test -s tests.DocsTests.test_docs
+  $ python setup.py test -s tests.ProjectTests
 """
 from unipath import Path
 
@@ -33,5 +34,7 @@ class PackagesTests(TestCase):
         self.run_packages_test(SETUP_INFO['packages'])
 
 
+class ProjectTests(TestCase):
 
-
+    def test_project(self):
+        self.run_django_manage_test(ROOTDIR.child('tests', 'project'))
@@ -0,0 +1,23 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""The Django settings used by the unit tests of Lino Noi.
+
+"""
+
+from lino_noi.lib.noi.settings import *
+
+
+class Site(Site):
+    title = "Lino Noi test project"
+    demo_fixtures = ['std']
+    user_types_module = 'user_types'
+
+    def get_installed_apps(self):
+        yield super(Site, self).get_installed_apps()
+        yield 'lino_noi.lib.public'
+
+
+SITE = Site(globals())
+
+DEBUG = True
@@ -0,0 +1,7 @@
+"""The unit tests of Lino Noi.  They are run by :class:`ProjectTests
+<tests.ProjectTests>`::
+
+  $ cd tests/project
+  $ python manage.py test
+
+"""
@@ -0,0 +1,133 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Tests about loading Python fixtures in bulk.  See
+:mod:`lino_noi.lib.noi.bulkload`.
+
+"""
+
+from __future__ import unicode_literals
+
+import types
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from lino.api import rt
+from lino.modlib.users.choicelists import UserTypes
+from lino.utils.djangotest import RemoteAuthTestCase
+
+from lino_noi.lib.noi.bulkload import BulkDeserializer, BulkLoader
+from lino_noi.lib.noi.bulkload import install_query_hook, get_table_names
+
+
+def load_module(d, module):
+    # what BulkDeserializer.deserialize() does with a fixture file
+    d.bulk = BulkLoader(100)
+    uninstall = install_query_hook(connection, d.bulk.before_query)
+    try:
+        for o in d.deserialize_module(module):
+            o.save()
+    finally:
+        uninstall()
+
+
+class TestCase(RemoteAuthTestCase):
+    maxDiff = None
+
+    def tearDown(self):
+        settings.SITE.loading_from_dump = False
+        super(TestCase, self).tearDown()
+
+    def test_batches(self):
+        CommitWatermark = rt.models.noi.CommitWatermark
+        User = rt.models.users.User
+        d = BulkDeserializer()
+        seen = []
+
+        def objects():
+            for i in range(5):
+                yield CommitWatermark(id=i + 1, repository_id=i + 1)
+            # validation and queries on other tables don't flush
+            User.objects.count()
+            seen.append((d.bulk.count, d.bulk.flushes))
+            seen.append(CommitWatermark.objects.count())
+            seen.append((d.bulk.count, d.bulk.flushes))
+
+        module = types.ModuleType(str('fixture'))
+        module.objects = objects
+        load_module(d, module)
+        self.assertEqual(seen, [(5, 0), 5, (0, 1)])
+
+    def test_deferred(self):
+        User = rt.models.users.User
+        Ticket = rt.models.tickets.Ticket
+        Site = rt.models.tickets.Site
+        settings.SITE.loading_from_dump = True
+        d = BulkDeserializer()
+
+        def objects():
+            yield User(id=1, username='robin', user_type=UserTypes.admin)
+            # the site does not yet exist
+            yield Ticket(id=1, summary="Foo", user_id=1, site_id=1)
+            yield Site(id=1, name="site")
+
+        module = types.ModuleType(str('fixture'))
+        module.objects = objects
+        load_module(d, module)
+        self.assertEqual(d.save_later, {})
+        self.assertEqual(Ticket.objects.get(pk=1).site_id, 1)
+
+    def test_demo_fixture(self):
+        User = rt.models.users.User
+        Ticket = rt.models.tickets.Ticket
+        Site = rt.models.tickets.Site
+        robin = User.objects.create(
+            username='robin', user_type=UserTypes.admin)
+        d = BulkDeserializer()
+
+        # like a demo fixture: no primary keys, and Ticket.save() sets
+        # the timestamps
+        def objects():
+            sites = []
+            for i in range(5):
+                site = Site(name="site{}".format(i))
+                yield site
+                sites.append(site)
+            for i in range(20):
+                yield Ticket(summary="Ticket {}".format(i), user=robin,
+                             site=sites[i % 5])
+
+        module = types.ModuleType(str('fixture'))
+        module.objects = objects
+        with CaptureQueriesContext(connection) as ctx:
+            load_module(d, module)
+            d.bulk.flush()
+        inserts = [q['sql'] for q in ctx.captured_queries
+                   if q['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 2)
+        self.assertEqual(Site.objects.count(), 5)
+        self.assertEqual(Ticket.objects.count(), 20)
+        self.assertEqual(
+            Ticket.objects.filter(created__isnull=True).count(), 0)
+        self.assertEqual(
+            Ticket.objects.filter(site__name="site3").count(), 4)
+
+    def test_table_names(self):
+        self.assertEqual(
+            get_table_names(
+                'SELECT COUNT(*) FROM "tickets_ticket" INNER JOIN '
+                '"tickets_tickettype" ON ("tickets_ticket"."ticket_type_id"'
+                ' = "tickets_tickettype"."id")'),
+            set(['tickets_ticket', 'tickets_tickettype']))
+        # the name of a table contained in another one
+        self.assertEqual(
+            get_table_names('SELECT * FROM "tickets_tickettype"'),
+            set(['tickets_tickettype']))
+        self.assertEqual(
+            get_table_names('INSERT INTO "tickets_ticket" ("id") VALUES (1)'),
+            set(['tickets_ticket']))
+        self.assertEqual(
+            get_table_names('UPDATE `tickets_ticket` SET `summary` = 1'),
+            set(['tickets_ticket']))
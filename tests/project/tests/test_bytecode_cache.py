@@ -0,0 +1,44 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Tests about the :manage:`precompile_templates` command.
+
+"""
+
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils.six import StringIO
+from jinja2 import FileSystemBytecodeCache
+
+from lino.api import dd
+from lino.utils.djangotest import RemoteAuthTestCase
+
+
+class TestCase(RemoteAuthTestCase):
+    maxDiff = None
+
+    def test_precompile(self):
+        env = dd.plugins.jinja.renderer.jinja_env
+        # the cache is not active by default
+        self.assertIsNone(env.bytecode_cache)
+        with self.assertRaises(CommandError):
+            call_command('precompile_templates', stdout=StringIO())
+
+        d = tempfile.mkdtemp()
+        try:
+            env.bytecode_cache = FileSystemBytecodeCache(d)
+            # templates loaded before are not compiled again
+            env.cache.clear()
+            out = StringIO()
+            call_command('precompile_templates', stdout=out)
+            self.assertIn("Compiled", out.getvalue())
+            self.assertTrue(len(os.listdir(d)) > 0)
+        finally:
+            env.bytecode_cache = None
+            shutil.rmtree(d)
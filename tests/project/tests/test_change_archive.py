@@ -0,0 +1,77 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Tests about the archive of old changes.  See
+:class:`lino_noi.lib.noi.models.ChangeArchive`.
+
+"""
+
+from __future__ import unicode_literals
+
+import datetime
+
+from django.utils import timezone
+
+from lino.api import rt
+from lino.modlib.users.choicelists import UserTypes
+from lino.utils.djangotest import RemoteAuthTestCase
+
+
+class TestCase(RemoteAuthTestCase):
+    maxDiff = None
+
+    def test_archive(self):
+        User = rt.models.users.User
+        Ticket = rt.models.tickets.Ticket
+        Change = rt.models.changes.Change
+        ChangeTypes = rt.models.changes.ChangeTypes
+        ChangeArchive = rt.models.noi.ChangeArchive
+        ContentType = rt.models.contenttypes.ContentType
+
+        robin = User.objects.create(
+            username='robin', user_type=UserTypes.admin)
+        ticket = Ticket.objects.create(summary="Foo", user=robin)
+        ct = ContentType.objects.get_for_model(Ticket)
+        now = timezone.now()
+
+        def change(days, diff):
+            return Change.objects.create(
+                time=now - datetime.timedelta(days=days),
+                type=ChangeTypes.update, user=robin,
+                object_type=ct, object_id=ticket.pk,
+                master_type=ct, master_id=ticket.pk,
+                changed_fields="summary ", diff=diff)
+
+        old = [change(100, "summary : Foo --> Bar"),
+               change(99, "summary : Bar --> Baz"),
+               change(40, "summary : Baz --> Foo")]
+        recent = change(1, "summary : Foo --> Bar")
+
+        n = ChangeArchive.archive_changes(
+            now - datetime.timedelta(days=30))
+        self.assertEqual(n, 3)
+        self.assertEqual(
+            list(Change.objects.values_list('id', flat=True)), [recent.pk])
+        self.assertEqual(
+            sum(ChangeArchive.objects.values_list('count', flat=True)), 3)
+
+        # the changes are read back from the database
+        changes = []
+        for a in ChangeArchive.objects.order_by('month'):
+            changes.extend(a.get_changes())
+        self.assertEqual([c.pk for c in changes], [c.pk for c in old])
+        self.assertEqual([c.diff for c in changes], [c.diff for c in old])
+        self.assertEqual(changes[0].user_id, robin.pk)
+        self.assertEqual(changes[0].type, ChangeTypes.update)
+        self.assertEqual(changes[0].master_id, ticket.pk)
+
+        # the recent changes are still a queryset
+        ar = rt.login('robin').spawn(
+            rt.models.changes.ChangesByMaster, master_instance=ticket)
+        self.assertEqual([c.pk for c in ar], [recent.pk])
+
+        ar = rt.login('robin').spawn(
+            rt.models.noi.ArchivedChangesByMaster, master_instance=ticket)
+        self.assertEqual(ar.get_total_count(), ChangeArchive.objects.count())
+        months = [a.month for a in ar]
+        self.assertEqual(months, sorted(months, reverse=True))
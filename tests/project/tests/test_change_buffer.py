@@ -0,0 +1,92 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Tests about the change buffer.  See
+:mod:`lino_noi.lib.noi.change_buffer`.
+
+"""
+
+from __future__ import unicode_literals
+
+from django.core.signals import request_finished
+from django.db import connection, transaction
+
+from lino.api import rt
+from lino.core.diff import ChangeWatcher
+from lino.modlib.users.choicelists import UserTypes
+from lino.utils.djangotest import RemoteAuthTestCase
+
+from lino_noi.lib.noi.change_buffer import (
+    install_change_buffer, uninstall_change_buffer)
+
+
+def run_on_commit():
+    # a test case never commits, so we run the callbacks ourselves
+    callbacks = connection.run_on_commit
+    connection.run_on_commit = []
+    for sids, func in callbacks:
+        func()
+
+
+class TestCase(RemoteAuthTestCase):
+    maxDiff = None
+
+    def setUp(self):
+        super(TestCase, self).setUp()
+        install_change_buffer(
+            60, 100, [rt.models.tickets.Ticket, rt.models.comments.Comment])
+
+    def tearDown(self):
+        uninstall_change_buffer()
+        super(TestCase, self).tearDown()
+
+    def edit(self, ar, obj, **values):
+        cw = ChangeWatcher(obj)
+        for k, v in values.items():
+            setattr(obj, k, v)
+        obj.save()
+        cw.send_update(ar)
+
+    def test_coalesce(self):
+        User = rt.models.users.User
+        Ticket = rt.models.tickets.Ticket
+        Change = rt.models.changes.Change
+
+        robin = User.objects.create(
+            username='robin', user_type=UserTypes.admin)
+        ticket = Ticket.objects.create(summary="Foo", user=robin)
+        ar = rt.login('robin')
+
+        self.edit(ar, ticket, summary="Bar")
+        self.edit(ar, ticket, summary="Baz")
+        run_on_commit()
+        self.assertEqual(Change.objects.count(), 0)
+        request_finished.send(sender=None)
+        self.assertEqual(Change.objects.count(), 1)
+
+        # a second request within the time window updates the same record
+        self.edit(ar, ticket, description="Hello")
+        run_on_commit()
+        request_finished.send(sender=None)
+        self.assertEqual(Change.objects.count(), 1)
+        c = Change.objects.get()
+        self.assertEqual(c.changed_fields, "summary description ")
+        self.assertEqual(
+            c.diff, "- summary : Foo --> Baz\n- description :  --> Hello")
+
+    def test_rollback(self):
+        User = rt.models.users.User
+        Ticket = rt.models.tickets.Ticket
+        Change = rt.models.changes.Change
+
+        robin = User.objects.create(
+            username='robin', user_type=UserTypes.admin)
+        ticket = Ticket.objects.create(summary="Foo", user=robin)
+        ar = rt.login('robin')
+
+        with transaction.atomic():
+            self.edit(ar, ticket, summary="Bar")
+            transaction.set_rollback(True)
+        run_on_commit()
+        request_finished.send(sender=None)
+        self.assertEqual(Change.objects.count(), 0)
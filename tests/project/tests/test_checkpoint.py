@@ -0,0 +1,102 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Tests about resuming the restore of a Python dump.  See
+:mod:`lino_noi.lib.noi.checkpoint`.
+
+"""
+
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+
+from lino.api import rt
+from lino.utils.djangotest import RemoteAuthTestCase
+
+from lino_noi.lib.noi.checkpoint import ResumableRestore
+
+RESTORE_PY = """
+from __future__ import unicode_literals
+import six
+from django.conf import settings
+from lino.core.utils import resolve_model
+SOURCE_VERSION = {version!r}
+tickets_Site = resolve_model("tickets.Site")
+executed = []
+
+def execfile(fn, *args):
+    six.exec_(compile(open(fn, "rb").read(), fn, 'exec'), *args)
+
+def main(args):
+    args = (globals(), locals())
+    execfile("tickets_site_1.py", *args)
+    execfile("tickets_site_2.py", *args)
+    execfile("tickets_site_3.py", *args)
+"""
+
+DUMP_FILE = """
+executed.append({fn!r})
+loader.save(tickets_Site(id={pk}, name="site{pk}"))
+"""
+
+
+class TestCase(RemoteAuthTestCase):
+    maxDiff = None
+
+    def setUp(self):
+        super(TestCase, self).setUp()
+        self.cwd = os.getcwd()
+        self.dump_dir = tempfile.mkdtemp()
+        self.write('restore.py', RESTORE_PY.format(
+            version=settings.SITE.version))
+        for pk in (1, 2, 3):
+            fn = 'tickets_site_{}.py'.format(pk)
+            self.write(fn, DUMP_FILE.format(fn=fn, pk=pk))
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dump_dir)
+        settings.SITE.loading_from_dump = False
+        super(TestCase, self).tearDown()
+
+    def write(self, fn, content):
+        with open(os.path.join(self.dump_dir, fn), 'w') as f:
+            f.write(content)
+
+    def test_resume(self):
+        Site = rt.models.tickets.Site
+        RestoreProgress = rt.models.noi.RestoreProgress
+        flushed = []
+        fn = os.path.join(self.dump_dir, 'restore.py')
+
+        # the middle file fails
+        self.write('tickets_site_2.py', 'raise Exception("Oops")\n')
+        r = ResumableRestore(fn)
+        with self.assertRaises(Exception):
+            r.run(initdb=lambda: flushed.append(True))
+        self.assertEqual(flushed, [True])
+        self.assertEqual(list(Site.objects.values_list('id', flat=True)), [1])
+        self.assertEqual(
+            list(RestoreProgress.objects.values_list('filename', flat=True)),
+            ['tickets_site_1.py'])
+
+        # run it again after fixing the file
+        self.write('tickets_site_2.py', DUMP_FILE.format(
+            fn='tickets_site_2.py', pk=2))
+        r = ResumableRestore(fn)
+        r.run(initdb=lambda: flushed.append(True))
+        # the database has not been flushed again
+        self.assertEqual(flushed, [True])
+        # the committed file has been skipped
+        self.assertEqual(
+            r.globals_dict['executed'],
+            ['tickets_site_2.py', 'tickets_site_3.py'])
+        self.assertEqual(
+            sorted(Site.objects.values_list('id', flat=True)), [1, 2, 3])
+        self.assertEqual(RestoreProgress.objects.count(), 3)
+        p = RestoreProgress.objects.get(filename='tickets_site_3.py')
+        self.assertEqual((p.table, p.part, p.rows), ('tickets_site', 3, 1))
@@ -0,0 +1,120 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Tests about the full-text search of tickets.
+
+"""
+
+from __future__ import unicode_literals
+
+import re
+
+from django.db import connection, transaction
+
+from lino.api import dd, rt
+from lino.modlib.users.choicelists import UserTypes
+from lino.utils.djangotest import RemoteAuthTestCase
+
+
+def run_on_commit():
+    # a test case never commits, so we run the callbacks ourselves
+    callbacks = connection.run_on_commit
+    connection.run_on_commit = []
+    for sids, func in callbacks:
+        func()
+
+
+class TestCase(RemoteAuthTestCase):
+    maxDiff = None
+
+    def setUp(self):
+        super(TestCase, self).setUp()
+        dd.plugins.tickets.use_fulltext = True
+        dd.plugins.tickets.get_fulltext_backend().clear()
+
+    def tearDown(self):
+        dd.plugins.tickets.use_fulltext = False
+        dd.plugins.public.index_page_size = 50
+        super(TestCase, self).tearDown()
+
+    def search(self, text):
+        ar = rt.login('robin').spawn(
+            rt.models.tickets.AllTickets, quick_search=text)
+        return [obj.pk for obj in ar.data_iterator]
+
+    def test_ranking(self):
+        User = rt.models.users.User
+        Ticket = rt.models.tickets.Ticket
+
+        robin = User.objects.create(
+            username='robin', user_type=UserTypes.admin)
+        t1 = Ticket.objects.create(
+            summary="Printer is broken", user=robin)
+        t2 = Ticket.objects.create(
+            summary="Cannot work", description="<p>The printer is off</p>",
+            user=robin)
+        Ticket.objects.create(summary="Something else", user=robin)
+        run_on_commit()
+
+        # a match in the summary ranks higher than one in the
+        # description, although the tables are sorted by -id
+        search = self.search
+        self.assertEqual(search("printer"), [t1.pk, t2.pk])
+        self.assertEqual(search("off"), [t2.pk])
+        self.assertEqual(search("nothing"), [])
+        self.assertEqual(search(str(t2.pk)), [t2.pk])
+
+        t2.delete()
+        run_on_commit()
+        self.assertEqual(search("printer"), [t1.pk])
+
+    def test_rollback(self):
+        User = rt.models.users.User
+        Ticket = rt.models.tickets.Ticket
+
+        robin = User.objects.create(
+            username='robin', user_type=UserTypes.admin)
+        try:
+            with transaction.atomic():
+                Ticket.objects.create(summary="Printer", user=robin)
+                raise Exception("rollback")
+        except Exception:
+            pass
+        run_on_commit()
+        self.assertEqual(self.search("printer"), [])
+
+    def test_keyset(self):
+        User = rt.models.users.User
+        Ticket = rt.models.tickets.Ticket
+        AllTickets = rt.models.tickets.AllTickets
+
+        robin = User.objects.create(
+            username='robin', user_type=UserTypes.admin)
+        # the newest tickets rank lowest
+        for i in range(7):
+            Ticket.objects.create(
+                summary="printer " + "word " * i, user=robin)
+        run_on_commit()
+        ranked = self.search("printer")
+        self.assertNotEqual(ranked, sorted(ranked, reverse=True))
+
+        # the cursor is ignored for a full-text search
+        kw = AllTickets.parse_req(
+            None, {'after': str(ranked[2])}, quick_search="printer")
+        self.assertNotIn('filter', kw)
+        kw = AllTickets.parse_req(None, {'after': str(ranked[2])})
+        self.assertIn('filter', kw)
+
+        # the public index selects the pages by offset
+        dd.plugins.public.index_page_size = 3
+        url = '/noi/?q=printer'
+        found = []
+        while url:
+            response = self.client.get(url)
+            content = b''.join(response.streaming_content).decode('utf-8')
+            for pk in re.findall(r'ticket/([0-9]+)', content):
+                if int(pk) not in found:
+                    found.append(int(pk))
+            m = re.search(r'href="(\?start=[^"]+)"', content)
+            url = '/noi/' + m.group(1).replace('&amp;', '&') if m else None
+        self.assertEqual(found, ranked)
@@ -0,0 +1,102 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Tests about importing the commits of a local git repository.  See
+:mod:`lino_noi.lib.noi.gitlog`.
+
+"""
+
+from __future__ import unicode_literals
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+from six import StringIO
+
+from django.core.management import call_command
+
+from lino.api import rt
+from lino.modlib.users.choicelists import UserTypes
+from lino.utils.djangotest import RemoteAuthTestCase
+
+from lino_noi.lib.noi.gitlog import run_git
+
+
+class TestCase(RemoteAuthTestCase):
+    maxDiff = None
+
+    def setUp(self):
+        super(TestCase, self).setUp()
+        self.path = tempfile.mkdtemp()
+        run_git(self.path, 'init', '-q')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(TestCase, self).tearDown()
+
+    def commit(self, email, message):
+        env = dict(os.environ)
+        env.update(GIT_AUTHOR_NAME="Someone", GIT_AUTHOR_EMAIL=email,
+                   GIT_COMMITTER_NAME="Someone", GIT_COMMITTER_EMAIL=email)
+        subprocess.check_call(
+            ['git', '-C', self.path, 'commit', '-q', '--allow-empty',
+             '-m', message], env=env)
+        return run_git(self.path, 'rev-parse', 'HEAD')
+
+    def ingest(self):
+        out = StringIO()
+        call_command('ingest_commits', 'foo/bar', self.path, stdout=out)
+        return out.getvalue().strip()
+
+    def test_ingest(self):
+        User = rt.models.users.User
+        Ticket = rt.models.tickets.Ticket
+        Commit = rt.models.github.Commit
+        CommitWatermark = rt.models.noi.CommitWatermark
+
+        robin = User.objects.create(
+            username='robin', user_type=UserTypes.admin,
+            email='robin@example.com')
+        octocat = User.objects.create(
+            username='octocat', user_type=UserTypes.user,
+            github_username='octocat')
+        User.objects.create(
+            username='anna', user_type=UserTypes.user,
+            github_username='anna')
+        t1 = Ticket.objects.create(summary="One", user=robin)
+        t2 = Ticket.objects.create(summary="Two", user=robin)
+
+        s1 = self.commit('robin@example.com', "Fix #{}".format(t1.pk))
+        s2 = self.commit('12345+octocat@users.noreply.github.com',
+                         "Refs #{}".format(t2.pk))
+        # not a noreply address, although anna is a GitHub user name
+        s3 = self.commit('anna@example.org', "No ticket")
+
+        self.assertEqual(self.ingest(), "Imported 3 commits into foo:bar "
+                         "(0 existing commits linked to a ticket).")
+        repo = rt.models.github.Repository.objects.get(
+            user_name='foo', repo_name='bar')
+        wm = CommitWatermark.objects.get(repository_id=repo.pk)
+        self.assertEqual(wm.last_sha, s3)
+
+        commits = dict([(c.sha, (c.ticket_id, c.user_id))
+                        for c in Commit.objects.all()])
+        self.assertEqual(commits, {
+            s1: (t1.pk, robin.pk), s2: (t2.pk, octocat.pk),
+            s3: (None, None)})
+
+        # the second run reads only the new commit
+        s4 = self.commit('robin@example.com', "#{} again".format(t1.pk))
+        self.assertEqual(self.ingest(), "Imported 1 commits into foo:bar "
+                         "(0 existing commits linked to a ticket).")
+        wm = CommitWatermark.objects.get(repository_id=repo.pk)
+        self.assertEqual(wm.last_sha, s4)
+        self.assertEqual(Commit.objects.count(), 4)
+        self.assertEqual(
+            Commit.objects.filter(ticket=t1).count(), 2)
+
+        # nothing new
+        self.assertEqual(self.ingest(), "Imported 0 commits into foo:bar "
+                         "(0 existing commits linked to a ticket).")
@@ -0,0 +1,52 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Tests about the keyset pagination of ticket tables.  See
+:func:`lino_noi.lib.tickets.models.parse_req`.
+
+"""
+
+from __future__ import unicode_literals
+
+from lino.api import rt
+from lino.modlib.users.choicelists import UserTypes
+from lino.utils.djangotest import RemoteAuthTestCase
+
+
+class TestCase(RemoteAuthTestCase):
+    maxDiff = None
+
+    def test_after(self):
+        User = rt.models.users.User
+        Ticket = rt.models.tickets.Ticket
+        AllTickets = rt.models.tickets.AllTickets
+
+        robin = User.objects.create(
+            username='robin', user_type=UserTypes.admin)
+        pks = [Ticket.objects.create(summary=str(i), user=robin).pk
+               for i in range(10)]
+
+        def page(rqdata, **kw):
+            kw = AllTickets.parse_req(None, rqdata, limit=3, **kw)
+            ar = rt.login('robin').spawn(AllTickets, **kw)
+            return [obj.pk for obj in ar.sliced_data_iterator]
+
+        self.assertEqual(page({}), pks[:-4:-1])
+        self.assertEqual(page({'after': str(pks[7])}), pks[6:3:-1])
+        # the offset is ignored
+        self.assertEqual(
+            page({'after': str(pks[7])}, offset=3), pks[6:3:-1])
+
+        # the cursor is ignored in grid requests
+        kw = AllTickets.parse_req(
+            None, {'after': str(pks[7]), 'rp': 'ext-comp-1'}, offset=3)
+        self.assertNotIn('filter', kw)
+        self.assertEqual(kw['offset'], 3)
+
+        # a sort order given by the client disables it
+        kw = AllTickets.parse_req(
+            None, {'after': str(pks[7])}, order_by=['id'])
+        self.assertNotIn('filter', kw)
+
+        with self.assertRaises(Exception):
+            AllTickets.parse_req(None, {'after': 'foo'})
@@ -0,0 +1,50 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Tests about the management commands which run without the lazy
+plugins.  See :attr:`light_commands
+<lino_noi.lib.noi.settings.Site.light_commands>`.
+
+"""
+
+from __future__ import unicode_literals
+
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+
+from lino.utils.djangotest import RemoteAuthTestCase
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestCase(RemoteAuthTestCase):
+    maxDiff = None
+
+    def test_light_process(self):
+        site = settings.SITE
+        old = sys.argv
+        try:
+            sys.argv = ['manage.py', 'ingest_commits']
+            self.assertTrue(site.is_light_process())
+            kw = site.get_apps_modifiers()
+            for k in site.lazy_plugins:
+                self.assertIsNone(kw[k])
+            # these may load printable objects
+            for cmd in ('checkdata', 'linod', 'runserver'):
+                sys.argv = ['manage.py', cmd]
+                self.assertFalse(site.is_light_process())
+        finally:
+            sys.argv = old
+
+    def test_check(self):
+        # runs in a new process, i.e. without the lazy plugins
+        proc = subprocess.Popen(
+            [sys.executable, 'manage.py', 'check'], cwd=PROJECT_DIR,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True)
+        out = proc.communicate()[0]
+        self.assertEqual(proc.returncode, 0, out)
+        self.assertIn("System check identified no issues", out)
@@ -0,0 +1,48 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Tests about the notifications sent to triagers.
+
+"""
+
+from __future__ import unicode_literals
+
+from django.utils import timezone
+
+from lino.api import rt
+from lino.modlib.users.choicelists import UserTypes
+from lino.utils.djangotest import RemoteAuthTestCase
+
+
+class TestCase(RemoteAuthTestCase):
+    maxDiff = None
+
+    def test_notify_triagers(self):
+        User = rt.models.users.User
+        Ticket = rt.models.tickets.Ticket
+        Message = rt.models.notify.Message
+
+        robin = User.objects.create(
+            username='robin', user_type=UserTypes.admin, language='en')
+        User.objects.create(
+            username='luc', user_type=UserTypes.senior, language='en')
+        User.objects.create(
+            username='anna', user_type=UserTypes.user, language='en')
+
+        ses = rt.login('robin')
+        ticket = Ticket.objects.create(summary="Foo", user=robin)
+
+        def recipients():
+            return list(Message.objects.order_by('id').values_list(
+                'user__username', flat=True))
+
+        ticket.notify_triagers(ses)
+        self.assertEqual(recipients(), ['luc'])
+
+        # luc has not yet seen the first message
+        ticket.notify_triagers(ses)
+        self.assertEqual(recipients(), ['luc'])
+
+        Message.objects.update(seen=timezone.now())
+        ticket.notify_triagers(ses)
+        self.assertEqual(recipients(), ['luc', 'luc'])
@@ -0,0 +1,93 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Tests about the number of database queries of the public interface.
+
+"""
+
+from __future__ import unicode_literals
+
+from lino.api import dd, rt
+from lino.modlib.users.choicelists import UserTypes
+from lino.utils.djangotest import RemoteAuthTestCase
+
+
+class TestCase(RemoteAuthTestCase):
+    maxDiff = None
+
+    def setUp(self):
+        super(TestCase, self).setUp()
+        User = rt.models.users.User
+        Ticket = rt.models.tickets.Ticket
+        Site = rt.models.tickets.Site
+        robin = User.objects.create(
+            username='robin', user_type=UserTypes.admin)
+        sites = [Site.objects.create(name="site{}".format(i))
+                 for i in range(3)]
+        for i in range(dd.plugins.public.index_page_size + 5):
+            Ticket.objects.create(
+                summary="Ticket {}".format(i), user=robin,
+                site=sites[i % 3])
+
+    def tearDown(self):
+        dd.plugins.public.max_queries = None
+        super(TestCase, self).tearDown()
+
+    def get_content(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        if response.streaming:
+            return b''.join(response.streaming_content)
+        return response.content
+
+    def test_index(self):
+        # a query per row would exceed this
+        dd.plugins.public.max_queries = 10
+        content = self.get_content('/noi/')
+        self.assertIn(b'Ticket 54', content)
+        self.assertNotIn(b'Ticket 4<', content)
+        self.assertIn(b'?after=', content)
+
+        # the assertion is raised although the response is streamed
+        dd.plugins.public.max_queries = 0
+        with self.assertRaises(AssertionError):
+            self.get_content('/noi/')
+
+    def test_detail(self):
+        ticket = rt.models.tickets.Ticket.objects.first()
+        url = '/noi/ticket/{}/'.format(ticket.pk)
+        dd.plugins.public.max_queries = 10
+        self.get_content(url)
+
+        dd.plugins.public.max_queries = 0
+        with self.assertRaises(AssertionError):
+            self.get_content(url)
+
+    def test_page_cache(self):
+        from django.core.cache import cache
+        Ticket = rt.models.tickets.Ticket
+        ticket = Ticket.objects.first()
+        url = '/noi/ticket/{}/'.format(ticket.pk)
+        dd.plugins.public.page_cache_timeout = 60
+        try:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+            # saving the site of the ticket discards the cached page
+            ticket.site.name = "Renamed site"
+            ticket.site.save()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            etag = response['ETag']
+
+            ticket.user.save()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+        finally:
+            dd.plugins.public.page_cache_timeout = None
+            cache.clear()
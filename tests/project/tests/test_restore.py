@@ -0,0 +1,59 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Tests about restoring a Python dump in bulk.  See
+:func:`lino_noi.lib.noi.bulkload.install_bulk_loader`.
+
+"""
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+
+from lino.api import rt
+from lino.modlib.users.choicelists import UserTypes
+from lino.utils.djangotest import RemoteAuthTestCase
+from lino.utils.dpy import DpyLoader
+
+
+class TestCase(RemoteAuthTestCase):
+    maxDiff = None
+
+    def setUp(self):
+        super(TestCase, self).setUp()
+        settings.SITE.bulk_load_batch_size = 100
+
+    def tearDown(self):
+        settings.SITE.bulk_load_batch_size = None
+        settings.SITE.loading_from_dump = False
+        super(TestCase, self).tearDown()
+
+    def test_deferred(self):
+        User = rt.models.users.User
+        Ticket = rt.models.tickets.Ticket
+        Site = rt.models.tickets.Site
+
+        # what a restore.py does
+        loader = DpyLoader(dict(
+            SOURCE_VERSION=settings.SITE.version, settings=settings))
+        self.assertTrue(settings.SITE.loading_from_dump)
+        self.assertIsNotNone(loader.bulk)
+
+        loader.save(User(id=1, username='robin', user_type=UserTypes.admin))
+        loader.flush_deferred_objects()
+
+        # the tickets come before the sites they point to
+        loader.save(Ticket(id=1, summary="Foo", user_id=1, site_id=1))
+        loader.save(Ticket(id=2, summary="Bar", user_id=1))
+        loader.flush_deferred_objects()
+        self.assertEqual(Ticket.objects.count(), 1)
+        self.assertEqual(len(loader.save_later[Ticket]), 1)
+
+        loader.save(Site(id=1, name="site"))
+        loader.flush_deferred_objects()
+        loader.finalize()
+
+        self.assertEqual(loader.save_later, {})
+        self.assertEqual(Ticket.objects.count(), 2)
+        self.assertEqual(Ticket.objects.get(pk=1).site_id, 1)
+        self.assertEqual(loader.bulk.pending, {})
@@ -0,0 +1,29 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Tests about the role index.
+
+"""
+
+from __future__ import unicode_literals
+
+from lino.api import rt
+from lino.modlib.users.choicelists import UserTypes
+from lino.utils.djangotest import RemoteAuthTestCase
+from lino_xl.lib.tickets.roles import Triager
+
+from lino_noi.lib.noi.roles import get_user_types_with_role, has_role
+
+
+class TestCase(RemoteAuthTestCase):
+    maxDiff = None
+
+    def test_extended_user_types(self):
+        # the test project adds a user type after importing those of
+        # Lino Noi
+        self.assertEqual(
+            sorted(get_user_types_with_role(Triager)),
+            ['450', '490', '900'])
+        rt.models.users.User.objects.create(
+            username='tom', user_type=UserTypes.triager)
+        self.assertTrue(has_role(rt.login('tom'), Triager))
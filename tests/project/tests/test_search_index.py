@@ -0,0 +1,61 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Tests about the :class:`TicketSearchIndex
+<lino_noi.lib.tickets.models.TicketSearchIndex>`.
+
+"""
+
+from __future__ import unicode_literals
+
+from lino.api import dd, rt
+from lino.modlib.users.choicelists import UserTypes
+from lino.utils.djangotest import RemoteAuthTestCase
+
+
+class TestCase(RemoteAuthTestCase):
+    maxDiff = None
+
+    def setUp(self):
+        super(TestCase, self).setUp()
+        dd.plugins.tickets.use_search_index = True
+
+    def tearDown(self):
+        dd.plugins.tickets.use_search_index = False
+        super(TestCase, self).tearDown()
+
+    def test_plain_save(self):
+        User = rt.models.users.User
+        Ticket = rt.models.tickets.Ticket
+        Site = rt.models.tickets.Site
+        Company = rt.models.contacts.Company
+        TicketSearchIndex = rt.models.tickets.TicketSearchIndex
+        TicketStates = rt.models.tickets.TicketStates
+
+        robin = User.objects.create(
+            username='robin', user_type=UserTypes.admin)
+        foo = Company.objects.create(name="Foo")
+        bar = Company.objects.create(name="Bar")
+        site = Site.objects.create(name="site", company=foo)
+        ticket = Ticket.objects.create(summary="Foo", user=robin, site=site)
+
+        idx = TicketSearchIndex.objects.get(ticket=ticket)
+        self.assertEqual(idx.assigned_to_id, None)
+        self.assertEqual(idx.company_id, foo.pk)
+        self.assertEqual(idx.state, TicketStates.new)
+
+        ticket.assigned_to = robin
+        ticket.state = TicketStates.closed
+        ticket.save()
+        idx = TicketSearchIndex.objects.get(ticket=ticket)
+        self.assertEqual(idx.assigned_to_id, robin.pk)
+        self.assertEqual(idx.state, TicketStates.closed)
+        self.assertFalse(idx.active)
+
+        site.company = bar
+        site.save()
+        idx = TicketSearchIndex.objects.get(ticket=ticket)
+        self.assertEqual(idx.company_id, bar.pk)
+
+        ticket.delete()
+        self.assertEqual(TicketSearchIndex.objects.count(), 0)
@@ -0,0 +1,92 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Tests about the ticket statistics of sites.  See
+:mod:`lino_noi.lib.tickets.stats`.
+
+"""
+
+from __future__ import unicode_literals
+
+from lino.api import dd, rt
+from lino.modlib.users.choicelists import UserTypes
+from lino.utils.djangotest import RemoteAuthTestCase
+from lino.utils.quantities import Duration
+
+FIELDS = ('ticket_states', 'open_planned_time', 'last_ticket_activity')
+
+
+class TestCase(RemoteAuthTestCase):
+    maxDiff = None
+
+    def tearDown(self):
+        dd.plugins.tickets.use_site_stats = False
+        super(TestCase, self).tearDown()
+
+    def test_stats(self):
+        User = rt.models.users.User
+        Ticket = rt.models.tickets.Ticket
+        Site = rt.models.tickets.Site
+        TicketStates = rt.models.tickets.TicketStates
+
+        robin = User.objects.create(
+            username='robin', user_type=UserTypes.admin)
+        site = Site.objects.create(name="site")
+        Ticket.objects.create(
+            summary="One", user=robin, site=site,
+            planned_time=Duration('1:00'))
+        Ticket.objects.create(
+            summary="Two", user=robin, site=site,
+            planned_time=Duration('2:00'), state=TicketStates.closed)
+
+        def values(obj):
+            return [Site.get_data_elem(name).value_from_object(obj)
+                    for name in FIELDS]
+
+        # computed once per row
+        obj = Site.objects.get(pk=site.pk)
+        computed = values(obj)
+        with self.assertNumQueries(0):
+            self.assertEqual(values(obj), computed)
+        self.assertEqual(str(computed[1]), '1:00')
+
+        # materialised
+        dd.plugins.tickets.use_site_stats = True
+        obj = Site.objects.select_related('ticket_stats').get(pk=site.pk)
+        self.assertEqual(values(obj), computed)
+
+    def test_last_activity(self):
+        User = rt.models.users.User
+        Ticket = rt.models.tickets.Ticket
+        Site = rt.models.tickets.Site
+        SiteTicketStats = rt.models.tickets.SiteTicketStats
+        checker = rt.models.tickets.SiteTicketStatsChecker.self
+
+        dd.plugins.tickets.use_site_stats = True
+        robin = User.objects.create(
+            username='robin', user_type=UserTypes.admin)
+        site = Site.objects.create(name="site")
+        other = Site.objects.create(name="other")
+        first = Ticket.objects.create(summary="One", user=robin, site=site)
+        second = Ticket.objects.create(summary="Two", user=robin, site=site)
+        third = Ticket.objects.create(summary="Three", user=robin, site=site)
+
+        def last_activity(obj):
+            return SiteTicketStats.objects.get(site=obj).last_activity
+
+        self.assertEqual(last_activity(site), third.modified)
+
+        # deleting the last modified ticket
+        third.delete()
+        self.assertEqual(last_activity(site), second.modified)
+
+        # moving the last modified ticket to another site
+        second = Ticket.objects.get(pk=second.pk)
+        second.site = other
+        second.save()
+        self.assertEqual(last_activity(site), first.modified)
+        self.assertEqual(last_activity(other), second.modified)
+
+        for obj in (site, other):
+            obj = Site.objects.get(pk=obj.pk)
+            self.assertEqual(list(checker.get_checkdata_problems(obj)), [])
@@ -0,0 +1,39 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Tests about the key of the demo database snapshots.
+
+"""
+
+from __future__ import unicode_literals
+
+import datetime
+
+from lino.api import dd
+from lino.utils.djangotest import RemoteAuthTestCase
+
+from lino_noi.lib.noi.snapshot import get_snapshot_key
+
+
+class TestCase(RemoteAuthTestCase):
+    maxDiff = None
+
+    def test_key(self):
+        site = dd.plugins.tickets.site
+        key = get_snapshot_key()
+        self.assertEqual(get_snapshot_key(), key)
+
+        old = site.the_demo_date
+        site.the_demo_date = datetime.date(2015, 5, 23)
+        try:
+            self.assertNotEqual(get_snapshot_key(), key)
+        finally:
+            site.the_demo_date = old
+        self.assertEqual(get_snapshot_key(), key)
+
+        dd.plugins.tickets.use_search_index = True
+        try:
+            self.assertNotEqual(get_snapshot_key(), key)
+        finally:
+            dd.plugins.tickets.use_search_index = False
+        self.assertEqual(get_snapshot_key(), key)
@@ -0,0 +1,60 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Tests about the startup profiler.  See
+:mod:`lino_noi.lib.noi.startup_profile`.
+
+"""
+
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from lino.utils.djangotest import RemoteAuthTestCase
+
+from lino_noi.lib.noi.startup_profile import ENV_VAR
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestCase(RemoteAuthTestCase):
+    maxDiff = None
+
+    def test_report(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fn = os.path.join(tmpdir, 'startup.json')
+            env = dict(os.environ)
+            env[ENV_VAR] = fn
+            proc = subprocess.Popen(
+                [sys.executable, 'manage.py', 'check'], cwd=PROJECT_DIR,
+                env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                universal_newlines=True)
+            out = proc.communicate()[0]
+            self.assertEqual(proc.returncode, 0, out)
+            with open(fn) as f:
+                report = json.load(f)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        events = report['traceEvents']
+        names = set([ev['name'] for ev in events])
+        for name in ('Site.__init__', 'load_plugins', 'setup_plugins',
+                     'do_site_startup', 'watch_changes', 'startup'):
+            self.assertIn(name, names)
+        self.assertIn('tickets.on_site_startup', names)
+        for ev in events:
+            self.assertEqual(ev['ph'], 'X')
+            self.assertTrue(ev['dur'] >= 0)
+        if sys.version_info >= (3, 4):
+            # the imports are recorded from the start
+            self.assertIn('lino.projects.std.settings', names)
+
+        data = report['otherData']
+        self.assertIn('do_site_startup', data['phases_ms'])
+        self.assertIn('tickets', data['plugins_ms'])
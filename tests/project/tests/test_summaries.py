@@ -0,0 +1,144 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Tests about the incremental maintenance of the working time
+summaries.  See :mod:`lino_noi.lib.tickets.summaries`.
+
+"""
+
+from __future__ import unicode_literals
+
+import datetime
+
+from lino.api import dd, rt
+from lino.modlib.users.choicelists import UserTypes
+from lino.utils.djangotest import RemoteAuthTestCase
+from lino.utils.quantities import Duration
+
+from lino_noi.lib.tickets import summaries
+
+
+class TestCase(RemoteAuthTestCase):
+    maxDiff = None
+
+    def setUp(self):
+        super(TestCase, self).setUp()
+        dd.plugins.tickets.use_incremental_summaries = True
+
+    def tearDown(self):
+        dd.plugins.tickets.use_incremental_summaries = False
+        super(TestCase, self).tearDown()
+
+    def test_summaries(self):
+        User = rt.models.users.User
+        Ticket = rt.models.tickets.Ticket
+        Site = rt.models.tickets.Site
+        Session = rt.models.working.Session
+        SiteSummary = rt.models.working.SiteSummary
+        TicketStates = rt.models.tickets.TicketStates
+        hours = dd.plugins.working.default_reporting_type.name + '_hours'
+
+        robin = User.objects.create(
+            username='robin', user_type=UserTypes.admin)
+        site = Site.objects.create(name="site")
+        SiteSummary.get_for_period(site, None, None).compute_summary_values()
+
+        def summary():
+            s = SiteSummary.objects.get(master=site, year__isnull=True)
+            return (s.active_tickets, s.inactive_tickets,
+                    str(getattr(s, hours)))
+
+        ticket = Ticket.objects.create(summary="Foo", user=robin, site=site)
+        self.assertEqual(summary(), (1, 0, '0:00'))
+
+        ticket.state = TicketStates.closed
+        ticket.save()
+        self.assertEqual(summary(), (0, 1, '0:00'))
+
+        session = Session.objects.create(
+            user=robin, ticket=ticket,
+            start_date=datetime.date(2018, 5, 23),
+            start_time=datetime.time(9, 0), end_time=datetime.time(10, 30))
+        self.assertEqual(summary(), (0, 1, '1:30'))
+        # the *_hours fields of the ticket are not maintained
+        self.assertEqual(
+            getattr(Ticket.objects.get(pk=ticket.pk), hours), None)
+
+        # only the needed columns are read, in a single query
+        with self.assertNumQueries(1):
+            c = summaries.get_original_contributions(session)
+        self.assertEqual(c, {
+            ((site.pk, None, None), hours): Duration('1:30'),
+            ((site.pk, 2018, None), hours): Duration('1:30')})
+
+        session.end_time = datetime.time(11, 0)
+        session.save()
+        self.assertEqual(summary(), (0, 1, '2:00'))
+
+        session.delete()
+        ticket.delete()
+        self.assertEqual(summary(), (0, 0, '0:00'))
+
+    def test_move_ticket(self):
+        User = rt.models.users.User
+        Ticket = rt.models.tickets.Ticket
+        Site = rt.models.tickets.Site
+        Session = rt.models.working.Session
+        SiteSummary = rt.models.working.SiteSummary
+        DirtySummary = rt.models.tickets.DirtySummary
+        ReportingTypes = rt.models.working.ReportingTypes
+        hours = dd.plugins.working.default_reporting_type.name + '_hours'
+
+        robin = User.objects.create(
+            username='robin', user_type=UserTypes.admin)
+        old_site = Site.objects.create(name="old")
+        new_site = Site.objects.create(name="new")
+        ticket = Ticket.objects.create(
+            summary="Foo", user=robin, site=old_site)
+        for year in (2017, 2018):
+            Session.objects.create(
+                user=robin, ticket=ticket,
+                start_date=datetime.date(year, 5, 23),
+                start_time=datetime.time(9, 0),
+                end_time=datetime.time(10, 0))
+        for site in (old_site, new_site):
+            for year in (None, 2017, 2018):
+                SiteSummary.get_for_period(
+                    site, year, None).compute_summary_values()
+        # the rows did not exist when the sessions were created
+        DirtySummary.objects.all().delete()
+
+        def summary(site, year=None, name=hours):
+            s = SiteSummary.objects.get(master=site, year=year)
+            return str(getattr(s, name))
+
+        self.assertEqual(summary(old_site), '2:00')
+        self.assertEqual(summary(old_site, 2017), '1:00')
+        self.assertEqual(summary(new_site), '0:00')
+
+        ticket.site = new_site
+        ticket.save()
+        self.assertEqual(
+            sorted(DirtySummary.objects.values_list('site_id', 'year')),
+            [(old_site.pk, 2017), (old_site.pk, 2018),
+             (new_site.pk, 2017), (new_site.pk, 2018)])
+
+        summaries.update_dirty_summaries()
+        self.assertEqual(DirtySummary.objects.count(), 0)
+        self.assertEqual(summary(old_site), '0:00')
+        self.assertEqual(summary(old_site, 2018), '0:00')
+        self.assertEqual(summary(new_site), '2:00')
+        self.assertEqual(summary(new_site, 2017), '1:00')
+        self.assertEqual(summary(new_site, 2018), '1:00')
+
+        # the hours of a site move to another reporting type
+        extra = ReportingTypes.extra
+        self.assertNotEqual(extra, dd.plugins.working.default_reporting_type)
+        new_site.reporting_type = extra
+        new_site.save()
+        self.assertEqual(
+            sorted(DirtySummary.objects.values_list('site_id', 'year')),
+            [(new_site.pk, 2017), (new_site.pk, 2018)])
+        summaries.update_dirty_summaries()
+        self.assertEqual(summary(new_site), '0:00')
+        self.assertEqual(summary(new_site, 2018, 'extra_hours'), '1:00')
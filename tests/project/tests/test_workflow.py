@@ -0,0 +1,63 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""Tests about changing the state of several tickets at once.
+
+"""
+
+from __future__ import unicode_literals
+
+from lino.api import dd, rt
+from lino.modlib.users.choicelists import UserTypes
+from lino.utils.djangotest import RemoteAuthTestCase
+
+from lino_noi.lib.tickets.signals import tickets_state_changed
+
+
+class TestCase(RemoteAuthTestCase):
+    maxDiff = None
+
+    def setUp(self):
+        super(TestCase, self).setUp()
+        dd.plugins.tickets.use_search_index = True
+
+    def tearDown(self):
+        dd.plugins.tickets.use_search_index = False
+        super(TestCase, self).tearDown()
+
+    def test_execute_many(self):
+        User = rt.models.users.User
+        Ticket = rt.models.tickets.Ticket
+        TicketStates = rt.models.tickets.TicketStates
+        TicketSearchIndex = rt.models.tickets.TicketSearchIndex
+        AllTickets = rt.models.tickets.AllTickets
+
+        robin = User.objects.create(
+            username='robin', user_type=UserTypes.admin)
+        t1 = Ticket.objects.create(summary="One", user=robin)
+        t2 = Ticket.objects.create(summary="Two", user=robin)
+        t3 = Ticket.objects.create(
+            summary="Three", user=robin, state=TicketStates.opened)
+
+        received = []
+
+        def receiver(sender=None, changes=None, **kw):
+            received.append(sorted(
+                [(obj.pk, old.name) for obj, old in changes]))
+
+        tickets_state_changed.connect(receiver)
+        try:
+            ba = AllTickets.get_action_by_name('mark_opened')
+            ar = ba.request_from(rt.login('robin'))
+            ba.action.execute_many(ar, [t1, t2, t3])
+        finally:
+            tickets_state_changed.disconnect(receiver)
+
+        # t3 was already opened
+        self.assertEqual(received, [[(t1.pk, 'new'), (t2.pk, 'new')]])
+        for t in (t1, t2, t3):
+            self.assertEqual(
+                Ticket.objects.get(pk=t.pk).state, TicketStates.opened)
+            self.assertEqual(
+                TicketSearchIndex.objects.get(ticket=t).state,
+                TicketStates.opened)
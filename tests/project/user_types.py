@@ -0,0 +1,11 @@
+# -*- coding: UTF-8 -*-
+# Copyright 2018 Rumma & Ko Ltd
+# License: BSD (see file COPYING for details)
+"""The user types of the test project: those of Lino Noi plus a
+triager.
+
+"""
+
+from lino_noi.lib.noi.user_types import *
+
+add('450', _("Triager"), Senior, 'triager')